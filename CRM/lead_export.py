@@ -0,0 +1,99 @@
+from CRM.odoo_api_calls import (
+    url_demo,
+    db_demo,
+    username_demo,
+    password_demo,
+    get_client,
+)
+
+# Only the columns analytics needs; description and chatter stay in Odoo
+EXPORT_FIELDS = [
+    "id",
+    "name",
+    "create_date",
+    "write_date",
+    "active",
+    "stage_id",
+    "user_id",
+    "priority",
+    "tag_ids",
+    "partner_name",
+    "contact_name",
+    "phone",
+    "email_from",
+    "street",
+]
+
+
+def iter_changed_leads(
+    client, cursor=None, fields=EXPORT_FIELDS, page_size=500, include_archived=True
+):
+    """
+    Yield pages of crm.lead changed after cursor, oldest write_date first.
+
+    cursor is (write_date, id) of the last exported lead, or None for a full export. Pages
+    use keyset pagination on (write_date, id) instead of offsets, so leads written during the
+    export are neither skipped nor repeated, and leads sharing one write_date (bulk writes)
+    are paged by id. Archived leads are included by default so a rerun sees them change.
+    """
+    kwargs = {"fields": fields, "limit": page_size}
+    if include_archived:
+        kwargs["context"] = {"active_test": False}
+    write_date, last_id = cursor or (None, None)
+    while True:
+        if write_date is not None:
+            # Leads left at the same write_date as the cursor
+            while True:
+                page = client.execute_kw(
+                    "crm.lead",
+                    "search_read",
+                    [[("write_date", "=", write_date), ("id", ">", last_id)]],
+                    {**kwargs, "order": "id asc"},
+                )
+                if page:
+                    last_id = page[-1]["id"]
+                    yield page
+                if len(page) < page_size:
+                    break
+
+        domain = [("write_date", ">", write_date)] if write_date is not None else []
+        page = client.execute_kw(
+            "crm.lead",
+            "search_read",
+            [domain],
+            {**kwargs, "order": "write_date asc, id asc"},
+        )
+        if page:
+            write_date, last_id = page[-1]["write_date"], page[-1]["id"]
+            yield page
+        if len(page) < page_size:
+            return
+
+
+# Odoo returns False for empty fields, [id, name] for many2one and [ids] for many2many
+def flatten_lead(lead):
+    row = {}
+    for field, value in lead.items():
+        if field in ("stage_id", "user_id"):
+            row[field] = value[0] if value else None
+            row[field.replace("_id", "_name")] = value[1] if value else None
+        elif field == "tag_ids":
+            row[field] = ",".join(map(str, value)) if value else None
+        elif field == "active":
+            row[field] = bool(value)
+        else:
+            row[field] = None if value is False else value
+    return row
+
+
+def export_changed_leads(
+    cursor=None,
+    page_size=500,
+    url=url_demo,
+    db=db_demo,
+    username=username_demo,
+    password=password_demo,
+):
+    client = get_client(url, db, username, password)
+    for page in iter_changed_leads(client, cursor=cursor, page_size=page_size):
+        yield [flatten_lead(lead) for lead in page]
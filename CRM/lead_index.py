@@ -0,0 +1,262 @@
+import re
+import threading
+import time
+import unicodedata
+import xmlrpc.client
+
+from CRM.lead_export import iter_changed_leads
+from CRM.odoo_api_calls import (
+    url_demo,
+    db_demo,
+    username_demo,
+    password_demo,
+    get_client,
+    create_lead_full_data,
+    is_missing_record,
+    update_lead,
+)
+
+_INDEX_FIELDS = ["id", "phone", "email_from", "partner_name", "write_date", "active"]
+
+
+# Keep the last 10 digits so "+52 1 81 1234 5678", "81-1234-5678" and "8112345678" match
+def normalize_phone(phone):
+    if not phone:
+        return None
+    digits = re.sub(r"\D", "", str(phone))
+    if len(digits) < 7:
+        return None
+    return digits[-10:]
+
+
+def normalize_email(email):
+    if not email:
+        return None
+    email = str(email).strip().lower()
+    return email if "@" in email else None
+
+
+# Case, accents, punctuation and spacing are ignored: "Industrial García S.A. de C.V."
+# and "industrial garcia sa de cv" are the same partner
+def normalize_partner_name(partner_name):
+    if not partner_name:
+        return None
+    text = unicodedata.normalize("NFKD", str(partner_name))
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    text = re.sub(r"[^\w\s]", "", text.casefold())
+    text = " ".join(text.split())
+    return text or None
+
+
+class LeadIndex:
+    """
+    Local index of crm.lead by normalized phone, email and partner name.
+
+    Filled once with paginated search_read and refreshed incrementally from a
+    (write_date, id) cursor, so finding an existing lead is a dictionary lookup instead
+    of a search RPC.
+    """
+
+    def __init__(self, client, page_size=500, refresh_interval=60):
+        self.client = client
+        self.page_size = page_size
+        self.refresh_interval = refresh_interval
+
+        self._by_phone = {}
+        self._by_email = {}
+        self._by_partner = {}
+        self._keys_by_id = {}
+        self._cursor = None  # (write_date, id) of the last lead read from Odoo
+        self._last_sync = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._keys_by_id)
+
+    # Full load the first time, afterwards only leads changed after the cursor. Keyset
+    # pages (see iter_changed_leads) do not skip leads written while the sync runs, which
+    # offset paging over a moving write_date filter would. The full load skips archived
+    # leads; incremental syncs read them too so a lead archived in Odoo leaves the index.
+    def sync(self):
+        with self._lock:
+            fetched = 0
+            for page in iter_changed_leads(
+                self.client,
+                cursor=self._cursor,
+                fields=_INDEX_FIELDS,
+                page_size=self.page_size,
+                include_archived=self._cursor is not None,
+            ):
+                for lead in page:
+                    if lead.get("active", True):
+                        self._add(lead)
+                    else:
+                        self._remove(lead["id"])
+                fetched += len(page)
+                self._cursor = (page[-1]["write_date"], page[-1]["id"])
+
+            self._last_sync = time.monotonic()
+            return fetched
+
+    # Sync again only if the index is older than refresh_interval seconds
+    def refresh(self):
+        if (
+            self._last_sync is None
+            or time.monotonic() - self._last_sync >= self.refresh_interval
+        ):
+            self.sync()
+
+    def _add(self, lead):
+        lead_id = lead["id"]
+        self._remove(lead_id)
+
+        keys = (
+            normalize_phone(lead.get("phone")),
+            normalize_email(lead.get("email_from")),
+            normalize_partner_name(lead.get("partner_name")),
+        )
+        for mapping, key in zip((self._by_phone, self._by_email, self._by_partner), keys):
+            if key is not None:
+                mapping[key] = lead_id
+        self._keys_by_id[lead_id] = keys
+
+    def _remove(self, lead_id):
+        keys = self._keys_by_id.pop(lead_id, None)
+        if keys is None:
+            return
+        for mapping, key in zip((self._by_phone, self._by_email, self._by_partner), keys):
+            if key is not None and mapping.get(key) == lead_id:
+                del mapping[key]
+
+    # Record a lead created or updated locally without waiting for the next sync.
+    # Values left as None keep whatever the index already had for that lead.
+    def add(self, lead_id, phone=None, email_from=None, partner_name=None):
+        with self._lock:
+            previous = self._keys_by_id.get(lead_id, (None, None, None))
+            keys = (
+                normalize_phone(phone) or previous[0],
+                normalize_email(email_from) or previous[1],
+                normalize_partner_name(partner_name) or previous[2],
+            )
+            self._remove(lead_id)
+            for mapping, key in zip(
+                (self._by_phone, self._by_email, self._by_partner), keys
+            ):
+                if key is not None:
+                    mapping[key] = lead_id
+            self._keys_by_id[lead_id] = keys
+
+    # Forget a lead, e.g. after Odoo reports it was deleted
+    def discard(self, lead_id):
+        with self._lock:
+            self._remove(lead_id)
+
+    # Returns the matching lead id or None. Phone wins over email, email over partner name.
+    def find(self, phone=None, email_from=None, partner_name=None):
+        candidates = (
+            (self._by_phone, normalize_phone(phone)),
+            (self._by_email, normalize_email(email_from)),
+            (self._by_partner, normalize_partner_name(partner_name)),
+        )
+        for mapping, key in candidates:
+            if key is not None and key in mapping:
+                return mapping[key]
+        return None
+
+
+# One shared index per Odoo database/user
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_lead_index(url=url_demo, db=db_demo, username=username_demo, password=password_demo):
+    key = (url, db, username, password)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = LeadIndex(get_client(url, db, username, password))
+            _indexes[key] = index
+        return index
+
+
+# Update the existing lead for this contact, or create a new one. Returns the lead id.
+def upsert_lead_full_data(
+    lead_name,
+    phone_number_id,
+    url=url_demo,
+    db=db_demo,
+    username=username_demo,
+    password=password_demo,
+    contact_name=None,
+    email_from=None,
+    partner_name=None,
+    description=None,
+    priority=None,
+    tag_ids=None,
+    street=None,
+    stage_id=None,
+    user_id=None,
+):
+    index = get_lead_index(url, db, username, password)
+    try:
+        index.refresh()
+    except Exception as e:
+        print(f"Could not refresh the lead index, using the cached copy: {e}")
+
+    fields = dict(
+        contact_name=contact_name,
+        email_from=email_from,
+        partner_name=partner_name,
+        description=description,
+        priority=priority,
+        tag_ids=tag_ids,
+        street=street,
+        stage_id=stage_id,
+        user_id=user_id,
+    )
+
+    lead_id = index.find(
+        phone=phone_number_id, email_from=email_from, partner_name=partner_name
+    )
+    if lead_id is not None:
+        print("Existing lead found with ID:", lead_id)
+        try:
+            updated = update_lead(
+                lead_id,
+                url=url,
+                db=db,
+                username=username,
+                password=password,
+                name=lead_name,
+                phone=phone_number_id,
+                **fields,
+            )
+        except xmlrpc.client.Fault as e:
+            # Only a lead deleted in Odoo since the last sync is replaced; any other error
+            # may have left the update applied, and creating would duplicate the lead
+            if not is_missing_record(e):
+                raise
+            print(f"Lead {lead_id} no longer exists, creating a new one: {e}")
+            index.discard(lead_id)
+            lead_id = None
+        else:
+            if not updated:
+                return None
+
+    if lead_id is None:
+        lead_id = create_lead_full_data(
+            lead_name,
+            phone_number_id,
+            url=url,
+            db=db,
+            username=username,
+            password=password,
+            **fields,
+        )
+        if lead_id is None:
+            return None
+
+    index.add(
+        lead_id, phone=phone_number_id, email_from=email_from, partner_name=partner_name
+    )
+    return lead_id
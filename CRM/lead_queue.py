@@ -0,0 +1,312 @@
+import hashlib
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+
+from CRM.odoo_api_calls import create_leads_bulk
+from CRM.lead_index import upsert_lead_full_data
+
+_ACTIONS = ("create", "upsert")
+
+
+# Same payload -> same key, so a double click on "Enviar a CRM" does not create two leads
+def idempotency_key_for(action, payload):
+    canonical = json.dumps([action, payload], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class LeadQueue:
+    """
+    Durable write-behind queue for lead submissions, stored in SQLite.
+
+    enqueue() returns immediately; a background worker sends due submissions to Odoo in
+    batches. Failures are retried with exponential backoff and jitter until max_attempts,
+    after which the submission is marked as failed and kept for inspection or retry().
+    A create whose connection failed after it was sent may already exist in Odoo, so it is
+    not retried automatically: it is marked as unknown until someone checks Odoo and calls
+    retry(). Delivery is at-least-once: a submission interrupted mid-send by a crash is sent
+    again on restart.
+    """
+
+    def __init__(
+        self,
+        path=".cache/odoo_queue.sqlite3",
+        batch_size=50,
+        max_attempts=8,
+        base_delay=2.0,
+        max_delay=300.0,
+        poll_interval=1.0,
+    ):
+        self.path = path
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+
+        self._lock = threading.Lock()
+        self._connection = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _db(self):
+        if self._connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS submissions (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    idempotency_key TEXT NOT NULL UNIQUE,
+                    action TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt REAL NOT NULL,
+                    lead_id INTEGER,
+                    error TEXT,
+                    created REAL NOT NULL,
+                    updated REAL NOT NULL
+                )
+                """
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS idx_submissions_due "
+                "ON submissions (status, next_attempt)"
+            )
+            # Submissions left in "sending" by a crash go back to the queue
+            self._connection.execute(
+                "UPDATE submissions SET status = 'pending' WHERE status = 'sending'"
+            )
+            self._connection.commit()
+        return self._connection
+
+    # Add a submission. payload holds the keyword arguments of create_lead_full_data.
+    # Returns the idempotency key; enqueueing the same key twice keeps the first one.
+    def enqueue(self, payload, action="create", idempotency_key=None):
+        if action not in _ACTIONS:
+            raise ValueError("action must be one of {}".format(_ACTIONS))
+        key = idempotency_key or idempotency_key_for(action, payload)
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            db.execute(
+                "INSERT OR IGNORE INTO submissions "
+                "(idempotency_key, action, payload, status, next_attempt, created, updated) "
+                "VALUES (?, ?, ?, 'pending', ?, ?, ?)",
+                (key, action, json.dumps(payload, ensure_ascii=False), now, now, now),
+            )
+            db.commit()
+        self._wake.set()
+        return key
+
+    def get(self, idempotency_key):
+        with self._lock:
+            row = (
+                self._db()
+                .execute(
+                    "SELECT idempotency_key, action, status, attempts, next_attempt, lead_id, "
+                    "error, created, updated FROM submissions WHERE idempotency_key = ?",
+                    (idempotency_key,),
+                )
+                .fetchone()
+            )
+        return _row_to_item(row) if row else None
+
+    # Claim up to batch_size due submissions by marking them as "sending"
+    def _claim(self):
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            rows = db.execute(
+                "SELECT id, action, payload, attempts FROM submissions "
+                "WHERE status = 'pending' AND next_attempt <= ? "
+                "ORDER BY next_attempt, id LIMIT ?",
+                (now, self.batch_size),
+            ).fetchall()
+            if rows:
+                db.executemany(
+                    "UPDATE submissions SET status = 'sending', updated = ? WHERE id = ?",
+                    [(now, row[0]) for row in rows],
+                )
+                db.commit()
+        return rows
+
+    def _backoff(self, attempts):
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+        return delay * random.uniform(0.5, 1.0)
+
+    def _finish(self, results):
+        # results: [(row id, attempts so far, lead_id or None, error or None, unknown outcome)]
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            for row_id, attempts, lead_id, error, unknown in results:
+                if error is None:
+                    db.execute(
+                        "UPDATE submissions SET status = 'done', attempts = ?, lead_id = ?, "
+                        "error = NULL, updated = ? WHERE id = ?",
+                        (attempts + 1, lead_id, now, row_id),
+                    )
+                    continue
+                attempts += 1
+                if unknown:
+                    status = "unknown"
+                elif attempts >= self.max_attempts:
+                    status = "failed"
+                else:
+                    status = "pending"
+                db.execute(
+                    "UPDATE submissions SET status = ?, attempts = ?, next_attempt = ?, "
+                    "error = ?, updated = ? WHERE id = ?",
+                    (status, attempts, now + self._backoff(attempts), error, now, row_id),
+                )
+            db.commit()
+
+    # Send one batch of due submissions. Returns how many were attempted.
+    def process_once(self):
+        rows = self._claim()
+        if not rows:
+            return 0
+
+        results = []
+        creates = [row for row in rows if row[1] == "create"]
+        if creates:
+            try:
+                outcome = create_leads_bulk([json.loads(row[2]) for row in creates])
+            except Exception as e:
+                # create_leads_bulk reports failures per record; an exception escaping it
+                # may come after Odoo committed the leads
+                outcome = {
+                    i: {"id": None, "error": str(e), "unknown": True}
+                    for i in range(len(creates))
+                }
+            for index, (row_id, _, _, attempts) in enumerate(creates):
+                result = outcome.get(index) or {"id": None, "error": "No result from Odoo"}
+                error = result.get("error")
+                if error is None and result.get("id") is None:
+                    error = "Odoo did not return a lead id"
+                results.append(
+                    (row_id, attempts, result.get("id"), error, bool(result.get("unknown")))
+                )
+
+        for row_id, action, payload, attempts in rows:
+            if action != "upsert":
+                continue
+            try:
+                lead_id = upsert_lead_full_data(**json.loads(payload))
+                error = None if lead_id is not None else "Odoo did not return a lead id"
+            except Exception as e:
+                lead_id, error = None, str(e)
+            results.append((row_id, attempts, lead_id, error, False))
+
+        self._finish(results)
+        return len(rows)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if self.process_once():
+                    continue  # There may be more due submissions
+            except Exception as e:
+                print(f"Lead queue worker error: {e}")
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="odoo-lead-queue", daemon=True
+            )
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    # Send a failed submission again on the next pass. For an unknown one, check first that
+    # the lead is not already in Odoo.
+    def retry(self, idempotency_key):
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            cursor = db.execute(
+                "UPDATE submissions SET status = 'pending', attempts = 0, next_attempt = ?, "
+                "updated = ? WHERE idempotency_key = ? AND status IN ('failed', 'unknown')",
+                (now, now, idempotency_key),
+            )
+            db.commit()
+        self._wake.set()
+        return cursor.rowcount > 0
+
+    # Counts per status plus the submissions not done yet, oldest first
+    def status(self, limit=50):
+        with self._lock:
+            db = self._db()
+            counts = dict(
+                db.execute("SELECT status, COUNT(*) FROM submissions GROUP BY status").fetchall()
+            )
+            rows = db.execute(
+                "SELECT idempotency_key, action, status, attempts, next_attempt, lead_id, "
+                "error, created, updated FROM submissions "
+                "WHERE status != 'done' ORDER BY created LIMIT ?",
+                (limit,),
+            ).fetchall()
+        return {
+            "counts": {
+                status: counts.get(status, 0)
+                for status in ("pending", "sending", "done", "failed", "unknown")
+            },
+            "items": [_row_to_item(row) for row in rows],
+        }
+
+
+def _row_to_item(row):
+    keys = (
+        "idempotency_key",
+        "action",
+        "status",
+        "attempts",
+        "next_attempt",
+        "lead_id",
+        "error",
+        "created",
+        "updated",
+    )
+    return dict(zip(keys, row))
+
+
+# One queue and worker per process
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_lead_queue():
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = LeadQueue(
+                path=os.getenv("ODOO_QUEUE_DB", ".cache/odoo_queue.sqlite3")
+            ).start()
+        return _queue
+
+
+# Enqueue a lead with the same arguments as create_lead_full_data. Returns the idempotency key.
+def enqueue_lead_full_data(upsert=False, idempotency_key=None, **lead_fields):
+    return get_lead_queue().enqueue(
+        lead_fields,
+        action="upsert" if upsert else "create",
+        idempotency_key=idempotency_key,
+    )
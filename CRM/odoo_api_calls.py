@@ -1,9 +1,286 @@
+import http.client
+import os
+import queue
+import threading
 import xmlrpc.client
+from contextlib import contextmanager
 
-url_demo = "https://autoflujo.odoo.com"
-db_demo = "autoflujo"
-username_demo = "alejandro_capellan@hotmail.com"
-password_demo = "Nadamass1!Odoo1!"
+from airregio_metricas import span
+
+# ODOO_URL / ODOO_DB / ODOO_USERNAME / ODOO_PASSWORD point the client at another database,
+# e.g. the local stand-in used by the benchmarks
+url_demo = os.getenv("ODOO_URL", "https://autoflujo.odoo.com")
+db_demo = os.getenv("ODOO_DB", "autoflujo")
+username_demo = os.getenv("ODOO_USERNAME", "alejandro_capellan@hotmail.com")
+password_demo = os.getenv("ODOO_PASSWORD", "Nadamass1!Odoo1!")
+
+
+class OdooAuthenticationError(Exception):
+    pass
+
+
+# Errors of a keep-alive connection that Odoo closed while it was idle
+_STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError)
+
+# Methods that give the same result when repeated, so a call that failed after reaching Odoo
+# (e.g. a read timeout) can be sent again. create is not one of them.
+_IDEMPOTENT_METHODS = {"search_read", "read", "search", "search_count", "write"}
+
+
+# xmlrpc.client.Transport already keeps one HTTP/1.1 connection open per instance;
+# this mixin adds a socket timeout so a stalled Odoo does not hang forever, and replaces
+# the stdlib retry, which resends on ECONNRESET even while reading the response and could
+# create a lead twice.
+class _KeepAliveMixin:
+    def __init__(self, timeout=None, **kwargs):
+        super().__init__(**kwargs)
+        self.timeout = timeout
+        self.request_sent = False
+
+    def make_connection(self, host):
+        connection = super().make_connection(host)
+        if self.timeout is not None:
+            connection.timeout = self.timeout
+        return connection
+
+    def send_request(self, host, handler, request_body, debug):
+        connection = super().send_request(host, handler, request_body, debug)
+        self.request_sent = True
+        return connection
+
+    # Retry once only if Odoo cannot have run the call: the request was not fully sent, or
+    # a reused connection was closed without a single byte of response
+    def request(self, host, handler, request_body, verbose=False):
+        reused = self._connection[1] is not None
+        self.request_sent = False
+        try:
+            return self.single_request(host, handler, request_body, verbose)
+        except _STALE_CONNECTION_ERRORS as e:
+            if self.request_sent and not (
+                reused and isinstance(e, http.client.RemoteDisconnected)
+            ):
+                raise
+        return self.single_request(host, handler, request_body, verbose)
+
+
+class _KeepAliveTransport(_KeepAliveMixin, xmlrpc.client.Transport):
+    pass
+
+
+class _KeepAliveSafeTransport(_KeepAliveMixin, xmlrpc.client.SafeTransport):
+    pass
+
+
+# One keep-alive transport shared by the common and object endpoints. A Transport is not
+# thread-safe, so each thread borrows a whole _Connection from the client's pool.
+class _Connection:
+    def __init__(self, url, timeout):
+        transport_class = (
+            _KeepAliveSafeTransport if url.startswith("https") else _KeepAliveTransport
+        )
+        self.transport = transport_class(timeout=timeout)
+        self.common = xmlrpc.client.ServerProxy(
+            "{}/xmlrpc/2/common".format(url), transport=self.transport
+        )
+        self.models = xmlrpc.client.ServerProxy(
+            "{}/xmlrpc/2/object".format(url), transport=self.transport
+        )
+
+    def reset(self):
+        self.transport.close()
+
+
+# Build the crm.lead values dict, skipping fields that were not provided
+def _lead_values(
+    name=None,
+    contact_name=None,
+    email_from=None,
+    partner_name=None,
+    phone=None,
+    description=None,
+    priority=None,
+    tag_ids=None,
+    street=None,
+    stage_id=None,
+    user_id=None,
+):
+    values = {}
+    if name is not None:
+        values["name"] = name
+    if contact_name is not None:
+        values["contact_name"] = contact_name
+    if email_from is not None:
+        values["email_from"] = email_from
+    if partner_name is not None:
+        values["partner_name"] = partner_name
+    if phone is not None:
+        values["phone"] = phone
+    if description is not None:
+        values["description"] = description
+    if priority is not None:
+        values["priority"] = priority
+    if tag_ids is not None:
+        values["tag_ids"] = [(6, 0, tag_ids)]  # Replace tags with a list of tag IDs
+    if street is not None:
+        values["street"] = street
+    if stage_id is not None:
+        values["stage_id"] = stage_id
+    if user_id is not None:
+        values["user_id"] = user_id  # Salesperson
+    return values
+
+
+# A lead without a phone number must omit the key: XML-RPC cannot marshal None
+def _full_lead_values(lead_name, phone_number_id, **fields):
+    return _lead_values(name=lead_name, phone=phone_number_id, **fields)
+
+
+class OdooClient:
+    """
+    XML-RPC client for one Odoo database.
+
+    Authenticates once and caches the uid, re-authenticating when Odoo rejects it.
+    Keeps a small pool of keep-alive connections so the client can be shared
+    between threads without repeating TLS handshakes on every call.
+    """
+
+    def __init__(
+        self,
+        url=url_demo,
+        db=db_demo,
+        username=username_demo,
+        password=password_demo,
+        pool_size=4,
+        timeout=30,
+    ):
+        self.url = url
+        self.db = db
+        self.username = username
+        self.password = password
+        self.timeout = timeout
+
+        self._uid = None
+        self._auth_lock = threading.Lock()
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+        for _ in range(pool_size):
+            self._pool.put(None)  # Connections are created lazily
+
+    @contextmanager
+    def _connection(self):
+        connection = self._pool.get()
+        if connection is None:
+            connection = _Connection(self.url, self.timeout)
+        try:
+            yield connection
+        except xmlrpc.client.Fault:
+            # The response was read completely, the connection is still usable
+            raise
+        except Exception:
+            # Do not hand a half-read socket to the next caller
+            connection.reset()
+            raise
+        finally:
+            self._pool.put(connection)
+
+    @property
+    def uid(self):
+        if self._uid is None:
+            self.authenticate()
+        return self._uid
+
+    def authenticate(self, force=False):
+        with self._auth_lock:
+            if self._uid is not None and not force:
+                return self._uid
+            with span("odoo_authenticate"):
+                with self._connection() as connection:
+                    uid = connection.common.authenticate(
+                        self.db, self.username, self.password, {}
+                    )
+                if not uid:
+                    self._uid = None
+                    raise OdooAuthenticationError(
+                        "Authentication failed for {} on {}".format(self.username, self.db)
+                    )
+            self._uid = uid
+            return uid
+
+    # Call a model method. Retries once after re-authenticating if the cached uid
+    # was rejected. Stale keep-alive connections are retried by the transport; other
+    # connection errors are retried once only for idempotent methods.
+    def execute_kw(self, model, method, args, kwargs=None):
+        retried_auth = False
+        retried_connection = False
+        while True:
+            uid = self.uid
+            try:
+                with span(f"odoo_{method}", model=model), self._connection() as connection:
+                    if kwargs:
+                        return connection.models.execute_kw(
+                            self.db, uid, self.password, model, method, args, kwargs
+                        )
+                    return connection.models.execute_kw(
+                        self.db, uid, self.password, model, method, args
+                    )
+            except xmlrpc.client.Fault as e:
+                if retried_auth or not _is_access_denied(e):
+                    raise
+                retried_auth = True
+                self.authenticate(force=True)
+            except (ConnectionError, xmlrpc.client.ProtocolError, OSError):
+                if retried_connection or method not in _IDEMPOTENT_METHODS:
+                    raise
+                retried_connection = True
+
+    def create_lead(self, lead_name, phone_number_id):
+        return self.execute_kw(
+            "crm.lead", "create", [{"name": lead_name, "phone": phone_number_id}]
+        )
+
+    def update_lead(self, lead_id, **fields):
+        return self.execute_kw(
+            "crm.lead", "write", [[lead_id], _lead_values(**fields)]
+        )
+
+    def create_lead_full_data(self, lead_name, phone_number_id, **fields):
+        return self.execute_kw(
+            "crm.lead", "create", [_full_lead_values(lead_name, phone_number_id, **fields)]
+        )
+
+    # Odoo's create accepts a list of value dicts and returns the list of new ids
+    def create_leads(self, values_list):
+        ids = self.execute_kw("crm.lead", "create", [values_list])
+        return ids if isinstance(ids, list) else [ids]
+
+    # Odoo's write applies the same values to every id in one call
+    def write_leads(self, lead_ids, values):
+        return self.execute_kw("crm.lead", "write", [list(lead_ids), values])
+
+
+def _is_access_denied(fault):
+    text = "{} {}".format(fault.faultCode, fault.faultString)
+    return "AccessDenied" in text or "Access Denied" in text or "SessionExpired" in text
+
+
+# Odoo raises MissingError when the record was deleted (or never existed)
+def is_missing_record(fault):
+    text = "{} {}".format(fault.faultCode, fault.faultString)
+    return "MissingError" in text or "does not exist" in text
+
+
+# One shared client per (url, db, username, password)
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(url=url_demo, db=db_demo, username=username_demo, password=password_demo):
+    key = (url, db, username, password)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = OdooClient(url=url, db=db, username=username, password=password)
+            _clients[key] = client
+        return client
 
 
 # Create new lead. Returns lead_id
@@ -17,32 +294,15 @@ def create_lead(
     username=username_demo,
     password=password_demo,
 ):
-    # Common endpoint
-    common = xmlrpc.client.ServerProxy("{}/xmlrpc/2/common".format(url))
-    uid = common.authenticate(db, username, password, {})
-
-    if not uid:
+    client = get_client(url, db, username, password)
+    try:
+        client.authenticate()
+    except OdooAuthenticationError:
         print("Authentication failed")
         return None
 
-    # Object endpoint
-    models = xmlrpc.client.ServerProxy("{}/xmlrpc/2/object".format(url))
-
     # Minimal data for creating a lead
-    lead_id = models.execute_kw(
-        db,
-        uid,
-        password,
-        "crm.lead",
-        "create",
-        [
-            {
-                "name": lead_name,
-                "phone": phone_number_id,  # Optional: Add a specific customer ID if needed
-                # 'user_id': 1,     # Optional: Assign a salesperson
-            }
-        ],
-    )
+    lead_id = client.create_lead(lead_name, phone_number_id)
 
     print("Lead created with ID:", lead_id)
     return lead_id
@@ -78,44 +338,29 @@ def update_lead(
     tag_ids=None,
     street=None,
     stage_id=None,  # Add stage_id parameter
+    user_id=None,
 ):
-    # Common endpoint
-    common = xmlrpc.client.ServerProxy("{}/xmlrpc/2/common".format(url))
-    uid = common.authenticate(db, username, password, {})
-
-    if not uid:
+    client = get_client(url, db, username, password)
+    try:
+        client.authenticate()
+    except OdooAuthenticationError:
         print("Authentication failed")
         return False
 
-    # Object endpoint
-    models = xmlrpc.client.ServerProxy("{}/xmlrpc/2/object".format(url))
-
-    # Prepare the values dictionary for fields to be updated
-    values = {}
-    if name is not None:
-        values["name"] = name
-    if contact_name is not None:
-        values["contact_name"] = contact_name
-    if email_from is not None:
-        values["email_from"] = email_from
-    if partner_name is not None:
-        values["partner_name"] = partner_name
-    if phone is not None:
-        values["phone"] = phone
-    if description is not None:
-        values["description"] = description
-    if priority is not None:
-        values["priority"] = priority
-    if tag_ids is not None:
-        values["tag_ids"] = [(6, 0, tag_ids)]  # Update tags with a list of tag IDs
-    if street is not None:
-        values["street"] = street
-    if stage_id is not None:
-        values["stage_id"] = stage_id  # Update stage
-
-    # Update the lead
-    result = models.execute_kw(
-        db, uid, password, "crm.lead", "write", [[lead_id], values]
+    # Update the lead with only the fields that were provided
+    result = client.update_lead(
+        lead_id,
+        name=name,
+        contact_name=contact_name,
+        email_from=email_from,
+        partner_name=partner_name,
+        phone=phone,
+        description=description,
+        priority=priority,
+        tag_ids=tag_ids,
+        street=street,
+        stage_id=stage_id,
+        user_id=user_id,
     )
 
     if result:
@@ -162,39 +407,172 @@ def create_lead_full_data(
     tag_ids=None,
     street=None,
     stage_id=None,
+    user_id=None,
 ):
-    # Common endpoint
-    common = xmlrpc.client.ServerProxy("{}/xmlrpc/2/common".format(url))
-    uid = common.authenticate(db, username, password, {})
-
-    if not uid:
+    client = get_client(url, db, username, password)
+    try:
+        client.authenticate()
+    except OdooAuthenticationError:
         print("Authentication failed")
         return None
 
-    # Object endpoint
-    models = xmlrpc.client.ServerProxy("{}/xmlrpc/2/object".format(url))
-
-    # Prepare the values dictionary for fields to be created
-    values = {"name": lead_name, "phone": phone_number_id}
-    if contact_name is not None:
-        values["contact_name"] = contact_name
-    if email_from is not None:
-        values["email_from"] = email_from
-    if partner_name is not None:
-        values["partner_name"] = partner_name
-    if description is not None:
-        values["description"] = description
-    if priority is not None:
-        values["priority"] = priority
-    if tag_ids is not None:
-        values["tag_ids"] = [(6, 0, tag_ids)]  # Add tags with a list of tag IDs
-    if street is not None:
-        values["street"] = street
-    if stage_id is not None:
-        values["stage_id"] = stage_id  # Set stage
-
     # Create the lead
-    lead_id = models.execute_kw(db, uid, password, "crm.lead", "create", [values])
+    lead_id = client.create_lead_full_data(
+        lead_name,
+        phone_number_id,
+        contact_name=contact_name,
+        email_from=email_from,
+        partner_name=partner_name,
+        description=description,
+        priority=priority,
+        tag_ids=tag_ids,
+        street=street,
+        stage_id=stage_id,
+        user_id=user_id,
+    )
 
     print("Lead created with ID:", lead_id)
     return lead_id
+
+
+# Split a list into chunks of at most batch_size items
+def _chunks(items, batch_size):
+    for start in range(0, len(items), batch_size):
+        yield items[start : start + batch_size]
+
+
+# Create many leads with one RPC per batch. Each record is a dict with the same
+# keyword arguments as create_lead_full_data (lead_name, phone_number_id, contact_name, ...).
+# Returns {record_index: {"id": lead_id or None, "error": message or None}}. When Odoo rejects
+# a batch (an XML-RPC fault), its records are retried one by one so a single bad record does not
+# fail the rest. When the connection fails after the batch was sent, Odoo may already have
+# committed it, so nothing is resent and each record is marked with "unknown": True.
+def create_leads_bulk(
+    records,
+    batch_size=100,
+    url=url_demo,
+    db=db_demo,
+    username=username_demo,
+    password=password_demo,
+):
+    results = {}
+    pending = []  # (index, values)
+    for index, record in enumerate(records):
+        try:
+            pending.append((index, _full_lead_values(**record)))
+        except TypeError as e:
+            results[index] = {"id": None, "error": str(e)}
+
+    client = get_client(url, db, username, password)
+    try:
+        client.authenticate()
+    except (OdooAuthenticationError, OSError, xmlrpc.client.ProtocolError) as e:
+        # Nothing was sent yet, the records can safely be sent again
+        print(f"Authentication failed: {e}")
+        for index, _ in pending:
+            results[index] = {"id": None, "error": str(e)}
+        return results
+
+    for batch in _chunks(pending, batch_size):
+        try:
+            ids = client.create_leads([values for _, values in batch])
+            for (index, _), lead_id in zip(batch, ids):
+                results[index] = {"id": lead_id, "error": None}
+            continue
+        except xmlrpc.client.Fault as e:
+            if len(batch) == 1:
+                results[batch[0][0]] = {"id": None, "error": str(e)}
+                continue
+            print(f"Batch create failed, retrying {len(batch)} leads one by one: {e}")
+        except ConnectionRefusedError as e:
+            for index, _ in batch:
+                results[index] = {"id": None, "error": str(e)}
+            continue
+        except Exception as e:
+            print(f"Batch create of {len(batch)} leads failed with an unknown outcome: {e}")
+            for index, _ in batch:
+                results[index] = {"id": None, "error": str(e), "unknown": True}
+            continue
+
+        for index, values in batch:
+            try:
+                results[index] = {"id": client.create_leads([values])[0], "error": None}
+            except (xmlrpc.client.Fault, ConnectionRefusedError) as e:
+                results[index] = {"id": None, "error": str(e)}
+            except Exception as e:
+                results[index] = {"id": None, "error": str(e), "unknown": True}
+
+    created = sum(1 for result in results.values() if result["error"] is None)
+    print(f"Bulk create: {created} of {len(records)} leads created.")
+    return dict(sorted(results.items()))
+
+
+# Update many leads. Each update is a dict with "lead_id" plus the same keyword arguments
+# as update_lead (name, contact_name, ..., stage_id, user_id). Updates that write the same values are
+# grouped into one write per batch. Returns {lead_id: {"ok": bool, "error": message or None}}.
+# Only batches rejected by Odoo are retried one by one; a connection error fails the batch.
+def update_leads_bulk(
+    updates,
+    batch_size=100,
+    url=url_demo,
+    db=db_demo,
+    username=username_demo,
+    password=password_demo,
+):
+    results = {}
+    groups = {}  # values key -> (values, [lead_id, ...])
+    for update in updates:
+        fields = dict(update)
+        lead_id = fields.pop("lead_id", None)
+        if lead_id is None:
+            print("Skipping update without lead_id")
+            continue
+        try:
+            values = _lead_values(**fields)
+        except TypeError as e:
+            results[lead_id] = {"ok": False, "error": str(e)}
+            continue
+        if not values:
+            results[lead_id] = {"ok": True, "error": None}
+            continue
+        key = repr(sorted(values.items()))
+        groups.setdefault(key, (values, []))[1].append(lead_id)
+
+    client = get_client(url, db, username, password)
+    try:
+        client.authenticate()
+    except OdooAuthenticationError as e:
+        print("Authentication failed")
+        for _, lead_ids in groups.values():
+            for lead_id in lead_ids:
+                results[lead_id] = {"ok": False, "error": str(e)}
+        return results
+
+    for values, lead_ids in groups.values():
+        for batch in _chunks(lead_ids, batch_size):
+            try:
+                ok = bool(client.write_leads(batch, values))
+                for lead_id in batch:
+                    results[lead_id] = {"ok": ok, "error": None}
+                continue
+            except xmlrpc.client.Fault as e:
+                if len(batch) == 1:
+                    results[batch[0]] = {"ok": False, "error": str(e)}
+                    continue
+                print(f"Batch write failed, retrying {len(batch)} leads one by one: {e}")
+            except Exception as e:
+                print(f"Batch write of {len(batch)} leads failed: {e}")
+                for lead_id in batch:
+                    results[lead_id] = {"ok": False, "error": str(e)}
+                continue
+
+            for lead_id in batch:
+                try:
+                    ok = bool(client.write_leads([lead_id], values))
+                    results[lead_id] = {"ok": ok, "error": None}
+                except Exception as e:
+                    results[lead_id] = {"ok": False, "error": str(e)}
+
+    updated = sum(1 for result in results.values() if result["ok"])
+    print(f"Bulk update: {updated} of {len(results)} leads updated.")
+    return results
@@ -0,0 +1,170 @@
+import os
+import threading
+import time
+
+from CRM.odoo_api_calls import (
+    url_demo,
+    db_demo,
+    username_demo,
+    password_demo,
+    get_client,
+)
+
+# name -> (model, domain, fields, order), loaded with one search_read each
+_MODELS = {
+    "tags": ("crm.tag", [], ["id", "name"], "id asc"),
+    "stages": (
+        "crm.stage",
+        [],
+        ["id", "name", "sequence", "is_won", "fold"],
+        "sequence asc, id asc",
+    ),
+    "salespeople": ("res.users", [("share", "=", False)], ["id", "name", "login"], "name asc"),
+}
+
+
+# Keep only the ids in known_ids, in order and without repeats
+def keep_known_ids(ids, known_ids):
+    known = set(known_ids)
+    kept = []
+    for record_id in ids or []:
+        if record_id in known and record_id not in kept:
+            kept.append(record_id)
+    return kept
+
+
+class ReferenceData:
+    """
+    Cached crm.tag, crm.stage and salespeople (internal res.users) of one Odoo database.
+
+    Loaded with one search_read per model and kept for ttl seconds, so building prompts and
+    validating tag_ids / stage_id / user_id never costs a lookup RPC per lead. If a reload
+    fails the previous copy is kept and the next attempt waits retry_interval seconds.
+
+    Readers (tags(), stages(), valid_tag_ids()...) only look at the cached copy and never call
+    Odoo; start() reloads it from a background thread, so a slow or unreachable Odoo cannot
+    block a request or an event loop. Listeners are called after every successful load.
+    """
+
+    def __init__(self, client, ttl=3600, retry_interval=60):
+        self.client = client
+        self.ttl = ttl
+        self.retry_interval = retry_interval
+
+        self._data = {name: [] for name in _MODELS}
+        self._loaded_at = None
+        self._next_attempt = 0.0
+        self._lock = threading.Lock()
+        self._listeners = []
+        self._wake = threading.Event()
+        self._thread = None
+
+    # Blocking: call it from a thread or at startup, never from an event loop
+    def load(self):
+        data = {}
+        for name, (model, domain, fields, order) in _MODELS.items():
+            data[name] = self.client.execute_kw(
+                model, "search_read", [domain], {"fields": fields, "order": order}
+            )
+        with self._lock:
+            self._data = data
+            self._loaded_at = time.monotonic()
+            listeners = list(self._listeners)
+        for listener in listeners:
+            try:
+                listener(self)
+            except Exception as e:
+                print(f"Odoo reference data listener error: {e}")
+        return data
+
+    # Reload if the cached copy is older than ttl. Errors are printed, not raised.
+    def refresh(self):
+        now = time.monotonic()
+        with self._lock:
+            fresh = self._loaded_at is not None and now - self._loaded_at < self.ttl
+            if fresh or now < self._next_attempt:
+                return
+            self._next_attempt = now + self.retry_interval
+        try:
+            self.load()
+        except Exception as e:
+            print(f"Could not load Odoo reference data, using the cached copy: {e}")
+
+    # Forget the cached copy, e.g. after tags or stages are edited in Odoo. Readers keep
+    # seeing it until the background thread has loaded the new one.
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+            self._next_attempt = 0.0
+        self._wake.set()
+
+    # listener(reference_data) runs in the loading thread after each successful load
+    def add_listener(self, listener):
+        with self._lock:
+            self._listeners.append(listener)
+
+    def _run(self):
+        while True:
+            self.refresh()
+            self._wake.wait(min(self.ttl, self.retry_interval))
+            self._wake.clear()
+
+    # Start the background refresher (once). Returns immediately.
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="odoo-reference-data", daemon=True
+                )
+                self._thread.start()
+        return self
+
+    @property
+    def loaded(self):
+        return self._loaded_at is not None
+
+    def tags(self):
+        return list(self._data["tags"])
+
+    def stages(self):
+        return list(self._data["stages"])
+
+    def salespeople(self):
+        return list(self._data["salespeople"])
+
+    # Keep only the tag ids that exist in Odoo, in order and without repeats
+    def valid_tag_ids(self, tag_ids):
+        return keep_known_ids(tag_ids, (tag["id"] for tag in self.tags()))
+
+    def is_valid_stage(self, stage_id):
+        return any(stage["id"] == stage_id for stage in self.stages())
+
+    def is_valid_salesperson(self, user_id):
+        return any(user["id"] == user_id for user in self.salespeople())
+
+    # First open stage by sequence: where a new lead should start
+    def initial_stage_id(self):
+        for stage in self.stages():
+            if not stage.get("is_won") and not stage.get("fold"):
+                return stage["id"]
+        return None
+
+
+# One shared cache per Odoo database/user
+_references = {}
+_references_lock = threading.Lock()
+
+
+def get_reference_data(
+    url=url_demo, db=db_demo, username=username_demo, password=password_demo
+):
+    key = (url, db, username, password)
+    with _references_lock:
+        reference = _references.get(key)
+        if reference is None:
+            reference = ReferenceData(
+                get_client(url, db, username, password),
+                ttl=float(os.getenv("ODOO_REFERENCE_TTL", "3600")),
+            )
+            _references[key] = reference
+        return reference
@@ -1,4 +1,9 @@
+import asyncio
+import json
 import os
+import threading
+import time
+from functools import lru_cache
 
 from dotenv import load_dotenv
 from pydantic import BaseModel, Field
@@ -7,9 +12,30 @@ from langchain_groq import ChatGroq
 from langchain_openai import ChatOpenAI
 
 from langchain_core.prompts import PromptTemplate
-from langchain_core.messages import HumanMessage, SystemMessage, AIMessage
 from langchain_core.output_parsers import JsonOutputParser
-import re
+from langchain_core.utils.json import parse_partial_json
+
+from airregio_cache import CacheResultados, clave_cache
+from airregio_calificacion_local import calificar_local, prioridad_desde_score
+from airregio_conversacion import (
+    compactar_conversacion,
+    contar_tokens,
+    dividir_en_fragmentos,
+)
+from airregio_duplicados import IndiceDuplicados
+from airregio_extraccion_rapida import (
+    _sin_acentos,
+    aplicar_campos_deterministas,
+    extraer_campos_deterministas,
+)
+from airregio_limites import (
+    LIMITADOR_ACTIVO,
+    es_limite_de_tasa,
+    obtener_limitador,
+    tokens_usados,
+)
+from airregio_metricas import span
+from airregio_prompts import registrar_prompt, registrar_uso
 
 
 load_dotenv(override=True)
@@ -21,8 +47,347 @@ os.environ["GROQ_API_KEY"] = os.getenv("GROQ_API_KEY")
 llama_3_2 = "llama-3.2-90b-vision-preview"
 llama_3_1 = "llama-3.1-70b-versatile"
 gpt = "gpt-4o-mini"
-llm = ChatOpenAI(model=gpt, temperature=0.2)
-# llm = ChatGroq(model=llama_3_1, temperature=0.2)
+gpt_4o = "gpt-4o"
+
+
+# Los modelos de Llama se sirven en Groq, los demás en OpenAI. Con el limitador activo los
+# reintentos (429, 5xx, red) los hace airregio_limites; si el SDK también reintentara, cada
+# 429 se multiplicaría sin que el limitador lo viera.
+def crear_llm(modelo, temperatura=0.2):
+    reintentos = 0 if LIMITADOR_ACTIVO else 2
+    if modelo.startswith("llama"):
+        return ChatGroq(model=modelo, temperature=temperatura, max_retries=reintentos)
+    return ChatOpenAI(model=modelo, temperature=temperatura, max_retries=reintentos)
+
+
+# Cascada: toda llamada va primero al modelo rápido y barato (llm). Solo si su respuesta no se
+# puede parsear o no pasa la validación se repite con el modelo fuerte.
+# AIRREGIO_MODELO_FUERTE="" desactiva la cascada.
+llm = crear_llm(os.getenv("AIRREGIO_MODELO", gpt))
+_modelo_fuerte = os.getenv("AIRREGIO_MODELO_FUERTE", gpt_4o)
+llm_fuerte = crear_llm(_modelo_fuerte) if _modelo_fuerte else None
+
+# Cobertura (hedging): si el modelo no respondió en AIRREGIO_HEDGE_SEGUNDOS, se lanza la misma
+# llamada al modelo de respaldo (otro proveedor) y se usa la primera respuesta. 0 la desactiva.
+HEDGE_SEGUNDOS = float(os.getenv("AIRREGIO_HEDGE_SEGUNDOS", "0"))
+llm_respaldo = (
+    crear_llm(os.getenv("AIRREGIO_MODELO_RESPALDO", llama_3_1))
+    if HEDGE_SEGUNDOS > 0
+    else None
+)
+
+# Veces que se reparó una respuesta, que se escaló al modelo fuerte y que ganó el respaldo,
+# por prompt
+estadisticas_enrutamiento = {"reparados": {}, "escalados": {}, "respaldo_gano": {}}
+_estadisticas_enrutamiento_lock = threading.Lock()
+
+# Cache de resultados para no pagar otra vez por conversaciones ya procesadas.
+# AIRREGIO_CACHE=0 la desactiva.
+cache_resultados = CacheResultados(
+    ruta=os.getenv("AIRREGIO_CACHE_DB", ".cache/airregio_llm.sqlite3"),
+    ttl_segundos=int(os.getenv("AIRREGIO_CACHE_TTL", str(7 * 24 * 3600))),
+    habilitado=os.getenv("AIRREGIO_CACHE", "1") == "1",
+)
+
+
+# Clave de cache para una llamada: la versión del prompt registrado cambia con su texto
+# y el mensaje del usuario ya incluye la conversación tal como se envía (compactada o no).
+# La respuesta puede venir del modelo rápido, del fuerte (cascada) o del de respaldo
+# (cobertura), así que la clave incluye los tres: cambiar cualquiera invalida el cache.
+def _clave_cache(prompt, mensajes_llm):
+    modelos = [modelo for modelo in (llm, llm_fuerte, llm_respaldo) if modelo is not None]
+    return clave_cache(
+        prompt.nombre,
+        mensajes_llm[1].content,
+        prompt.version,
+        ",".join(str(_nombre_modelo(modelo)) for modelo in modelos),
+        tuple(getattr(modelo, "temperature", None) for modelo in modelos),
+    )
+
+
+def _nombre_modelo(modelo=None):
+    modelo = modelo if modelo is not None else llm
+    return getattr(modelo, "model_name", None) or getattr(modelo, "model", None)
+
+
+def _contar_enrutamiento(tipo, prompt):
+    with _estadisticas_enrutamiento_lock:
+        conteos = estadisticas_enrutamiento[tipo]
+        conteos[prompt.nombre] = conteos.get(prompt.nombre, 0) + 1
+
+
+# Esquema JSON estricto para response_format de OpenAI: todos los campos son obligatorios (los
+# opcionales aceptan null), no se permiten campos extra y se quitan "default" y "title"
+def _esquema_estricto(nodo):
+    if isinstance(nodo, list):
+        return [_esquema_estricto(valor) for valor in nodo]
+    if not isinstance(nodo, dict):
+        return nodo
+    estricto = {}
+    for clave, valor in nodo.items():
+        if clave in ("default", "title"):
+            continue
+        if clave in ("properties", "$defs"):
+            estricto[clave] = {
+                nombre: _esquema_estricto(propiedad) for nombre, propiedad in valor.items()
+            }
+        else:
+            estricto[clave] = _esquema_estricto(valor)
+    if "properties" in estricto:
+        estricto["required"] = list(estricto["properties"])
+        estricto["additionalProperties"] = False
+    return estricto
+
+
+@lru_cache(maxsize=None)
+def _formato_respuesta(esquema):
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": esquema.__name__,
+            "strict": True,
+            "schema": _esquema_estricto(esquema.model_json_schema()),
+        },
+    }
+
+
+# Salida estructurada: OpenAI genera JSON que cumple el esquema del parser del prompt y Groq
+# garantiza un objeto JSON. Así la respuesta se parsea directo, sin limpiar texto alrededor.
+def _estructurado(modelo, prompt):
+    esquema = getattr(prompt.parser, "pydantic_object", None)
+    if esquema is None:
+        return modelo
+    if isinstance(modelo, ChatOpenAI):
+        return modelo.bind(response_format=_formato_respuesta(esquema))
+    if isinstance(modelo, ChatGroq):
+        return modelo.bind(response_format={"type": "json_object"})
+    return modelo
+
+
+# Tokens de salida que se reservan en el limitador si el modelo no tiene max_tokens
+TOKENS_SALIDA_ESTIMADOS = int(os.getenv("AIRREGIO_TOKENS_SALIDA_ESTIMADOS", "400"))
+
+
+# Tokens que consumirá la llamada, estimados antes de enviarla
+def _tokens_estimados(modelo, mensajes_llm):
+    entrada = sum(contar_tokens(str(mensaje.content)) for mensaje in mensajes_llm)
+    return entrada + (getattr(modelo, "max_tokens", None) or TOKENS_SALIDA_ESTIMADOS)
+
+
+# Una llamada al modelo pasando por el limitador del proceso (RPM, TPM y concurrencia AIMD);
+# los 429 se reintentan ahí con espera y jitter
+def _llamar_modelo(modelo, prompt, mensajes_llm):
+    ejecutable = _estructurado(modelo, prompt)
+    limitador = obtener_limitador(_nombre_modelo(modelo))
+    if limitador is None:
+        return ejecutable.invoke(mensajes_llm)
+    return limitador.llamar(
+        lambda: ejecutable.invoke(mensajes_llm), _tokens_estimados(modelo, mensajes_llm)
+    )
+
+
+async def _allamar_modelo(modelo, prompt, mensajes_llm):
+    ejecutable = _estructurado(modelo, prompt)
+    limitador = obtener_limitador(_nombre_modelo(modelo))
+    if limitador is None:
+        return await ejecutable.ainvoke(mensajes_llm)
+    return await limitador.allamar(
+        lambda: ejecutable.ainvoke(mensajes_llm), _tokens_estimados(modelo, mensajes_llm)
+    )
+
+
+# Lanza la llamada y, si tarda más de HEDGE_SEGUNDOS, la repite con el modelo de respaldo.
+# Devuelve (respuesta, modelo que respondió).
+async def _ainvocar_con_respaldo(prompt, modelo, mensajes_llm):
+    if llm_respaldo is None or HEDGE_SEGUNDOS <= 0:
+        return await _allamar_modelo(modelo, prompt, mensajes_llm), modelo
+
+    principal = asyncio.ensure_future(_allamar_modelo(modelo, prompt, mensajes_llm))
+    listas, _ = await asyncio.wait({principal}, timeout=HEDGE_SEGUNDOS)
+    if listas:
+        return principal.result(), modelo
+
+    respaldo = asyncio.ensure_future(_allamar_modelo(llm_respaldo, prompt, mensajes_llm))
+    tareas = {principal: modelo, respaldo: llm_respaldo}
+    pendientes = set(tareas)
+    while pendientes:
+        listas, pendientes = await asyncio.wait(
+            pendientes, return_when=asyncio.FIRST_COMPLETED
+        )
+        for tarea in listas:
+            if tarea.exception() is None:
+                for otra in pendientes:
+                    otra.cancel()
+                if tarea is respaldo:
+                    _contar_enrutamiento("respaldo_gano", prompt)
+                return tarea.result(), tareas[tarea]
+    # Fallaron las dos: se reporta el error del modelo principal
+    raise principal.exception()
+
+
+def _modelos_cascada():
+    return [llm] if llm_fuerte is None else [llm, llm_fuerte]
+
+
+# Reparación: si la respuesta no pasa la validación, el modelo barato recibe solo el esquema,
+# la respuesta inválida y el error (no la conversación) y devuelve el JSON corregido
+PROMPT_REPARACION = registrar_prompt(
+    "reparacion",
+    sistema="""
+        Eres un validador de JSON. Recibirás el esquema que debía cumplir una respuesta, la respuesta que se generó y el error de validación.
+        Devuelve solo el JSON corregido que cumpla el esquema, conservando los valores de la respuesta original.
+        No inventes datos: si un valor no se puede corregir, usa null.
+        """,
+    encabezado_usuario="Corrige la siguiente respuesta:\n\n",
+)
+
+
+def _se_puede_reparar(prompt, modelo):
+    return prompt.parser is not None and modelo is not llm_fuerte
+
+
+def _mensajes_reparacion(prompt, contenido, error):
+    return PROMPT_REPARACION.mensajes(
+        f"Esquema:\n{prompt.parser.get_format_instructions()}\n\n"
+        f"Respuesta:\n{contenido}\n\n"
+        f"Error:\n{str(error)[:500]}"
+    )
+
+
+def _reparar(prompt, contenido, error):
+    mensajes_llm = _mensajes_reparacion(prompt, contenido, error)
+    with span("llm_reparacion", modelo=_nombre_modelo(), prompt=prompt.nombre) as actual:
+        respuesta = _llamar_modelo(llm, prompt, mensajes_llm)
+        actual.uso_llm(respuesta, _nombre_modelo())
+    registrar_uso(PROMPT_REPARACION.nombre, respuesta)
+    _contar_enrutamiento("reparados", prompt)
+    return respuesta.content
+
+
+async def _areparar(prompt, contenido, error):
+    mensajes_llm = _mensajes_reparacion(prompt, contenido, error)
+    with span("llm_reparacion", modelo=_nombre_modelo(), prompt=prompt.nombre) as actual:
+        respuesta = await _allamar_modelo(llm, prompt, mensajes_llm)
+        actual.uso_llm(respuesta, _nombre_modelo())
+    registrar_uso(PROMPT_REPARACION.nombre, respuesta)
+    _contar_enrutamiento("reparados", prompt)
+    return respuesta.content
+
+
+# Después de una respuesta inválida: si era el último modelo se lanza el error; si no, se
+# avisa y la cascada sigue con el siguiente
+def _escalar(prompt, modelos, nivel, error):
+    if nivel + 1 == len(modelos):
+        raise error
+    print(
+        f"Respuesta inválida de {_nombre_modelo(modelos[nivel])}, se repite con "
+        f"{_nombre_modelo(modelos[nivel + 1])}: {error}"
+    )
+    _contar_enrutamiento("escalados", prompt)
+
+
+# Llama al LLM dentro de un span (latencia, tokens y costo), acumula el uso del prompt y
+# parsea la respuesta con `parsear`. Si el parseo o la validación fallan, se intenta una
+# reparación barata y después se escala al siguiente modelo de la cascada; los errores de
+# red o de la API no escalan.
+async def _ainvocar_llm(prompt, mensajes_llm, parsear, modelos=None):
+    modelos = modelos or _modelos_cascada()
+    for nivel, modelo in enumerate(modelos):
+        with span(f"llm_{prompt.nombre}", modelo=_nombre_modelo(modelo), nivel=nivel) as actual:
+            respuesta, modelo = await _ainvocar_con_respaldo(prompt, modelo, mensajes_llm)
+            actual.uso_llm(respuesta, _nombre_modelo(modelo))
+        registrar_uso(prompt.nombre, respuesta)
+        try:
+            return parsear(respuesta.content)
+        except Exception as e:
+            error = e
+        if _se_puede_reparar(prompt, modelo):
+            try:
+                return parsear(await _areparar(prompt, respuesta.content, error))
+            except Exception as e:
+                error = e
+        _escalar(prompt, modelos, nivel, error)
+
+
+def _invocar_llm(prompt, mensajes_llm, parsear, modelos=None):
+    if llm_respaldo is not None and HEDGE_SEGUNDOS > 0:
+        # La cobertura necesita esperar dos llamadas a la vez: se usa el loop de fondo
+        return ejecutar_async(_ainvocar_llm(prompt, mensajes_llm, parsear, modelos))
+
+    modelos = modelos or _modelos_cascada()
+    for nivel, modelo in enumerate(modelos):
+        with span(f"llm_{prompt.nombre}", modelo=_nombre_modelo(modelo), nivel=nivel) as actual:
+            respuesta = _llamar_modelo(modelo, prompt, mensajes_llm)
+            actual.uso_llm(respuesta, _nombre_modelo(modelo))
+        registrar_uso(prompt.nombre, respuesta)
+        try:
+            return parsear(respuesta.content)
+        except Exception as e:
+            error = e
+        if _se_puede_reparar(prompt, modelo):
+            try:
+                return parsear(_reparar(prompt, respuesta.content, error))
+            except Exception as e:
+                error = e
+        _escalar(prompt, modelos, nivel, error)
+
+
+# Compactación de la conversación antes de enviarla al LLM: se eliminan encabezados repetidos
+# y se recortan los turnos del asistente, que solo sirven de contexto.
+# AIRREGIO_COMPACTAR=0 envía el texto original.
+COMPACTAR_CONVERSACION = os.getenv("AIRREGIO_COMPACTAR", "1") == "1"
+MAX_CARACTERES_ASISTENTE = int(os.getenv("AIRREGIO_MAX_CARACTERES_ASISTENTE", "160"))
+
+# Tokens de la conversación antes y después de compactar, acumulados por llamada al LLM
+estadisticas_compactacion = {"llamadas": 0, "tokens_antes": 0, "tokens_despues": 0}
+_estadisticas_compactacion_lock = threading.Lock()
+
+
+# Devuelve la conversación que se inserta en el prompt del usuario
+def preparar_conversacion(mensajes):
+    if not COMPACTAR_CONVERSACION or not isinstance(mensajes, str):
+        return mensajes
+
+    with span("parse_conversacion"):
+        compacto, estadisticas = compactar_conversacion(
+            mensajes,
+            max_caracteres_asistente=MAX_CARACTERES_ASISTENTE,
+            modelo=getattr(llm, "model_name", None) or "gpt-4o-mini",
+        )
+    with _estadisticas_compactacion_lock:
+        estadisticas_compactacion["llamadas"] += 1
+        estadisticas_compactacion["tokens_antes"] += estadisticas["tokens_antes"]
+        estadisticas_compactacion["tokens_despues"] += estadisticas["tokens_despues"]
+    return compacto
+
+
+# Teléfono, correo y fechas se buscan con expresiones regulares en los mensajes del usuario
+# antes de llamar al LLM. Al modelo se le indica que no necesita devolver esos campos.
+# AIRREGIO_EXTRACCION_RAPIDA=0 deja todo al LLM.
+EXTRACCION_RAPIDA = os.getenv("AIRREGIO_EXTRACCION_RAPIDA", "1") == "1"
+
+
+def _campos_deterministas(mensajes):
+    if not EXTRACCION_RAPIDA or not isinstance(mensajes, str):
+        return None
+    return extraer_campos_deterministas(mensajes)
+
+
+# Los campos ya resueltos se indican en una nota antes de la conversación en lugar de quitarlos
+# del esquema: así el prompt de sistema no cambia y el proveedor puede cachear el prefijo.
+def _nota_campos_conocidos(campos):
+    if campos is None:
+        return None
+    conocidos = [
+        nombre for nombre in ("phone", "email_from") if campos[nombre] is not None
+    ]
+    if not conocidos:
+        return None
+    return (
+        f"Los campos {', '.join(conocidos)} ya se obtuvieron de la conversación; "
+        "no es necesario incluirlos en el JSON."
+    )
+
 
 ############################## 1. Prepare data for CRM ##############################
 
@@ -60,28 +425,28 @@ class DatosUsuario(BaseModel):
     )
 
 
-# Función para extraer los datos del usuario a partir de la conversación
-def extraer_datos_conversacion(mensajes):
-    """
-    Procesa una lista de mensajes entre el asistente y el usuario para extraer información clave.
-
-    Args:
-        mensajes (List[dict]): Lista de mensajes en el formato [{"role": "user", "content": "..."}, ...]
-
-    Returns:
-        Optional[dict]: Diccionario con los datos extraídos, solo con las claves encontradas.
-    """
-
-    # Crear una instancia del parser basado en la clase DatosUsuario
-    parser = JsonOutputParser(pydantic_object=DatosUsuario)
-    format_instructions = parser.get_format_instructions()
-
-    # Crear las plantillas de prompt
-    system_prompt_template = PromptTemplate.from_template(
-        """
-        Eres un asistente profesional de AIRREGIO especializado en extraer información clave de una conversación entre un asistente y un usuario.
-        La información que extraigas será usada para ayudar a un vendedor a entender mejor la información de la conversación, llenar datos en su CRM y usarla para cerrar la venta.
-        
+# Instrucciones de extracción y catálogo de etiquetas. Se comparten entre el prompt de
+# extracción, el fusionado (extracción + calificación) y el delta. El catálogo sale de las
+# etiquetas de Odoo (sección 9); estas son las que se usan mientras no se hayan cargado.
+ETIQUETAS_PREDETERMINADAS = [
+    (1, "URGENTE"),
+    (2, "Mantenimiento"),
+    (3, "Consulta"),
+    (4, "Instalación"),
+    (5, "Otro"),
+]
+
+# Criterio para asignar cada etiqueta, por nombre en minúsculas y sin acentos. Las etiquetas
+# de Odoo que no están aquí se listan solo con su nombre.
+CRITERIOS_ETIQUETAS = {
+    "urgente": "si se menciona que es urgente",
+    "mantenimiento": "si se solicita mantenimiento",
+    "consulta": "Si solo es una consulta",
+    "instalacion": "si se requiere instalación",
+    "otro": "si es otra categoría que no es ni urgente, ni mantenimiento, ni consulta, ni instalación",
+}
+
+_INSTRUCCIONES_BASE = """
         INSTRUCCIONES:
         - Únicamente extrae información contenida en los mensajes del usuario para llenar los valores del JSON. Los valores en los mensajes del asistente no deben ser usados para llenar el JSON.
         - Si no hay información útil, no extraigas nada.
@@ -94,13 +459,45 @@ def extraer_datos_conversacion(mensajes):
         
         
         Además, debes asignar una o más etiquetas numéricas en el parámetro tag_ids basadas en el tema de la conversación:
-        1: URGENTE (si se menciona que es urgente)
-        2: Mantenimiento (si se solicita mantenimiento)
-        3: Consulta (Si solo es una consulta)
-        4: Instalación (si se requiere instalación)
-        5: Otro (si es otra categoría que no es ni urgente, ni mantenimiento, ni consulta, ni instalación)
+"""
+
 
+def instrucciones_extraccion(etiquetas):
+    """
+    Args:
+        etiquetas (List[tuple]): [(id, nombre)] de las etiquetas disponibles.
+
+    Returns:
+        str: Instrucciones de extracción con el catálogo de etiquetas al final.
+    """
+    lineas = []
+    for id_etiqueta, nombre in etiquetas:
+        criterio = CRITERIOS_ETIQUETAS.get(_sin_acentos(nombre.strip().lower()))
+        lineas.append(
+            f"        {id_etiqueta}: {nombre} ({criterio})"
+            if criterio
+            else f"        {id_etiqueta}: {nombre}"
+        )
+    return _INSTRUCCIONES_BASE + "\n".join(lineas) + "\n"
+
+
+INSTRUCCIONES_EXTRACCION = instrucciones_extraccion(ETIQUETAS_PREDETERMINADAS)
+
+
+# Prompt de extracción: se construye al cargar el módulo y otra vez solo si cambian las
+# etiquetas de Odoo
+def _registrar_prompt_extraccion(instrucciones):
+    return registrar_prompt(
+        "extraccion",
+        sistema=PromptTemplate.from_template(
+            """
+        Eres un asistente profesional de AIRREGIO especializado en extraer información clave de una conversación entre un asistente y un usuario.
+        La información que extraigas será usada para ayudar a un vendedor a entender mejor la información de la conversación, llenar datos en su CRM y usarla para cerrar la venta.
+        
+        {instrucciones_extraccion}
         Solo incluye los campos en el JSON que correspondan a información explícita en los mensajes del usuario.
+
+        **Nota:** No debes incluir las interacciones del asistente en los campos de datos. si es necesario, solo usa esas interacciones del asistente para entender mejor la solicitud del usuario.
         
         Devuelve los datos en formato JSON, siguiendo las instrucciones:
         
@@ -108,108 +505,140 @@ def extraer_datos_conversacion(mensajes):
 
         {format_instructions}
         """
+        ).format(
+            instrucciones_extraccion=instrucciones,
+            format_instructions=JsonOutputParser(
+                pydantic_object=DatosUsuario
+            ).get_format_instructions(),
+        ),
+        encabezado_usuario="Procesa la siguiente conversación y extrae los datos del usuario:\n\n",
+        parser=JsonOutputParser(pydantic_object=DatosUsuario),
     )
 
-    user_prompt_template = PromptTemplate.from_template(
-        """
-        Procesa la siguiente conversación y extrae los datos del usuario:
 
-        {mensajes}
+PROMPT_EXTRACCION = _registrar_prompt_extraccion(INSTRUCCIONES_EXTRACCION)
 
-        **Nota:** No debes incluir las interacciones del asistente en los campos de datos. si es necesario, solo usa esas interacciones del asistente para entender mejor la solicitud del usuario.
-        """
-    )
 
-    # Rellenar el contenido del mensaje del sistema y del usuario
-    system_message_content = system_prompt_template.format(
-        format_instructions=format_instructions
+# Construye el parser y los mensajes (sistema + usuario) para la extracción de datos
+def _construir_mensajes_extraccion(mensajes):
+    """
+    Prepara la lista de mensajes que se envía al LLM a partir del prompt registrado.
+
+    Args:
+        mensajes: Conversación en texto o lista de mensajes.
+
+    Returns:
+        tuple: (parser, [SystemMessage, HumanMessage], campos deterministas o None)
+    """
+    _iniciar_referencias()
+    campos = _campos_deterministas(mensajes)
+    mensajes_llm = PROMPT_EXTRACCION.mensajes(
+        preparar_conversacion(mensajes), nota=_nota_campos_conocidos(campos)
     )
+    return PROMPT_EXTRACCION.parser, mensajes_llm, campos
+
 
-    user_message_content = user_prompt_template.format(mensajes=mensajes)
+# Parsea la respuesta del LLM, elimina las claves con valor None y aplica los campos
+# encontrados por la extracción determinista
+def _parsear_extraccion(parser, contenido, campos=None):
+    # Validar y parsear la respuesta JSON
+    with span("parse_respuesta", prompt="extraccion"):
+        datos_usuario = parser.parse(contenido)
+        # Validar tipos contra el modelo; si no pasa, la cascada reintenta con el modelo fuerte
+        if getattr(parser, "pydantic_object", None) is not None:
+            datos_usuario = parser.pydantic_object.model_validate(datos_usuario).model_dump()
+
+    # Convertir a diccionario eliminando las claves con valor None
+    datos_dict = {k: v for k, v in datos_usuario.items() if v is not None}
+
+    if campos is not None:
+        aplicar_campos_deterministas(datos_dict, campos)
+    return datos_dict
+
+
+# Función para extraer los datos del usuario a partir de la conversación
+def extraer_datos_conversacion(mensajes):
+    """
+    Procesa una lista de mensajes entre el asistente y el usuario para extraer información clave.
+
+    Args:
+        mensajes (List[dict]): Lista de mensajes en el formato [{"role": "user", "content": "..."}, ...]
+
+    Returns:
+        Optional[dict]: Diccionario con los datos extraídos, solo con las claves encontradas.
+    """
+    if es_conversacion_larga(mensajes):
+        return ejecutar_async(aextraer_datos_conversacion(mensajes))
+
+    parser, mensajes_llm, campos = _construir_mensajes_extraccion(mensajes)
+
+    clave = _clave_cache(PROMPT_EXTRACCION, mensajes_llm)
+    en_cache = cache_resultados.obtener(clave)
+    if en_cache is not None:
+        return en_cache
 
     try:
         # Invocar el LLM usando SystemMessage y HumanMessage
-        json_datos_response = llm.invoke(
-            [
-                SystemMessage(content=system_message_content),
-                HumanMessage(content=user_message_content),
-            ]
+        datos_dict = _invocar_llm(
+            PROMPT_EXTRACCION,
+            mensajes_llm,
+            lambda contenido: _parsear_extraccion(parser, contenido, campos),
         )
 
-        # Validar y parsear la respuesta JSON
-        datos_usuario = parser.parse(json_datos_response.content)
-
-        # Convertir a diccionario eliminando las claves con valor None
-        datos_dict = {k: v for k, v in datos_usuario.items() if v is not None}
-
         # print(f"TOOL extraer_datos_conversacion. Datos extraídos:\n\n{datos_dict}\n\nFin datos extraídos.")
 
+        cache_resultados.guardar(clave, datos_dict)
         return datos_dict
     except Exception as e:
         print(f"Ocurrió un error al extraer los datos del usuario: {e}")
         return None
 
 
-############################## 2. Score Chat  ##############################
+# Versión asíncrona de extraer_datos_conversacion (usa llm.ainvoke)
+async def aextraer_datos_conversacion(mensajes):
+    """
+    Igual que extraer_datos_conversacion, pero sin bloquear el event loop.
 
+    Returns:
+        Optional[dict]: Diccionario con los datos extraídos o None si hubo un error.
+    """
+    if es_conversacion_larga(mensajes):
+        datos_dict, _ = await aprocesar_conversacion_larga(mensajes, calificar=False)
+        return datos_dict
 
-# Define la estructura esperada de los datos utilizando Pydantic
-class ScoreOutput(BaseModel):
-    score_total: int = Field(
-        description="Puntaje total asignado al lead según la conversación"
-    )
+    parser, mensajes_llm, campos = _construir_mensajes_extraccion(mensajes)
 
+    clave = _clave_cache(PROMPT_EXTRACCION, mensajes_llm)
+    en_cache = cache_resultados.obtener(clave)
+    if en_cache is not None:
+        return en_cache
 
-# Función para limpiar la respuesta del LLM
-def limpiar_respuesta(respuesta: str) -> str:
-    """
-    Limpia la respuesta del LLM eliminando cualquier etiqueta, texto adicional o bloques de código,
-    dejando solo el JSON válido.
-    """
     try:
-        # Eliminar cualquier bloque de código con ```json ... ```
-        json_block = re.search(r"```json\s*(\{.*?\})\s*```", respuesta, re.DOTALL)
-        if json_block:
-            return json_block.group(1).strip()
-
-        # Si no hay bloques de código, intenta extraer el JSON directamente
-        inicio = respuesta.find("{")
-        fin = respuesta.rfind("}") + 1
-        if inicio != -1 and fin != -1:
-            json_str = respuesta[inicio:fin]
-            return json_str.strip()
-
-        # Si no se encuentra un JSON válido, retornar la respuesta completa para depuración
-        return respuesta.strip()
+        datos_dict = await _ainvocar_llm(
+            PROMPT_EXTRACCION,
+            mensajes_llm,
+            lambda contenido: _parsear_extraccion(parser, contenido, campos),
+        )
+        cache_resultados.guardar(clave, datos_dict)
+        return datos_dict
     except Exception as e:
-        print(f"Error al limpiar la respuesta: {e}")
-        return respuesta.strip()
-
-
-# Función para calificar la conversación y obtener el score_total en formato JSON
-def calificar_conversacion(mensajes):
-    """
-    Procesa una lista de mensajes entre el agente y el usuario para calcular una calificación total.
+        print(f"Ocurrió un error al extraer los datos del usuario: {e}")
+        return None
 
-    Args:
-        mensajes (List[dict]): Lista de mensajes en el formato [{"role": "user", "content": "..."}, ...]
 
-    Returns:
-        Optional[dict]: Diccionario con el puntaje total, por ejemplo {"score_total": 75}.
-    """
+############################## 2. Score Chat  ##############################
 
-    # Crear una instancia del parser basado en la clase ScoreOutput
-    parser = JsonOutputParser(pydantic_object=ScoreOutput)
 
-    # Crear las plantillas de prompt
-    # Escapar las llaves en el system_prompt_template
-    system_prompt_template = PromptTemplate.from_template(
-        """
-        Eres un asistente experto en análisis de conversaciones para la calificación de leads. 
-        Tu tarea es analizar la siguiente conversación entre un lead y un agente de AIRREGIO y asignar un puntaje total basado en los factores proporcionados.
+# Define la estructura esperada de los datos utilizando Pydantic
+class ScoreOutput(BaseModel):
+    score_total: int = Field(
+        description="Puntaje total asignado al lead según la conversación"
+    )
 
-        Califica al lead según la siguiente tabla de factores. Se te pasará una conversación entre un lead y un agente:
 
+# Tabla de factores para calificar al lead. Se comparte entre el prompt de calificación
+# y el prompt fusionado (extracción + calificación).
+RUBRICA_CALIFICACION = """
         1. **Urgencia de la Solicitud** (0 a 20 puntos):
            - No hay urgencia / Sin fecha específica: 0 puntos
            - Considera hacerlo en los próximos meses: 10 puntos
@@ -242,7 +671,20 @@ def calificar_conversacion(mensajes):
            - Neutral o desinteresado: 5 puntos
            - Interesado y positivo: 10 puntos
            - Entusiasta o con alta motivación para avanzar: 15 puntos
+"""
+
 
+# Prompt de calificación: se construye una sola vez al cargar el módulo
+PROMPT_CALIFICACION = registrar_prompt(
+    "calificacion",
+    sistema=PromptTemplate.from_template(
+        """
+        Eres un asistente experto en análisis de conversaciones para la calificación de leads. 
+        Tu tarea es analizar la siguiente conversación entre un lead y un agente de AIRREGIO y asignar un puntaje total basado en los factores proporcionados.
+
+        Califica al lead según la siguiente tabla de factores. Se te pasará una conversación entre un lead y un agente:
+
+        {rubrica_calificacion}
         Suma los valores de cada factor y responde solo con el valor total del score en formato JSON. 
         No agregues ninguna explicación adicional, solamente el resultado en JSON.
 
@@ -253,47 +695,1005 @@ def calificar_conversacion(mensajes):
         }}
         ```
         """
-    )
+    ).format(rubrica_calificacion=RUBRICA_CALIFICACION),
+    encabezado_usuario="Procesa la siguiente conversación y calcula el score_total basado en los factores proporcionados:\n\n",
+    parser=JsonOutputParser(pydantic_object=ScoreOutput),
+)
 
-    user_prompt_template = PromptTemplate.from_template(
-        """
-        Procesa la siguiente conversación y calcula el score_total basado en los factores proporcionados:
 
-        {mensajes}
-        """
-    )
+# Construye el parser y los mensajes (sistema + usuario) para la calificación
+def _construir_mensajes_calificacion(mensajes):
+    """
+    Prepara la lista de mensajes que se envía al LLM a partir del prompt registrado.
+
+    Args:
+        mensajes: Conversación en texto o lista de mensajes.
+
+    Returns:
+        tuple: (parser, [SystemMessage, HumanMessage])
+    """
+    mensajes_llm = PROMPT_CALIFICACION.mensajes(preparar_conversacion(mensajes))
+    return PROMPT_CALIFICACION.parser, mensajes_llm
+
+
+# Parsea la respuesta del LLM (salida estructurada) para obtener el score
+def _parsear_calificacion(parser, contenido):
+    with span("parse_respuesta", prompt="calificacion"):
+        score_dict = parser.parse(contenido)
+    _validar_score(score_dict.get("score_total"))
+    return score_dict
+
+
+# El score_total debe ser un entero de 0 a 100; si no, la cascada reintenta con el modelo fuerte
+def _validar_score(score_total):
+    if isinstance(score_total, bool) or not isinstance(score_total, int):
+        raise ValueError(f"score_total no es un entero: {score_total!r}")
+    if not 0 <= score_total <= 100:
+        raise ValueError(f"score_total fuera de rango: {score_total}")
 
-    # Rellenar el contenido del mensaje del sistema y del usuario
-    system_message_content = system_prompt_template.format()
-    # Filtra solo HumanMessage y AIMessage, excluyendo ToolMessage
 
-    user_message_content = user_prompt_template.format(mensajes=mensajes)
+# La calificación local (reglas sobre la tabla de factores) se usa si su confianza llega a
+# este umbral; si no, se llama al LLM. AIRREGIO_CONFIANZA_LOCAL mayor que 1 la desactiva.
+CONFIANZA_CALIFICACION_LOCAL = float(os.getenv("AIRREGIO_CONFIANZA_LOCAL", "0.75"))
+
+
+def _calificacion_local(mensajes):
+    """
+    Returns:
+        Optional[dict]: {"score_total": n} si la calificación local es confiable, o None.
+        Las listas de mensajes (no texto) siempre van al LLM.
+    """
+    if CONFIANZA_CALIFICACION_LOCAL > 1 or not isinstance(mensajes, str):
+        return None
+    with span("calificacion_local") as actual:
+        resultado = calificar_local(mensajes)
+        actual.atributos.update(
+            score_total=resultado["score_total"], confianza=resultado["confianza"]
+        )
+    if resultado["confianza"] < CONFIANZA_CALIFICACION_LOCAL:
+        return None
+    return {"score_total": resultado["score_total"]}
+
+
+# Función para calificar la conversación y obtener el score_total en formato JSON
+def calificar_conversacion(mensajes):
+    """
+    Procesa una lista de mensajes entre el agente y el usuario para calcular una calificación total.
+
+    Args:
+        mensajes (List[dict]): Lista de mensajes en el formato [{"role": "user", "content": "..."}, ...]
+
+    Returns:
+        Optional[dict]: Diccionario con el puntaje total, por ejemplo {"score_total": 75}.
+    """
+    score_local = _calificacion_local(mensajes)
+    if score_local is not None:
+        return score_local
+
+    if es_conversacion_larga(mensajes):
+        return ejecutar_async(acalificar_conversacion(mensajes))
+
+    parser, mensajes_llm = _construir_mensajes_calificacion(mensajes)
+
+    clave = _clave_cache(PROMPT_CALIFICACION, mensajes_llm)
+    en_cache = cache_resultados.obtener(clave)
+    if en_cache is not None:
+        return en_cache
 
     try:
         # Invocar el LLM usando SystemMessage y HumanMessage
-        json_score_response = llm.invoke(
-            [
-                SystemMessage(content=system_message_content),
-                HumanMessage(content=user_message_content),
-            ]
+        score_dict = _invocar_llm(
+            PROMPT_CALIFICACION,
+            mensajes_llm,
+            lambda contenido: _parsear_calificacion(parser, contenido),
         )
+        cache_resultados.guardar(clave, score_dict)
+        return score_dict
+    except Exception as e:
+        print(f"Ocurrió un error al calificar la conversación: {e}")
+        return None
 
-        # Imprimir la respuesta completa del LLM para depuración
-        # print("Respuesta del LLM:", json_score_response.content)
 
-        # Limpia la respuesta para eliminar etiquetas adicionales
-        respuesta_limpia = limpiar_respuesta(json_score_response.content)
+# Versión asíncrona de calificar_conversacion (usa llm.ainvoke)
+async def acalificar_conversacion(mensajes):
+    """
+    Igual que calificar_conversacion, pero sin bloquear el event loop.
 
-        # Imprimir la respuesta limpia para depuración
-        # print("Respuesta Limpia:", respuesta_limpia)
+    Returns:
+        Optional[dict]: Diccionario con el puntaje total o None si hubo un error.
+    """
+    score_local = _calificacion_local(mensajes)
+    if score_local is not None:
+        return score_local
 
-        # Validar y parsear la respuesta JSON
-        score_output = parser.parse(respuesta_limpia)
+    if es_conversacion_larga(mensajes):
+        _, score_dict = await aprocesar_conversacion_larga(mensajes)
+        return score_dict
 
-        # Dado que score_output ya es un dict, puedes usarlo directamente
-        score_dict = score_output  # score_output es un dict
+    parser, mensajes_llm = _construir_mensajes_calificacion(mensajes)
 
+    clave = _clave_cache(PROMPT_CALIFICACION, mensajes_llm)
+    en_cache = cache_resultados.obtener(clave)
+    if en_cache is not None:
+        return en_cache
+
+    try:
+        score_dict = await _ainvocar_llm(
+            PROMPT_CALIFICACION,
+            mensajes_llm,
+            lambda contenido: _parsear_calificacion(parser, contenido),
+        )
+        cache_resultados.guardar(clave, score_dict)
         return score_dict
     except Exception as e:
         print(f"Ocurrió un error al calificar la conversación: {e}")
         return None
+
+
+############################## 3. Extracción + calificación en una sola llamada ##############################
+
+
+# Esquema combinado: los campos de DatosUsuario más el score_total de ScoreOutput
+class DatosUsuarioConScore(DatosUsuario):
+    score_total: Optional[int] = Field(
+        default=None,
+        description="Puntaje total asignado al lead según la tabla de factores",
+    )
+
+
+# Prompt del modo fusionado: igual que el de extracción, se reconstruye si cambian las etiquetas
+def _registrar_prompt_fusionado(instrucciones):
+    return registrar_prompt(
+        "fusionado",
+        sistema=PromptTemplate.from_template(
+            """
+        Eres un asistente profesional de AIRREGIO especializado en extraer información clave de una conversación entre un asistente y un usuario, y en calificar al lead.
+        La información que extraigas será usada para ayudar a un vendedor a entender mejor la información de la conversación, llenar datos en su CRM y usarla para cerrar la venta.
+
+        {instrucciones_extraccion}
+        Solo incluye los campos en el JSON que correspondan a información explícita en los mensajes del usuario.
+
+        **Nota:** No debes incluir las interacciones del asistente en los campos de datos. si es necesario, solo usa esas interacciones del asistente para entender mejor la solicitud del usuario.
+
+        Además, califica al lead en el parámetro score_total según la siguiente tabla de factores. Suma los valores de cada factor:
+
+        {rubrica_calificacion}
+        El parámetro score_total siempre debe aparecer en el JSON.
+
+        Devuelve los datos en formato JSON, siguiendo las instrucciones:
+
+        {format_instructions}
+        """
+        ).format(
+            instrucciones_extraccion=instrucciones,
+            rubrica_calificacion=RUBRICA_CALIFICACION,
+            format_instructions=JsonOutputParser(
+                pydantic_object=DatosUsuarioConScore
+            ).get_format_instructions(),
+        ),
+        encabezado_usuario="Procesa la siguiente conversación, extrae los datos del usuario y calcula el score_total:\n\n",
+        parser=JsonOutputParser(pydantic_object=DatosUsuarioConScore),
+    )
+
+
+PROMPT_FUSIONADO = _registrar_prompt_fusionado(INSTRUCCIONES_EXTRACCION)
+
+
+# Construye el parser y los mensajes para el modo fusionado
+def _construir_mensajes_fusionados(mensajes):
+    """
+    Prepara los mensajes del modo fusionado. La conversación se envía una sola vez, junto
+    con las instrucciones de extracción y la tabla de factores.
+
+    Args:
+        mensajes: Conversación en texto o lista de mensajes.
+
+    Returns:
+        tuple: (parser, [SystemMessage, HumanMessage], campos deterministas o None)
+    """
+    _iniciar_referencias()
+    campos = _campos_deterministas(mensajes)
+    mensajes_llm = PROMPT_FUSIONADO.mensajes(
+        preparar_conversacion(mensajes), nota=_nota_campos_conocidos(campos)
+    )
+    return PROMPT_FUSIONADO.parser, mensajes_llm, campos
+
+
+# Separa la respuesta fusionada en los mismos diccionarios que devuelven
+# extraer_datos_conversacion y calificar_conversacion
+def _parsear_fusionado(parser, contenido, campos=None):
+    datos_dict = _parsear_extraccion(parser, contenido, campos)
+    score_total = datos_dict.pop("score_total", None)
+    if score_total is not None:
+        _validar_score(score_total)
+    score_dict = {"score_total": score_total} if score_total is not None else None
+    return datos_dict, score_dict
+
+
+# Función para extraer los datos y calificar la conversación con una sola llamada al LLM
+def extraer_y_calificar_conversacion(mensajes):
+    """
+    Modo fusionado: obtiene los campos de DatosUsuario y el score_total en una sola llamada,
+    de modo que la conversación solo se paga una vez como tokens de entrada.
+
+    Args:
+        mensajes (List[dict]): Lista de mensajes en el formato [{"role": "user", "content": "..."}, ...]
+
+    Returns:
+        tuple: (datos_dict, score_dict) con la misma forma que devuelven extraer_datos_conversacion
+               y calificar_conversacion. Cada elemento es None si no se pudo obtener.
+    """
+    parser, mensajes_llm, campos = _construir_mensajes_fusionados(mensajes)
+
+    clave = _clave_cache(PROMPT_FUSIONADO, mensajes_llm)
+    en_cache = cache_resultados.obtener(clave)
+    if en_cache is not None:
+        return en_cache["datos"], en_cache["score"]
+
+    try:
+        datos_dict, score_dict = _invocar_llm(
+            PROMPT_FUSIONADO,
+            mensajes_llm,
+            lambda contenido: _parsear_fusionado(parser, contenido, campos),
+        )
+        if score_dict is not None:
+            cache_resultados.guardar(clave, {"datos": datos_dict, "score": score_dict})
+        return datos_dict, score_dict
+    except Exception as e:
+        print(f"Ocurrió un error al extraer y calificar la conversación: {e}")
+        return None, None
+
+
+# Versión asíncrona de extraer_y_calificar_conversacion (usa llm.ainvoke)
+async def aextraer_y_calificar_conversacion(mensajes):
+    """
+    Igual que extraer_y_calificar_conversacion, pero sin bloquear el event loop.
+
+    Returns:
+        tuple: (datos_dict, score_dict)
+    """
+    parser, mensajes_llm, campos = _construir_mensajes_fusionados(mensajes)
+
+    clave = _clave_cache(PROMPT_FUSIONADO, mensajes_llm)
+    en_cache = cache_resultados.obtener(clave)
+    if en_cache is not None:
+        return en_cache["datos"], en_cache["score"]
+
+    try:
+        datos_dict, score_dict = await _ainvocar_llm(
+            PROMPT_FUSIONADO,
+            mensajes_llm,
+            lambda contenido: _parsear_fusionado(parser, contenido, campos),
+        )
+        if score_dict is not None:
+            cache_resultados.guardar(clave, {"datos": datos_dict, "score": score_dict})
+        return datos_dict, score_dict
+    except Exception as e:
+        print(f"Ocurrió un error al extraer y calificar la conversación: {e}")
+        return None, None
+
+
+############################## 4. Pipeline (extracción + calificación) ##############################
+
+
+# Modo por defecto del pipeline: True usa una sola llamada fusionada, False las dos llamadas
+# en paralelo. Se puede cambiar con la variable de entorno AIRREGIO_MODO_FUSIONADO=1 para
+# comparar costo y latencia entre ambos caminos.
+MODO_FUSIONADO = os.getenv("AIRREGIO_MODO_FUSIONADO", "0") == "1"
+
+
+# Conversaciones casi iguales a una ya procesada (respuestas de plantilla a un anuncio,
+# reenvíos) reutilizan su resultado en lugar de llamar al LLM. AIRREGIO_DUPLICADOS=0 lo
+# desactiva; AIRREGIO_UMBRAL_DUPLICADOS es la similitud mínima (0-1).
+indice_duplicados = IndiceDuplicados(
+    umbral=float(os.getenv("AIRREGIO_UMBRAL_DUPLICADOS", "0.9")),
+    max_entradas=int(os.getenv("AIRREGIO_DUPLICADOS_MAX", "5000")),
+    habilitado=os.getenv("AIRREGIO_DUPLICADOS", "1") == "1",
+)
+
+
+def _buscar_duplicado(mensajes):
+    with span("duplicados") as actual:
+        resultado, similitud = indice_duplicados.buscar(mensajes)
+        actual.atributos.update(similitud=round(similitud, 3), reutilizado=resultado is not None)
+    return resultado
+
+
+# Solo se guardan resultados completos: si una de las llamadas falló no se reutilizan
+def _guardar_duplicado(mensajes, resultado):
+    if "score_total" in resultado and len(resultado) > 1:
+        indice_duplicados.agregar(mensajes, resultado)
+
+
+# Ejecuta la extracción y la calificación al mismo tiempo
+async def procesar_conversacion_async(mensajes, fusionado=None):
+    """
+    Lanza extracción y calificación en paralelo con llm.ainvoke y combina los resultados.
+    El tiempo total es el de la llamada más lenta, no la suma de ambas.
+
+    Args:
+        mensajes: Conversación en texto o lista de mensajes.
+        fusionado (Optional[bool]): Si es True, usa una sola llamada con el esquema combinado.
+            Si es None, se usa MODO_FUSIONADO.
+
+    Returns:
+        dict: Datos extraídos combinados con el score, por ejemplo {"contact_name": "...", "score_total": 75}.
+              Si alguna de las dos llamadas falla, su parte simplemente no aparece en el diccionario.
+    """
+    if fusionado is None:
+        fusionado = MODO_FUSIONADO
+
+    duplicado = _buscar_duplicado(mensajes)
+    if duplicado is not None:
+        return duplicado
+
+    if es_conversacion_larga(mensajes):
+        # Map-reduce: la calificación necesita el resumen, así que va después de la extracción
+        datos_conversacion, calificacion = await aprocesar_conversacion_larga(mensajes)
+    elif fusionado:
+        # Si la calificación local es confiable, basta con el prompt de extracción
+        calificacion = _calificacion_local(mensajes)
+        if calificacion is not None:
+            datos_conversacion = await aextraer_datos_conversacion(mensajes)
+        else:
+            datos_conversacion, calificacion = await aextraer_y_calificar_conversacion(
+                mensajes
+            )
+    else:
+        datos_conversacion, calificacion = await asyncio.gather(
+            aextraer_datos_conversacion(mensajes),
+            acalificar_conversacion(mensajes),
+        )
+
+    # Combinar los datos obtenidos (None se trata como diccionario vacío)
+    resultado = {**(datos_conversacion or {}), **(calificacion or {})}
+    _guardar_duplicado(mensajes, resultado)
+    return resultado
+
+
+# Event loop en un hilo de fondo compartido por todas las llamadas síncronas. Se reutiliza
+# siempre el mismo loop porque el cliente async del LLM mantiene conexiones abiertas
+# ligadas al loop donde se crearon.
+_loop_fondo = None
+_loop_fondo_lock = threading.Lock()
+
+
+def _obtener_loop_fondo():
+    global _loop_fondo
+    with _loop_fondo_lock:
+        if _loop_fondo is None:
+            _loop_fondo = asyncio.new_event_loop()
+            threading.Thread(
+                target=_loop_fondo.run_forever, name="airregio-llm-loop", daemon=True
+            ).start()
+        return _loop_fondo
+
+
+def ejecutar_async(coro):
+    """
+    Ejecuta una corrutina en el loop de fondo y espera su resultado desde código síncrono.
+    Funciona aunque el hilo que llama ya tenga su propio event loop corriendo.
+    """
+    return asyncio.run_coroutine_threadsafe(coro, _obtener_loop_fondo()).result()
+
+
+# Envoltura síncrona para usar el pipeline desde Streamlit u otro código bloqueante
+def procesar_conversacion(mensajes, fusionado=None):
+    """
+    Versión síncrona de procesar_conversacion_async.
+
+    Returns:
+        dict: Datos extraídos combinados con el score.
+    """
+    return ejecutar_async(procesar_conversacion_async(mensajes, fusionado=fusionado))
+
+
+############################## 5. Datos para el CRM ##############################
+
+
+# Convierte el resultado del pipeline en los argumentos de create_lead_full_data
+def datos_a_lead(datos):
+    """
+    Args:
+        datos (dict): Resultado de procesar_conversacion (datos extraídos + score_total).
+
+    Returns:
+        dict: Argumentos para create_lead_full_data / upsert_lead_full_data.
+    """
+    return {
+        "lead_name": datos.get("conversation_name") or "Lead sin nombre",
+        "phone_number_id": datos.get("phone"),
+        "contact_name": datos.get("contact_name"),
+        "email_from": datos.get("email_from"),
+        "partner_name": datos.get("partner_name"),
+        "description": datos.get("description"),
+        "priority": prioridad_desde_score(datos.get("score_total", 0)),
+        "tag_ids": etiquetas_validas(datos.get("tag_ids")) or None,
+        "street": datos.get("street"),
+        "stage_id": etapa_valida(datos.get("stage_id")),
+        "user_id": vendedor_valido(datos.get("user_id") or VENDEDOR_PREDETERMINADO),
+    }
+
+
+############################## 6. Conversaciones largas (map-reduce) ##############################
+
+
+# Arriba de este número de tokens la conversación se procesa por fragmentos
+UMBRAL_TOKENS_LARGO = int(os.getenv("AIRREGIO_UMBRAL_TOKENS_LARGO", "12000"))
+# Tamaño máximo de cada fragmento (siempre menor que el umbral)
+TOKENS_POR_FRAGMENTO = min(
+    int(os.getenv("AIRREGIO_TOKENS_POR_FRAGMENTO", "6000")), UMBRAL_TOKENS_LARGO // 2
+)
+
+# Campos donde el valor del fragmento más reciente gana
+_CAMPOS_ULTIMO_GANA = (
+    "contact_name",
+    "email_from",
+    "partner_name",
+    "phone",
+    "street",
+    "conversation_name",
+)
+
+
+def es_conversacion_larga(mensajes):
+    # Cada token tiene al menos un carácter: los textos cortos ni siquiera se tokenizan
+    if not isinstance(mensajes, str) or len(mensajes) <= UMBRAL_TOKENS_LARGO:
+        return False
+    modelo = getattr(llm, "model_name", None) or "gpt-4o-mini"
+    return contar_tokens(mensajes, modelo) > UMBRAL_TOKENS_LARGO
+
+
+def combinar_datos_parciales(parciales):
+    """
+    Combina los DatosUsuario extraídos de cada fragmento, en orden cronológico.
+
+    - contact_name, email_from, partner_name, phone, street, conversation_name: gana el
+      fragmento más reciente que tenga valor.
+    - tag_ids: unión de todas las etiquetas, sin repetir.
+    - description: se devuelven por separado para resumirlas después.
+
+    Returns:
+        tuple: (datos_dict, [descripciones])
+    """
+    datos = {}
+    descripciones = []
+    etiquetas = []
+    for parcial in parciales:
+        if not parcial:
+            continue
+        for campo in _CAMPOS_ULTIMO_GANA:
+            if parcial.get(campo):
+                datos[campo] = parcial[campo]
+        if parcial.get("description"):
+            descripciones.append(parcial["description"])
+        for etiqueta in parcial.get("tag_ids") or []:
+            if etiqueta not in etiquetas:
+                etiquetas.append(etiqueta)
+    if etiquetas:
+        datos["tag_ids"] = etiquetas
+    return datos, descripciones
+
+
+PROMPT_RESUMEN = registrar_prompt(
+    "resumen",
+    sistema="""
+        Eres un asistente profesional de AIRREGIO. Recibirás notas de distintas partes de una misma conversación larga con un cliente, en orden cronológico.
+        Combínalas en un solo resumen COMPLETO y útil para el vendedor: conserva fechas agendadas, cantidades, direcciones y acuerdos.
+        Si hay información contradictoria, la parte más reciente es la que vale.
+        Responde solo con el resumen, sin encabezados ni explicaciones adicionales.
+        """,
+    encabezado_usuario="",
+)
+
+
+# Une las descripciones de cada fragmento en un solo resumen para el vendedor
+async def _aresumir_descripciones(descripciones):
+    if len(descripciones) <= 1:
+        return descripciones[0] if descripciones else None
+
+    notas = "\n\n".join(
+        f"Parte {numero}:\n{descripcion}"
+        for numero, descripcion in enumerate(descripciones, start=1)
+    )
+    mensajes_llm = PROMPT_RESUMEN.mensajes(notas)
+
+    clave = _clave_cache(PROMPT_RESUMEN, mensajes_llm)
+    en_cache = cache_resultados.obtener(clave)
+    if en_cache is not None:
+        return en_cache["resumen"]
+
+    try:
+        resumen = await _ainvocar_llm(
+            PROMPT_RESUMEN, mensajes_llm, lambda contenido: contenido.strip()
+        )
+        cache_resultados.guardar(clave, {"resumen": resumen})
+        return resumen
+    except Exception as e:
+        print(f"Ocurrió un error al resumir las descripciones: {e}")
+        return "\n\n".join(descripciones)
+
+
+# Texto corto que sustituye a la conversación completa al calificar
+def _texto_para_calificar(datos):
+    etiquetas = {
+        "conversation_name": "Solicitud",
+        "partner_name": "Empresa",
+        "street": "Dirección",
+        "description": "Resumen de la conversación",
+    }
+    lineas = [
+        "Esta es una conversación larga ya resumida. Califica al lead con base en este resumen:"
+    ]
+    for campo, etiqueta in etiquetas.items():
+        if datos.get(campo):
+            lineas.append(f"{etiqueta}: {datos[campo]}")
+    return "\n".join(lineas)
+
+
+async def aprocesar_conversacion_larga(mensajes, calificar=True):
+    """
+    Procesa una conversación que excede UMBRAL_TOKENS_LARGO:
+
+    1. Map: divide la conversación en fragmentos de TOKENS_POR_FRAGMENTO y extrae DatosUsuario
+       de cada uno en paralelo.
+    2. Reduce: combina los resultados (los mensajes más recientes ganan) y resume las
+       descripciones en una sola.
+    3. Califica usando el resumen en lugar de la conversación completa.
+
+    Returns:
+        tuple: (datos_dict, score_dict); cualquiera de los dos puede ser None.
+    """
+    modelo = getattr(llm, "model_name", None) or "gpt-4o-mini"
+    fragmentos = dividir_en_fragmentos(mensajes, TOKENS_POR_FRAGMENTO, modelo)
+
+    parciales = await asyncio.gather(
+        *(aextraer_datos_conversacion(fragmento) for fragmento in fragmentos)
+    )
+    if not any(parciales):
+        return None, None
+
+    datos_dict, descripciones = combinar_datos_parciales(parciales)
+    descripcion = await _aresumir_descripciones(descripciones)
+    if descripcion:
+        datos_dict["description"] = descripcion
+
+    score_dict = None
+    if calificar:
+        score_dict = await acalificar_conversacion(_texto_para_calificar(datos_dict))
+    return datos_dict, score_dict
+
+
+############################## 7. Extracción en streaming ##############################
+
+
+# Campos ya terminados en un JSON incompleto. El modelo escribe las claves en orden, así que
+# todas menos la última ya están completas; la última se conoce al final del stream.
+def _campos_completos(contenido):
+    inicio = contenido.find("{")
+    if inicio == -1:
+        return {}
+    try:
+        parcial = parse_partial_json(contenido[inicio:])
+    except Exception:
+        return {}
+    if not isinstance(parcial, dict):
+        return {}
+    return dict(list(parcial.items())[:-1])
+
+
+# Hace stream de la respuesta del LLM y emite (campo, valor) en cuanto cada campo termina.
+# Devuelve el texto completo de la respuesta (valor de `yield from`).
+def _stream_campos(prompt, mensajes_llm, emitidos):
+    respuesta = None
+    # El stream ocupa un lugar del limitador mientras dura; un 429 no se reintenta aquí
+    # porque ya pudo haber emitido campos
+    limitador = obtener_limitador(_nombre_modelo())
+    reserva = limitador.adquirir(_tokens_estimados(llm, mensajes_llm)) if limitador else None
+    inicio = time.monotonic()
+    limitado = False
+    try:
+        with span(f"llm_{prompt.nombre}", modelo=_nombre_modelo(), stream=True) as actual:
+            for fragmento in _estructurado(llm, prompt).stream(mensajes_llm):
+                respuesta = fragmento if respuesta is None else respuesta + fragmento
+                for campo, valor in _campos_completos(respuesta.content).items():
+                    if campo not in emitidos and valor is not None:
+                        emitidos[campo] = valor
+                        yield campo, valor
+
+            if respuesta is None:
+                raise ValueError("El LLM no devolvió ninguna respuesta")
+            actual.uso_llm(respuesta)
+    except Exception as e:
+        limitado = es_limite_de_tasa(e)
+        raise
+    finally:
+        if reserva is not None:
+            limitador.liberar(
+                reserva,
+                time.monotonic() - inicio,
+                tokens_usados(respuesta) if respuesta is not None else None,
+                limitado=limitado,
+            )
+    registrar_uso(prompt.nombre, respuesta)
+    return respuesta.content
+
+
+# Parsea la respuesta del stream; si no es válida, la repara y si tampoco, la repite (sin
+# stream) con el modelo fuerte
+def _parsear_o_escalar(prompt, mensajes_llm, contenido, parsear):
+    try:
+        return parsear(contenido)
+    except Exception as e:
+        error = e
+    try:
+        return parsear(_reparar(prompt, contenido, error))
+    except Exception as e:
+        error = e
+    modelos = _modelos_cascada()
+    _escalar(prompt, modelos, 0, error)
+    return _invocar_llm(prompt, mensajes_llm, parsear, modelos=modelos[1:])
+
+
+# Teléfono y correo encontrados con expresiones regulares se emiten antes de llamar al LLM
+def _emitir_campos_deterministas(campos, emitidos):
+    if campos is None:
+        return
+    for campo in ("phone", "email_from"):
+        if campos[campo] is not None:
+            emitidos[campo] = campos[campo]
+            yield campo, campos[campo]
+
+
+# Corrige lo ya emitido con el resultado final: teléfono normalizado, fechas agregadas a la
+# descripción o valores descartados (se emiten como None)
+def _emitir_diferencias(emitidos, final):
+    for campo in emitidos.keys() - final.keys():
+        yield campo, None
+    for campo, valor in final.items():
+        if emitidos.get(campo) != valor:
+            yield campo, valor
+
+
+def extraer_datos_conversacion_stream(mensajes):
+    """
+    Versión en streaming de extraer_datos_conversacion: emite cada campo de DatosUsuario en
+    cuanto el modelo termina de escribirlo, sin esperar el JSON completo.
+
+    Args:
+        mensajes: Conversación en texto o lista de mensajes.
+
+    Yields:
+        tuple: (campo, valor). Un campo puede emitirse otra vez al final con su valor
+               corregido, o con None si se descartó.
+    """
+    if es_conversacion_larga(mensajes):
+        yield from (extraer_datos_conversacion(mensajes) or {}).items()
+        return
+
+    parser, mensajes_llm, campos = _construir_mensajes_extraccion(mensajes)
+
+    clave = _clave_cache(PROMPT_EXTRACCION, mensajes_llm)
+    en_cache = cache_resultados.obtener(clave)
+    if en_cache is not None:
+        yield from en_cache.items()
+        return
+
+    emitidos = {}
+    yield from _emitir_campos_deterministas(campos, emitidos)
+    try:
+        contenido = yield from _stream_campos(PROMPT_EXTRACCION, mensajes_llm, emitidos)
+        datos_dict = _parsear_o_escalar(
+            PROMPT_EXTRACCION,
+            mensajes_llm,
+            contenido,
+            lambda contenido: _parsear_extraccion(parser, contenido, campos),
+        )
+    except Exception as e:
+        print(f"Ocurrió un error al extraer los datos del usuario: {e}")
+        return
+
+    yield from _emitir_diferencias(emitidos, datos_dict)
+    cache_resultados.guardar(clave, datos_dict)
+
+
+def extraer_y_calificar_conversacion_stream(mensajes):
+    """
+    Versión en streaming de extraer_y_calificar_conversacion. score_total se emite como un
+    campo más.
+
+    Yields:
+        tuple: (campo, valor)
+    """
+    parser, mensajes_llm, campos = _construir_mensajes_fusionados(mensajes)
+
+    clave = _clave_cache(PROMPT_FUSIONADO, mensajes_llm)
+    en_cache = cache_resultados.obtener(clave)
+    if en_cache is not None:
+        yield from {**en_cache["datos"], **en_cache["score"]}.items()
+        return
+
+    emitidos = {}
+    yield from _emitir_campos_deterministas(campos, emitidos)
+    try:
+        contenido = yield from _stream_campos(PROMPT_FUSIONADO, mensajes_llm, emitidos)
+        datos_dict, score_dict = _parsear_o_escalar(
+            PROMPT_FUSIONADO,
+            mensajes_llm,
+            contenido,
+            lambda contenido: _parsear_fusionado(parser, contenido, campos),
+        )
+    except Exception as e:
+        print(f"Ocurrió un error al extraer y calificar la conversación: {e}")
+        return
+
+    yield from _emitir_diferencias(emitidos, {**datos_dict, **(score_dict or {})})
+    if score_dict is not None:
+        cache_resultados.guardar(clave, {"datos": datos_dict, "score": score_dict})
+
+
+def procesar_conversacion_stream(mensajes, fusionado=None):
+    """
+    Versión en streaming de procesar_conversacion. Con dos llamadas, la calificación corre en
+    el loop de fondo mientras se hace stream de la extracción y score_total se emite al final.
+
+    Yields:
+        tuple: (campo, valor)
+    """
+    duplicado = _buscar_duplicado(mensajes)
+    if duplicado is not None:
+        yield from duplicado.items()
+        return
+
+    resultado = {}
+    for campo, valor in _procesar_stream(mensajes, fusionado):
+        resultado[campo] = valor
+        yield campo, valor
+    _guardar_duplicado(mensajes, resultado)
+
+
+def _procesar_stream(mensajes, fusionado):
+    if fusionado is None:
+        fusionado = MODO_FUSIONADO
+
+    if es_conversacion_larga(mensajes):
+        datos_conversacion, calificacion = ejecutar_async(aprocesar_conversacion_larga(mensajes))
+        yield from {**(datos_conversacion or {}), **(calificacion or {})}.items()
+        return
+    if fusionado:
+        calificacion = _calificacion_local(mensajes)
+        if calificacion is None:
+            yield from extraer_y_calificar_conversacion_stream(mensajes)
+            return
+        yield from extraer_datos_conversacion_stream(mensajes)
+        yield from calificacion.items()
+        return
+
+    calificacion = asyncio.run_coroutine_threadsafe(
+        acalificar_conversacion(mensajes), _obtener_loop_fondo()
+    )
+    yield from extraer_datos_conversacion_stream(mensajes)
+    yield from (calificacion.result() or {}).items()
+
+
+############################## 8. Modo incremental (delta) ##############################
+
+
+# Prompt para actualizar el estado de un lead solo con los mensajes nuevos de la conversación
+def _registrar_prompt_delta(instrucciones):
+    return registrar_prompt(
+        "delta",
+        sistema=PromptTemplate.from_template(
+            """
+        Eres un asistente profesional de AIRREGIO que mantiene actualizada la ficha de un lead mientras la conversación con el cliente continúa.
+        Recibirás el ESTADO ANTERIOR del lead en JSON, extraído de los mensajes ya procesados, y solo los MENSAJES NUEVOS de la conversación.
+
+        Devuelve el estado COMPLETO actualizado:
+        - Conserva los valores del estado anterior que los mensajes nuevos no cambian.
+        - Si el usuario corrige un dato, usa el valor nuevo.
+        - En description integra lo nuevo al resumen anterior, sin perder fechas, cantidades ni acuerdos.
+        - Recalcula score_total con la tabla de factores considerando toda la información.
+
+        {instrucciones_extraccion}
+        **Nota:** No debes incluir las interacciones del asistente en los campos de datos. si es necesario, solo usa esas interacciones del asistente para entender mejor la solicitud del usuario.
+
+        Tabla de factores para score_total:
+
+        {rubrica_calificacion}
+        Devuelve los datos en formato JSON, siguiendo las instrucciones:
+
+        {format_instructions}
+        """
+        ).format(
+            instrucciones_extraccion=instrucciones,
+            rubrica_calificacion=RUBRICA_CALIFICACION,
+            format_instructions=JsonOutputParser(
+                pydantic_object=DatosUsuarioConScore
+            ).get_format_instructions(),
+        ),
+        encabezado_usuario="Actualiza el estado del lead con los mensajes nuevos:\n\n",
+        parser=JsonOutputParser(pydantic_object=DatosUsuarioConScore),
+    )
+
+
+PROMPT_DELTA = _registrar_prompt_delta(INSTRUCCIONES_EXTRACCION)
+
+
+async def aextraer_delta(datos_previos, mensajes_nuevos, conversacion_completa=None):
+    """
+    Actualiza datos y score a partir del estado anterior y solo los mensajes nuevos, en lugar
+    de volver a enviar toda la conversación.
+
+    Args:
+        datos_previos (dict): Resultado anterior de procesar_conversacion (con score_total).
+        mensajes_nuevos (str): Mensajes posteriores a los ya procesados, ya renderizados.
+        conversacion_completa (Optional[str]): Conversación completa; solo se usa para la
+            extracción determinista de teléfono, correo y fechas, que no llama al LLM.
+
+    Returns:
+        dict: Estado combinado (datos + score_total) o None si hubo un error.
+    """
+    _iniciar_referencias()
+    previos = {k: v for k, v in datos_previos.items() if k != "score_total"}
+    estado = json.dumps(previos, ensure_ascii=False, sort_keys=True)
+    mensajes_llm = PROMPT_DELTA.mensajes(
+        f"Estado anterior:\n{estado}\n\nMensajes nuevos:\n{mensajes_nuevos}"
+    )
+    campos = _campos_deterministas(conversacion_completa)
+
+    clave = _clave_cache(PROMPT_DELTA, mensajes_llm)
+    en_cache = cache_resultados.obtener(clave)
+    if en_cache is not None:
+        return en_cache
+
+    try:
+        datos_dict, score_dict = await _ainvocar_llm(
+            PROMPT_DELTA,
+            mensajes_llm,
+            lambda contenido: _parsear_fusionado(PROMPT_DELTA.parser, contenido, campos),
+        )
+    except Exception as e:
+        print(f"Ocurrió un error al actualizar el estado del lead: {e}")
+        return None
+
+    # Los campos que el modelo omitió conservan su valor anterior
+    resultado = {**previos, **datos_dict}
+    score_total = (score_dict or {}).get("score_total", datos_previos.get("score_total"))
+    if score_total is not None:
+        resultado["score_total"] = score_total
+    cache_resultados.guardar(clave, resultado)
+    return resultado
+
+
+############################## 9. Datos de referencia de Odoo ##############################
+
+
+# Las etiquetas del prompt y la validación de tag_ids / stage_id salen de crm.tag y crm.stage,
+# cargados con search_read y guardados con TTL (CRM.reference_data, ODOO_REFERENCE_TTL).
+# Un hilo de fondo los recarga; los prompts y datos_a_lead solo leen la copia en memoria y
+# nunca esperan a Odoo. AIRREGIO_REFERENCIAS_ODOO=0 usa ETIQUETAS_PREDETERMINADAS sin
+# consultar Odoo.
+USAR_REFERENCIAS_ODOO = os.getenv("AIRREGIO_REFERENCIAS_ODOO", "1") == "1"
+# Vendedor (res.users) asignado a los leads nuevos; vacío para dejarlos sin asignar
+VENDEDOR_PREDETERMINADO = int(os.getenv("ODOO_VENDEDOR_ID", "0")) or None
+
+_etiquetas_prompt = list(ETIQUETAS_PREDETERMINADAS)
+_etiquetas_lock = threading.Lock()
+_referencias = None
+_referencias_lock = threading.Lock()
+
+
+def _iniciar_referencias():
+    """
+    Arranca (una sola vez) el hilo que carga y recarga los datos de referencia. No bloquea:
+    hasta la primera carga se usan ETIQUETAS_PREDETERMINADAS y ninguna etapa.
+
+    Returns:
+        Optional[ReferenceData]: None si AIRREGIO_REFERENCIAS_ODOO=0.
+    """
+    global _referencias
+
+    if not USAR_REFERENCIAS_ODOO:
+        return None
+    if _referencias is None:
+        with _referencias_lock:
+            if _referencias is None:
+                from CRM.reference_data import get_reference_data
+
+                referencias = get_reference_data()
+                referencias.add_listener(lambda _: actualizar_etiquetas())
+                _referencias = referencias
+                referencias.start()
+    return _referencias
+
+
+def cargar_referencias():
+    """
+    Primera carga bloqueante de los datos de referencia, para llamarla al arrancar (fuera de
+    un event loop) y que las primeras conversaciones ya usen las etiquetas de Odoo.
+    """
+    referencias = _iniciar_referencias()
+    if referencias is not None and not referencias.loaded:
+        referencias.refresh()
+
+
+def _referencias_odoo():
+    """
+    Returns:
+        Optional[ReferenceData]: Copia en memoria de los datos de referencia, o None si están
+        desactivados o todavía no se cargan.
+    """
+    referencias = _iniciar_referencias()
+    return referencias if referencias is not None and referencias.loaded else None
+
+
+def actualizar_etiquetas():
+    """
+    Reconstruye los prompts de extracción, fusionado y delta si las etiquetas de Odoo cambiaron
+    desde la última vez. Mientras no cambien, los prompts (y su prefijo en cache) son los mismos.
+    La llama el hilo de referencias después de cada carga.
+    """
+    global INSTRUCCIONES_EXTRACCION, PROMPT_EXTRACCION, PROMPT_FUSIONADO, PROMPT_DELTA
+    global _etiquetas_prompt
+
+    referencias = _referencias_odoo()
+    etiquetas = (
+        [(etiqueta["id"], etiqueta["name"]) for etiqueta in referencias.tags()]
+        if referencias is not None
+        else []
+    ) or ETIQUETAS_PREDETERMINADAS
+
+    with _etiquetas_lock:
+        if etiquetas == _etiquetas_prompt:
+            return
+        instrucciones = instrucciones_extraccion(etiquetas)
+        PROMPT_EXTRACCION = _registrar_prompt_extraccion(instrucciones)
+        PROMPT_FUSIONADO = _registrar_prompt_fusionado(instrucciones)
+        PROMPT_DELTA = _registrar_prompt_delta(instrucciones)
+        INSTRUCCIONES_EXTRACCION = instrucciones
+        _etiquetas_prompt = list(etiquetas)
+    # Los resultados guardados usan las etiquetas anteriores
+    indice_duplicados.limpiar()
+
+
+# Solo los ids del catálogo que vio el LLM, sin repetir: un id inventado o viejo haría fallar
+# el write en Odoo
+def etiquetas_validas(tag_ids):
+    from CRM.reference_data import keep_known_ids
+
+    referencias = _referencias_odoo()
+    if referencias is not None and referencias.tags():
+        return referencias.valid_tag_ids(tag_ids)
+    # Sin etiquetas de Odoo el prompt usa las predeterminadas
+    return keep_known_ids(tag_ids, [id_etiqueta for id_etiqueta, _ in ETIQUETAS_PREDETERMINADAS])
+
+
+# Primera etapa abierta del pipeline de Odoo, o None para que Odoo use la suya por defecto
+def etapa_inicial():
+    referencias = _referencias_odoo()
+    return referencias.initial_stage_id() if referencias is not None else None
+
+
+# La etapa pedida si existe en Odoo; si no, la etapa inicial
+def etapa_valida(stage_id):
+    referencias = _referencias_odoo()
+    if stage_id is not None and referencias is not None and referencias.is_valid_stage(stage_id):
+        return stage_id
+    return etapa_inicial()
+
+
+# El vendedor si es un usuario interno de Odoo, o None para dejar el lead sin asignar
+def vendedor_valido(user_id):
+    referencias = _referencias_odoo()
+    if user_id is not None and referencias is not None:
+        if referencias.is_valid_salesperson(user_id):
+            return user_id
+    return None
+
+
+# Olvida la copia en cache (por ejemplo, después de editar etiquetas o etapas en Odoo); el hilo
+# de referencias la vuelve a cargar en segundo plano
+def invalidar_referencias():
+    referencias = _iniciar_referencias()
+    if referencias is not None:
+        referencias.invalidate()
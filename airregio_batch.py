@@ -0,0 +1,299 @@
+"""
+Procesamiento por lotes de conversaciones exportadas de WhatsApp o correo.
+
+Uso:
+    python airregio_batch.py conversaciones/ -o resultados.jsonl
+    python airregio_batch.py conversaciones.jsonl -o resultados.jsonl --concurrencia 8 --odoo upsert
+
+La entrada puede ser un directorio (un archivo .txt por conversación) o un archivo JSONL con
+objetos {"id": "...", "conversation": "..."}. Los resultados se escriben como JSON por línea y
+los ids terminados se guardan en un archivo de checkpoint, de modo que al reanudar una corrida
+interrumpida no se repiten llamadas pagadas al LLM.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import sys
+import time
+
+from airregio_agents_crm_simple import (
+    cache_resultados,
+    cargar_referencias,
+    datos_a_lead,
+    estadisticas_compactacion,
+    indice_duplicados,
+    procesar_conversacion_async,
+)
+from airregio_metricas import servir_metricas
+from airregio_prompts import estadisticas_prompts
+
+
+############################## 1. Lectura de conversaciones ##############################
+
+
+# Id estable para conversaciones que no traen uno propio
+def _id_por_contenido(texto):
+    return hashlib.sha1(texto.encode("utf-8")).hexdigest()[:16]
+
+
+# Lee un directorio archivo por archivo, sin cargarlos todos en memoria
+def _leer_directorio(ruta):
+    for nombre in sorted(os.listdir(ruta)):
+        ruta_archivo = os.path.join(ruta, nombre)
+        if not os.path.isfile(ruta_archivo) or not nombre.endswith((".txt", ".eml")):
+            continue
+        with open(ruta_archivo, encoding="utf-8", errors="replace") as archivo:
+            yield os.path.splitext(nombre)[0], archivo.read()
+
+
+# Lee un JSONL línea por línea. Acepta las claves "conversation", "conversacion" o "text"
+def _leer_jsonl(ruta):
+    with open(ruta, encoding="utf-8") as archivo:
+        for numero, linea in enumerate(archivo, start=1):
+            linea = linea.strip()
+            if not linea:
+                continue
+            try:
+                registro = json.loads(linea)
+            except json.JSONDecodeError as e:
+                print(f"Línea {numero} ignorada, JSON inválido: {e}", file=sys.stderr)
+                continue
+            texto = (
+                registro.get("conversation")
+                or registro.get("conversacion")
+                or registro.get("text")
+            )
+            if not texto:
+                print(f"Línea {numero} ignorada, no tiene conversación", file=sys.stderr)
+                continue
+            yield str(registro.get("id") or _id_por_contenido(texto)), texto
+
+
+def leer_conversaciones(ruta):
+    """
+    Generador de (id, conversación) a partir de un directorio o de un archivo JSONL.
+    """
+    if os.path.isdir(ruta):
+        return _leer_directorio(ruta)
+    return _leer_jsonl(ruta)
+
+
+############################## 2. Checkpoint ##############################
+
+
+def cargar_checkpoint(ruta):
+    if not ruta or not os.path.exists(ruta):
+        return set()
+    with open(ruta, encoding="utf-8") as archivo:
+        return {linea.strip() for linea in archivo if linea.strip()}
+
+
+############################## 3. Ejecución ##############################
+
+
+class _Salida:
+    """
+    Escribe resultados en NDJSON y marca los ids en el checkpoint. Los leads para Odoo se
+    acumulan y se envían en lotes; un id solo se marca como terminado cuando su resultado
+    (y su lead, si aplica) ya quedó guardado.
+    """
+
+    def __init__(self, ruta_salida, ruta_checkpoint, modo_odoo, lote_odoo):
+        self.salida = open(ruta_salida, "a", encoding="utf-8")
+        self.checkpoint = (
+            open(ruta_checkpoint, "a", encoding="utf-8") if ruta_checkpoint else None
+        )
+        self.modo_odoo = modo_odoo
+        self.lote_odoo = lote_odoo
+        self.pendientes = []
+        self.procesados = 0
+        self.errores = 0
+
+    async def agregar(self, registro):
+        if self.modo_odoo == "create" and registro.get("datos"):
+            self.pendientes.append(registro)
+            if len(self.pendientes) >= self.lote_odoo:
+                await self.enviar_pendientes()
+            return
+
+        if self.modo_odoo == "upsert" and registro.get("datos"):
+            await self._upsert(registro)
+        self._escribir(registro)
+
+    async def _upsert(self, registro):
+        from CRM.lead_index import upsert_lead_full_data
+
+        try:
+            lead = await asyncio.to_thread(datos_a_lead, registro["datos"])
+            registro["lead_id"] = await asyncio.to_thread(upsert_lead_full_data, **lead)
+        except Exception as e:
+            registro["error_odoo"] = str(e)
+
+    async def enviar_pendientes(self):
+        if not self.pendientes:
+            return
+        from CRM.odoo_api_calls import create_leads_bulk
+
+        lote, self.pendientes = self.pendientes, []
+        try:
+            leads = await asyncio.to_thread(lambda: [datos_a_lead(r["datos"]) for r in lote])
+            resultados = await asyncio.to_thread(create_leads_bulk, leads)
+        except Exception as e:
+            resultados = {i: {"id": None, "error": str(e)} for i in range(len(lote))}
+
+        for indice, registro in enumerate(lote):
+            resultado = resultados.get(indice, {})
+            registro["lead_id"] = resultado.get("id")
+            if resultado.get("error"):
+                registro["error_odoo"] = resultado["error"]
+            self._escribir(registro)
+
+    def _escribir(self, registro):
+        self.salida.write(json.dumps(registro, ensure_ascii=False) + "\n")
+        self.salida.flush()
+        if registro.get("error") or registro.get("error_odoo"):
+            self.errores += 1
+        elif self.checkpoint is not None:
+            # Los errores (del LLM o de Odoo) no se marcan para volver a intentarlos en la
+            # siguiente corrida; la extracción repetida suele salir del cache de resultados
+            self.checkpoint.write(registro["id"] + "\n")
+            self.checkpoint.flush()
+        self.procesados += 1
+
+    def cerrar(self):
+        self.salida.close()
+        if self.checkpoint is not None:
+            self.checkpoint.close()
+
+
+async def procesar_lote(
+    conversaciones,
+    ruta_salida,
+    concurrencia=4,
+    ruta_checkpoint=None,
+    modo_odoo="none",
+    lote_odoo=50,
+    fusionado=None,
+):
+    """
+    Procesa un iterable de (id, conversación) con a lo sumo `concurrencia` conversaciones en
+    vuelo al mismo tiempo.
+
+    Returns:
+        dict: Resumen con procesados, omitidos (ya en el checkpoint), errores (sin datos del
+              LLM o sin lead en Odoo) y segundos.
+    """
+    terminados = cargar_checkpoint(ruta_checkpoint)
+    salida = _Salida(ruta_salida, ruta_checkpoint, modo_odoo, lote_odoo)
+    semaforo = asyncio.Semaphore(concurrencia)
+    en_vuelo = set()
+    omitidos = 0
+    inicio = time.perf_counter()
+
+    async def procesar_una(id_conversacion, texto):
+        try:
+            inicio_conversacion = time.perf_counter()
+            datos = await procesar_conversacion_async(texto, fusionado=fusionado)
+            registro = {
+                "id": id_conversacion,
+                "datos": datos,
+                "segundos": round(time.perf_counter() - inicio_conversacion, 3),
+            }
+            if not datos:
+                registro["error"] = "El LLM no devolvió datos"
+            await salida.agregar(registro)
+        finally:
+            semaforo.release()
+
+    try:
+        for id_conversacion, texto in conversaciones:
+            if id_conversacion in terminados:
+                omitidos += 1
+                continue
+            # Se espera aquí para no leer más conversaciones de las que se pueden procesar
+            await semaforo.acquire()
+            tarea = asyncio.create_task(procesar_una(id_conversacion, texto))
+            en_vuelo.add(tarea)
+            tarea.add_done_callback(en_vuelo.discard)
+
+        if en_vuelo:
+            await asyncio.gather(*en_vuelo)
+        await salida.enviar_pendientes()
+    finally:
+        salida.cerrar()
+
+    return {
+        "procesados": salida.procesados,
+        "omitidos": omitidos,
+        "errores": salida.errores,
+        "segundos": round(time.perf_counter() - inicio, 3),
+        "cache": cache_resultados.estadisticas(),
+        "duplicados": indice_duplicados.estadisticas(),
+        "compactacion": dict(estadisticas_compactacion),
+        "prompts": estadisticas_prompts(),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Extrae y califica conversaciones por lotes para el CRM de AIRREGIO."
+    )
+    parser.add_argument("entrada", help="Directorio con .txt o archivo JSONL")
+    parser.add_argument(
+        "-o", "--salida", default="resultados.jsonl", help="Archivo NDJSON de resultados"
+    )
+    parser.add_argument(
+        "-c", "--concurrencia", type=int, default=4, help="Conversaciones en paralelo"
+    )
+    parser.add_argument(
+        "--checkpoint",
+        default=None,
+        help="Archivo de ids terminados (por defecto <salida>.checkpoint)",
+    )
+    parser.add_argument(
+        "--odoo",
+        choices=["none", "create", "upsert"],
+        default="none",
+        help="Enviar los leads a Odoo: create (en lotes) o upsert (actualiza si ya existe)",
+    )
+    parser.add_argument(
+        "--lote-odoo", type=int, default=50, help="Leads por llamada en modo create"
+    )
+    parser.add_argument(
+        "--fusionado",
+        action="store_true",
+        default=None,
+        help="Extraer y calificar con una sola llamada al LLM",
+    )
+    parser.add_argument(
+        "--puerto-metricas",
+        type=int,
+        default=None,
+        help="Exponer métricas de Prometheus en http://localhost:<puerto>/metrics",
+    )
+    args = parser.parse_args(argv)
+
+    if args.puerto_metricas:
+        servir_metricas(args.puerto_metricas)
+    # Etiquetas y etapas de Odoo antes de la primera conversación
+    cargar_referencias()
+
+    resumen = asyncio.run(
+        procesar_lote(
+            leer_conversaciones(args.entrada),
+            args.salida,
+            concurrencia=args.concurrencia,
+            ruta_checkpoint=args.checkpoint or args.salida + ".checkpoint",
+            modo_odoo=args.odoo,
+            lote_odoo=args.lote_odoo,
+            fusionado=args.fusionado,
+        )
+    )
+    print(json.dumps(resumen, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+import copy
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+
+############################## Cache de resultados del LLM ##############################
+
+
+# Normaliza la conversación para que variaciones triviales (espacios, saltos de línea de
+# Windows, formas Unicode) generen la misma clave
+def normalizar_conversacion(mensajes):
+    if not isinstance(mensajes, str):
+        mensajes = json.dumps(mensajes, ensure_ascii=False, sort_keys=True)
+
+    texto = unicodedata.normalize("NFC", mensajes).replace("\r\n", "\n")
+    lineas = (" ".join(linea.split()) for linea in texto.split("\n"))
+    return "\n".join(linea for linea in lineas if linea)
+
+
+# Genera la clave (sha256) a partir de todo lo que cambia la respuesta del LLM
+def clave_cache(tipo, mensajes, version_prompt, modelo, temperatura):
+    """
+    Args:
+        tipo (str): Tipo de llamada, por ejemplo "extraccion", "calificacion" o "fusionado".
+        mensajes: Conversación en texto o lista de mensajes.
+        version_prompt (str): Versión del prompt (o el propio texto del prompt de sistema).
+        modelo (str): Nombre del modelo.
+        temperatura (float): Temperatura usada en la llamada.
+
+    Returns:
+        str: Hash hexadecimal que identifica la llamada.
+    """
+    partes = [
+        tipo,
+        hashlib.sha256(str(version_prompt).encode("utf-8")).hexdigest(),
+        str(modelo),
+        repr(temperatura),
+        normalizar_conversacion(mensajes),
+    ]
+    return hashlib.sha256("\x1f".join(partes).encode("utf-8")).hexdigest()
+
+
+class CacheResultados:
+    """
+    Cache de dos niveles para resultados del LLM: un LRU en memoria y una tabla SQLite en disco.
+
+    Las entradas caducan después de `ttl_segundos` y el disco se limita a `max_entradas_disco`
+    (se eliminan primero las que llevan más tiempo sin usarse). Es seguro usarla desde varios hilos.
+    """
+
+    def __init__(
+        self,
+        ruta=".cache/airregio_llm.sqlite3",
+        max_entradas_memoria=256,
+        max_entradas_disco=10000,
+        ttl_segundos=7 * 24 * 3600,
+        habilitado=True,
+    ):
+        self.ruta = ruta
+        self.max_entradas_memoria = max_entradas_memoria
+        self.max_entradas_disco = max_entradas_disco
+        self.ttl_segundos = ttl_segundos
+        self.habilitado = habilitado
+
+        self._memoria = OrderedDict()
+        self._lock = threading.Lock()
+        self._conexion = None
+        self._contadores = {
+            "hits_memoria": 0,
+            "hits_disco": 0,
+            "misses": 0,
+            "escrituras": 0,
+            "expirados": 0,
+            "desalojados": 0,
+        }
+
+    # La conexión se abre la primera vez que se necesita
+    def _db(self):
+        if self._conexion is None:
+            directorio = os.path.dirname(self.ruta)
+            if directorio:
+                os.makedirs(directorio, exist_ok=True)
+            self._conexion = sqlite3.connect(self.ruta, check_same_thread=False)
+            self._conexion.execute("PRAGMA journal_mode=WAL")
+            self._conexion.execute(
+                """
+                CREATE TABLE IF NOT EXISTS resultados (
+                    clave TEXT PRIMARY KEY,
+                    valor TEXT NOT NULL,
+                    creado REAL NOT NULL,
+                    accedido REAL NOT NULL
+                )
+                """
+            )
+            self._conexion.execute(
+                "CREATE INDEX IF NOT EXISTS idx_resultados_accedido ON resultados (accedido)"
+            )
+            self._conexion.commit()
+        return self._conexion
+
+    def _caducado(self, creado, ahora):
+        return self.ttl_segundos is not None and ahora - creado > self.ttl_segundos
+
+    def _guardar_en_memoria(self, clave, valor, creado):
+        self._memoria[clave] = (valor, creado)
+        self._memoria.move_to_end(clave)
+        while len(self._memoria) > self.max_entradas_memoria:
+            self._memoria.popitem(last=False)
+
+    def obtener(self, clave):
+        """
+        Devuelve una copia del valor guardado o None si no existe o ya caducó.
+        """
+        if not self.habilitado:
+            return None
+
+        ahora = time.time()
+        with self._lock:
+            entrada = self._memoria.get(clave)
+            if entrada is not None:
+                valor, creado = entrada
+                if not self._caducado(creado, ahora):
+                    self._memoria.move_to_end(clave)
+                    self._contadores["hits_memoria"] += 1
+                    return copy.deepcopy(valor)
+                del self._memoria[clave]
+
+            try:
+                db = self._db()
+                fila = db.execute(
+                    "SELECT valor, creado FROM resultados WHERE clave = ?", (clave,)
+                ).fetchone()
+                if fila is not None and self._caducado(fila[1], ahora):
+                    db.execute("DELETE FROM resultados WHERE clave = ?", (clave,))
+                    db.commit()
+                    self._contadores["expirados"] += 1
+                    fila = None
+                if fila is None:
+                    self._contadores["misses"] += 1
+                    return None
+
+                db.execute(
+                    "UPDATE resultados SET accedido = ? WHERE clave = ?", (ahora, clave)
+                )
+                db.commit()
+            except sqlite3.Error as e:
+                print(f"Error al leer la cache en disco: {e}")
+                self._contadores["misses"] += 1
+                return None
+
+            valor = json.loads(fila[0])
+            self._guardar_en_memoria(clave, valor, fila[1])
+            self._contadores["hits_disco"] += 1
+            return copy.deepcopy(valor)
+
+    def guardar(self, clave, valor):
+        """
+        Guarda un valor serializable a JSON en memoria y en disco.
+        """
+        if not self.habilitado or valor is None:
+            return
+
+        ahora = time.time()
+        with self._lock:
+            self._guardar_en_memoria(clave, copy.deepcopy(valor), ahora)
+            self._contadores["escrituras"] += 1
+            try:
+                db = self._db()
+                db.execute(
+                    "INSERT OR REPLACE INTO resultados (clave, valor, creado, accedido) VALUES (?, ?, ?, ?)",
+                    (clave, json.dumps(valor, ensure_ascii=False), ahora, ahora),
+                )
+                self._desalojar(db, ahora)
+                db.commit()
+            except sqlite3.Error as e:
+                print(f"Error al escribir la cache en disco: {e}")
+
+    # Elimina las entradas caducadas y, si aún sobra, las menos usadas recientemente
+    def _desalojar(self, db, ahora):
+        if self.ttl_segundos is not None:
+            cursor = db.execute(
+                "DELETE FROM resultados WHERE creado < ?", (ahora - self.ttl_segundos,)
+            )
+            self._contadores["expirados"] += max(cursor.rowcount, 0)
+
+        total = db.execute("SELECT COUNT(*) FROM resultados").fetchone()[0]
+        exceso = total - self.max_entradas_disco
+        if exceso > 0:
+            db.execute(
+                "DELETE FROM resultados WHERE clave IN "
+                "(SELECT clave FROM resultados ORDER BY accedido ASC LIMIT ?)",
+                (exceso,),
+            )
+            self._contadores["desalojados"] += exceso
+
+    def limpiar(self):
+        """
+        Vacía ambos niveles de la cache.
+        """
+        with self._lock:
+            self._memoria.clear()
+            try:
+                db = self._db()
+                db.execute("DELETE FROM resultados")
+                db.commit()
+            except sqlite3.Error as e:
+                print(f"Error al limpiar la cache en disco: {e}")
+
+    def estadisticas(self):
+        """
+        Returns:
+            dict: Contadores de hits/misses, tasa de aciertos y tamaño de cada nivel.
+        """
+        with self._lock:
+            estadisticas = dict(self._contadores)
+            estadisticas["entradas_memoria"] = len(self._memoria)
+
+        hits = estadisticas["hits_memoria"] + estadisticas["hits_disco"]
+        consultas = hits + estadisticas["misses"]
+        estadisticas["tasa_aciertos"] = hits / consultas if consultas else 0.0
+        return estadisticas
@@ -0,0 +1,412 @@
+"""
+Calificación local del lead con la misma tabla de factores que usa el LLM
+(RUBRICA_CALIFICACION en airregio_agents_crm_simple).
+
+Cada factor se calcula con listas de palabras y patrones sobre los mensajes del usuario
+("industrial", "plataforma", "urgente", cantidades en m2, montos en pesos...). El resultado
+trae el desglose por factor y una confianza: el LLM solo se llama cuando la confianza queda
+por debajo del umbral.
+"""
+
+import re
+
+from airregio_conversacion import parsear_conversacion
+from airregio_extraccion_rapida import _sin_acentos, buscar_fechas
+
+
+############################## 1. Patrones por factor ##############################
+
+
+def _patron(*palabras):
+    return re.compile(r"\b(?:" + "|".join(palabras) + r")")
+
+
+# Cada factor: [(puntos, patrón)] de mayor a menor puntaje. Los patrones se aplican al texto
+# del usuario en minúsculas y sin acentos.
+_URGENCIA = [
+    (
+        20,
+        _patron(
+            r"urgen",
+            r"de inmediato",
+            r"inmediatamente",
+            r"lo antes posible",
+            r"cuanto antes",
+            r"lo mas pronto",
+            r"hoy mismo",
+            r"esta semana",
+            r"ya mismo",
+            r"emergencia",
+            r"asap",
+        ),
+    ),
+    (
+        15,
+        _patron(
+            r"(?:este|proximo|siguiente) mes\b",
+            r"en (?:un|1|dos|2) mes",
+            r"(?:en |dentro de )?(?:1|uno|un)\s*(?:-|a|o)\s*(?:2|dos) meses",
+            r"en (?:unas|un par de|pocas) semanas",
+            r"antes de (?:la temporada de |que empiecen las )?lluvias",
+            r"pronto\b",
+        ),
+    ),
+    (
+        10,
+        _patron(
+            r"(?:los )?proximos meses",
+            r"en (?:unos|algunos|varios) meses",
+            r"mas adelante",
+            r"(?:el )?proximo ano",
+            r"a futuro",
+            r"(?:lo )?estamos (?:considerando|planeando|evaluando)",
+        ),
+    ),
+]
+
+_TAMANO = [
+    (
+        20,
+        _patron(
+            r"cubiertas? industrial",
+            r"plataformas?\b",
+            r"sotanos?\b",
+            r"naves?\b",
+            r"bodegas?\b",
+            r"almacen",
+            r"fabricas?\b",
+            r"plantas? (?:industrial|de produccion)",
+            r"estacionamiento",
+            r"cisternas?\b",
+        ),
+    ),
+    (10, _patron(r"azoteas?\b", r"techos?\b", r"losas?\b", r"techo verde")),
+    (5, _patron(r"terrazas?\b", r"balcon", r"jardineras?\b", r"banos?\b", r"marquesinas?\b")),
+]
+
+_SECTOR = [
+    (
+        10,
+        _patron(
+            r"industrial",
+            r"fabricas?\b",
+            r"plantas? (?:industrial|de produccion)",
+            r"naves?\b",
+            r"bodegas?\b",
+            r"almacen",
+            r"manufactura",
+        ),
+    ),
+    (
+        7,
+        _patron(
+            r"comercial",
+            r"plaza\b",
+            r"locales?\b",
+            r"oficinas?\b",
+            r"tiendas?\b",
+            r"restaurante",
+            r"hotel",
+            r"escuela",
+            r"hospital",
+            r"edificio",
+            r"negocio",
+        ),
+    ),
+    (5, _patron(r"mi casa", r"casa\b", r"residencia", r"hogar", r"departamento", r"vivienda")),
+]
+
+# Presupuesto: adjetivos. Los montos en pesos se clasifican con _PRESUPUESTO_MONTOS.
+_PRESUPUESTO = [
+    (
+        15,
+        _patron(
+            r"presupuesto (?:es )?(?:alto|amplio|flexible|abierto)",
+            r"no importa (?:el )?(?:costo|precio)",
+            r"sin limite",
+            r"lo que sea necesario",
+        ),
+    ),
+    (10, _patron(r"presupuesto (?:es )?(?:medio|razonable|moderado)")),
+    (
+        5,
+        _patron(
+            r"presupuesto (?:es )?(?:bajo|limitado|ajustado|corto)",
+            r"poco presupuesto",
+            r"algo (?:economico|barato)",
+            r"lo mas (?:economico|barato)",
+        ),
+    ),
+]
+# (monto mínimo en pesos, puntos)
+_PRESUPUESTO_MONTOS = [(200_000, 15), (50_000, 10), (0, 5)]
+
+_COTIZACION = _patron(r"cotiza", r"presupuesto", r"cuanto (?:cuesta|sale|cobran)", r"precios?\b")
+_DETALLE_TECNICO = _patron(
+    r"ficha tecnica",
+    r"especificacion",
+    r"garantia",
+    r"membrana",
+    r"poliurea",
+    r"acrilico",
+    r"prefabricad",
+    r"espesor",
+    r"sistemas? de impermeabiliza",
+    r"materiales?\b",
+)
+_VISITA = _patron(r"visita", r"agendar", r"cita\b", r"inspeccion", r"nos vemos", r"vernos")
+_INTERES = _patron(
+    r"impermeabiliz",
+    r"necesit",
+    r"requer",
+    r"me interesa",
+    r"interesad",
+    r"quiero",
+    r"mantenimiento",
+)
+
+_ENTUSIASMO = _patron(
+    r"excelente",
+    r"perfecto",
+    r"genial",
+    r"me encanta",
+    r"estupendo",
+    r"con gusto",
+    r"de acuerdo",
+    r"adelante",
+)
+_POSITIVO = _patron(r"gracias", r"claro", r"si\b", r"me parece", r"ok\b", r"bien\b", r"interesad")
+_DESINTERES = _patron(
+    r"solo (?:estoy |queria )?(?:preguntando|cotizando|viendo|una idea)",
+    r"lo (?:voy a )?pensar",
+    r"muy caro",
+    r"no me interesa",
+    r"despues (?:les? )?(?:aviso|llamo|marco)",
+    r"los llamo (?:despues|luego)",
+    r"tal vez",
+)
+
+_RE_AREA = re.compile(
+    r"(\d{1,3}(?:[,.]\d{3})+|\d+(?:\.\d+)?)\s*"
+    r"(?:m2|m²|mts2|mt2|mts|metros(?: cuadrados)?)(?!\w)"
+)
+_RE_MONTO = re.compile(
+    r"(?:\$\s*(\d{1,3}(?:,\d{3})+|\d+(?:\.\d+)?)\s*(mil|k|millon(?:es)?)?"
+    r"|(\d{1,3}(?:,\d{3})+|\d+(?:\.\d+)?)\s*(mil|k|millon(?:es)?)?\s*(?:de\s+)?(?:pesos|mxn))"
+)
+_RE_EMPRESA = re.compile(r"\bs\.? ?a\.? de c\.? ?v\b|\bempresa\b")
+
+# Negación hasta dos palabras antes de la coincidencia, dentro de la misma frase:
+# "no es urgente", "sin presupuesto", "todavia no necesito"
+_RE_NEGACION = re.compile(r"\b(?:no|sin|ni|nunca|tampoco|jamas)(?:\s+\w+){0,2}\s*$")
+_RE_FIN_FRASE = re.compile(r"[.,;:!?\n]")
+
+
+############################## 2. Factores ##############################
+
+
+def _palabras(patron, texto):
+    """
+    Returns:
+        tuple: (palabras afirmadas, palabras negadas) encontradas con el patrón.
+    """
+    afirmadas, negadas = [], []
+    for m in patron.finditer(texto):
+        previo = _RE_FIN_FRASE.split(texto[max(0, m.start() - 30) : m.start()])[-1]
+        (negadas if _RE_NEGACION.search(previo) else afirmadas).append(m.group(0))
+    return afirmadas, negadas
+
+
+def _coincidencias(texto, niveles):
+    """
+    Returns:
+        tuple: ({puntos: [palabras afirmadas]} solo con los niveles que coincidieron,
+                [palabras negadas]).
+    """
+    encontrados, negadas = {}, []
+    for puntos, patron in niveles:
+        palabras, negadas_nivel = _palabras(patron, texto)
+        if palabras:
+            encontrados[puntos] = palabras
+        negadas.extend(negadas_nivel)
+    return encontrados, negadas
+
+
+def _numero(texto):
+    # "1,200" y "1.200" son miles; "12.5" es decimal
+    if re.fullmatch(r"\d{1,3}(?:[,.]\d{3})+", texto):
+        return float(re.sub(r"[,.]", "", texto))
+    return float(texto)
+
+
+def _factor(puntos, confianza, evidencia):
+    return {"puntos": puntos, "confianza": confianza, "evidencia": evidencia}
+
+
+# Una palabra clave negada ("no es urgente") no suma puntos, pero es fácil de leer mal:
+# el factor baja de confianza para que el LLM decida si la total no alcanza el umbral
+def _con_negacion(factor, negadas):
+    if not negadas:
+        return factor
+    evidencia = factor["evidencia"] + [f"(negado) {palabra}" for palabra in negadas]
+    return _factor(factor["puntos"], min(factor["confianza"], 0.4), evidencia)
+
+
+# Con varios niveles a la vez se toma el más alto, con menos confianza
+def _nivel_mas_alto(encontrados):
+    puntos = max(encontrados)
+    confianza = 0.9 if len(encontrados) == 1 else 0.6
+    return _factor(puntos, confianza, encontrados[puntos])
+
+
+def _por_niveles(texto, niveles, sin_evidencia):
+    encontrados, negadas = _coincidencias(texto, niveles)
+    factor = _nivel_mas_alto(encontrados) if encontrados else sin_evidencia
+    return _con_negacion(factor, negadas)
+
+
+def _urgencia(texto, hay_fechas):
+    encontrados, negadas = _coincidencias(texto, _URGENCIA)
+    if encontrados:
+        factor = _nivel_mas_alto(encontrados)
+    elif hay_fechas:
+        # Ya hay una fecha concreta (visita, inicio de obra): necesita hacerlo pronto
+        factor = _factor(15, 0.7, ["fecha concreta"])
+    else:
+        factor = _factor(0, 0.7, [])
+    return _con_negacion(factor, negadas)
+
+
+def _tamano(texto):
+    areas = [_numero(m.group(1)) for m in _RE_AREA.finditer(texto)]
+    if areas:
+        area = max(areas)
+        puntos = 20 if area >= 300 else 10 if area >= 60 else 5
+        return _factor(puntos, 1.0, [f"{area:g} m2"])
+    return _por_niveles(texto, _TAMANO, _factor(5, 0.3, []))
+
+
+def _sector(texto):
+    # Una razón social sin otra pista indica al menos un cliente comercial
+    empresa = [m.group(0) for m in _RE_EMPRESA.finditer(texto)]
+    sin_evidencia = _factor(7, 0.6, empresa) if empresa else _factor(5, 0.4, [])
+    return _por_niveles(texto, _SECTOR, sin_evidencia)
+
+
+def _presupuesto(texto):
+    montos = []
+    for m in _RE_MONTO.finditer(texto):
+        cantidad = _numero(m.group(1) or m.group(3))
+        multiplicador = (m.group(2) or m.group(4) or "").strip()
+        if multiplicador in ("mil", "k"):
+            cantidad *= 1_000
+        elif multiplicador.startswith("millon"):
+            cantidad *= 1_000_000
+        montos.append(cantidad)
+    if montos:
+        monto = max(montos)
+        puntos = next(p for minimo, p in _PRESUPUESTO_MONTOS if monto >= minimo)
+        return _factor(puntos, 0.9, [f"${monto:,.0f}"])
+    # La mayoría de las conversaciones no mencionan presupuesto; la tabla da 0 puntos
+    return _por_niveles(texto, _PRESUPUESTO, _factor(0, 0.85, []))
+
+
+def _interes(texto, mensajes_usuario):
+    cotizacion, negadas = _palabras(_COTIZACION, texto)
+    tecnico, negadas_tecnico = _palabras(_DETALLE_TECNICO, texto)
+    tecnico += [m.group(0) for m in _RE_AREA.finditer(texto)]
+    visita, negadas_visita = _palabras(_VISITA, texto)
+    interes, negadas_interes = _palabras(_INTERES, texto)
+    negadas += negadas_tecnico + negadas_visita + negadas_interes
+
+    if cotizacion and tecnico:
+        factor = _factor(20, 0.8, cotizacion + tecnico)
+    elif mensajes_usuario >= 3 and (visita or tecnico):
+        factor = _factor(15, 0.8, visita + tecnico)
+    elif interes or tecnico:
+        factor = _factor(10, 0.7, interes + tecnico)
+    else:
+        factor = _factor(5, 0.5, cotizacion)
+    return _con_negacion(factor, negadas)
+
+
+def _sentimiento(texto):
+    entusiasmo, negadas = _palabras(_ENTUSIASMO, texto)
+    positivo, negadas_positivo = _palabras(_POSITIVO, texto)
+    negadas += negadas_positivo
+    # Los patrones de desinterés ya incluyen su negación ("no me interesa")
+    desinteres = [m.group(0) for m in _DESINTERES.finditer(texto)]
+
+    if desinteres:
+        confianza = 0.8 if not entusiasmo else 0.5
+        factor = _factor(5, confianza, desinteres)
+    elif len(entusiasmo) + texto.count("!") >= 2:
+        factor = _factor(15, 0.7, entusiasmo)
+    elif entusiasmo or positivo:
+        factor = _factor(10, 0.7, entusiasmo + positivo)
+    else:
+        factor = _factor(5, 0.5, [])
+    return _con_negacion(factor, negadas)
+
+
+############################## 3. Calificación ##############################
+
+
+# Puntaje máximo de cada factor (igual que RUBRICA_CALIFICACION)
+MAXIMOS_FACTORES = {
+    "urgencia": 20,
+    "tamano": 20,
+    "sector": 10,
+    "presupuesto": 15,
+    "interes": 20,
+    "sentimiento": 15,
+}
+
+
+def calificar_local(mensajes):
+    """
+    Califica la conversación con la tabla de factores sin llamar al LLM.
+
+    Args:
+        mensajes: Conversación en texto (WhatsApp o correo).
+
+    Returns:
+        dict: {"score_total": int, "confianza": float entre 0 y 1,
+               "factores": {factor: {"puntos", "confianza", "evidencia"}}}.
+              La confianza total es 1 menos la fracción de los 100 puntos que depende de
+              factores inciertos: cada factor aporta (1 - su confianza) * su puntaje máximo.
+    """
+    textos, hay_fechas = [], False
+    for mensaje in parsear_conversacion(mensajes):
+        if mensaje.rol != "user":
+            continue
+        textos.append(_sin_acentos(mensaje.contenido.lower()))
+        hay_fechas = hay_fechas or bool(buscar_fechas(mensaje.contenido, mensaje.timestamp))
+    texto = "\n".join(textos)
+
+    factores = {
+        "urgencia": _urgencia(texto, hay_fechas),
+        "tamano": _tamano(texto),
+        "sector": _sector(texto),
+        "presupuesto": _presupuesto(texto),
+        "interes": _interes(texto, len(textos)),
+        "sentimiento": _sentimiento(texto),
+    }
+    incertidumbre = sum(
+        (1 - factor["confianza"]) * MAXIMOS_FACTORES[nombre]
+        for nombre, factor in factores.items()
+    )
+    return {
+        "score_total": sum(factor["puntos"] for factor in factores.values()),
+        "confianza": round(1 - incertidumbre / sum(MAXIMOS_FACTORES.values()), 3),
+        "factores": factores,
+    }
+
+
+# Prioridad del lead en Odoo a partir del score_total
+def prioridad_desde_score(score_total):
+    if score_total < 34:
+        return "1"
+    if score_total <= 66:
+        return "2"
+    return "3"
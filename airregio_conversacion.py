@@ -0,0 +1,358 @@
+import re
+import threading
+from datetime import datetime
+from typing import Iterable, Iterator, Literal, Optional, Union
+
+from pydantic import BaseModel
+
+try:
+    import tiktoken
+except ImportError:  # pragma: no cover - tiktoken viene con langchain-openai
+    tiktoken = None
+
+
+############################## 1. Mensajes ##############################
+
+
+# Un mensaje de la conversación, ya separado de su encabezado
+class MensajeConversacion(BaseModel):
+    timestamp: Optional[datetime] = None
+    hablante: str
+    rol: Literal["user", "assistant"]
+    contenido: str
+
+
+# Palabras que marcan a un hablante del lado de AIRREGIO (el resto son mensajes del usuario).
+# Se comparan como palabras completas: "Asistente AIRREGIO" es el asistente, "Jorge Botello" no.
+HABLANTES_ASISTENTE = ("asistente", "assistant", "airregio", "agente", "bot")
+
+
+def _es_asistente(hablante, hablantes_asistente):
+    hablante = hablante.lower()
+    return any(
+        re.search(r"\b" + re.escape(nombre.lower()) + r"\b", hablante)
+        for nombre in hablantes_asistente
+    )
+
+
+############################## 2. Parser ##############################
+
+
+# [10:15 am, 26/10/2024] Fernanda: Hola  (WhatsApp iOS / web)
+_RE_WHATSAPP_CORCHETES = re.compile(
+    r"^\[(?P<hora>\d{1,2}:\d{2}(?::\d{2})?\s*(?:[aApP]\.?\s?[mM]\.?)?),?\s*"
+    r"(?P<fecha>\d{1,2}/\d{1,2}/\d{2,4})\]\s*(?P<hablante>[^:]{1,60}):\s?(?P<texto>.*)$"
+)
+# 26/10/24, 10:15 - Fernanda: Hola  (WhatsApp Android)
+_RE_WHATSAPP_GUION = re.compile(
+    r"^(?P<fecha>\d{1,2}/\d{1,2}/\d{2,4}),?\s+(?P<hora>\d{1,2}:\d{2}(?::\d{2})?\s*"
+    r"(?:[aApP]\.?\s?[mM]\.?)?)\s+-\s+(?P<hablante>[^:]{1,60}):\s?(?P<texto>.*)$"
+)
+# De: Fernanda García <fernanda@empresa.com>  /  From: ...
+_RE_EMAIL_DE = re.compile(r"^\s*(?:De|From)\s*:\s*(?P<hablante>.+?)\s*$", re.IGNORECASE)
+# Enviado: / Sent: / Date: / Fecha:
+_RE_EMAIL_FECHA = re.compile(
+    r"^\s*(?:Enviado|Sent|Date|Fecha)\s*:\s*(?P<fecha>.+?)\s*$", re.IGNORECASE
+)
+# Encabezados de correo que no aportan nada al modelo
+_RE_EMAIL_OTROS = re.compile(
+    r"^\s*(?:Para|To|CC|CCO|BCC|Asunto|Subject)\s*:", re.IGNORECASE
+)
+_RE_EMAIL_SEPARADOR = re.compile(
+    r"^\s*(?:-{2,}\s*(?:Original Message|Mensaje original|Forwarded message|Mensaje reenviado)\s*-{2,}"
+    r"|(?:El|On)\s.+(?:escribió|wrote):)\s*$",
+    re.IGNORECASE,
+)
+
+
+def _parsear_fecha_whatsapp(fecha, hora):
+    # Se arma a mano: datetime.strptime con varios formatos es lo más lento del parser
+    try:
+        dia, mes, anio = (int(parte) for parte in fecha.split("/"))
+        hora = hora.lower().replace(".", "").replace(" ", "")
+        sufijo = hora[-2:] if hora.endswith(("am", "pm")) else None
+        partes = [int(parte) for parte in (hora[:-2] if sufijo else hora).split(":")]
+        horas, minutos = partes[0], partes[1]
+        segundos = partes[2] if len(partes) > 2 else 0
+        if sufijo == "pm" and horas < 12:
+            horas += 12
+        elif sufijo == "am" and horas == 12:
+            horas = 0
+        return datetime(anio + 2000 if anio < 100 else anio, mes, dia, horas, minutos, segundos)
+    except ValueError:
+        return None
+
+
+def parsear_conversacion(
+    texto: Union[str, Iterable[str]], hablantes_asistente=HABLANTES_ASISTENTE
+) -> Iterator[MensajeConversacion]:
+    """
+    Convierte una conversación de WhatsApp o una cadena de correos en mensajes tipados.
+
+    Recorre el texto línea por línea y va entregando cada mensaje en cuanto termina, así que
+    también acepta un archivo abierto o cualquier iterable de líneas.
+
+    Args:
+        texto: Conversación completa o iterable de líneas.
+        hablantes_asistente: Palabras del nombre que identifican al lado de AIRREGIO.
+
+    Yields:
+        MensajeConversacion: Un mensaje por turno. Las líneas sin encabezado se agregan al
+        mensaje anterior; las líneas citadas de correo (">") se descartan.
+    """
+    if isinstance(texto, str):
+        texto = texto.splitlines()
+
+    actual = None  # (timestamp, hablante, [líneas])
+    fecha_correo = None
+
+    def cerrar(actual):
+        timestamp, hablante, lineas = actual
+        contenido = "\n".join(lineas).strip()
+        if not contenido:
+            return None
+        rol = "assistant" if _es_asistente(hablante, hablantes_asistente) else "user"
+        return MensajeConversacion(
+            timestamp=timestamp, hablante=hablante, rol=rol, contenido=contenido
+        )
+
+    for linea in texto:
+        linea = linea.rstrip("\r\n")
+
+        coincidencia = _RE_WHATSAPP_CORCHETES.match(linea) or _RE_WHATSAPP_GUION.match(
+            linea
+        )
+        if coincidencia:
+            if actual is not None and (mensaje := cerrar(actual)) is not None:
+                yield mensaje
+            actual = (
+                _parsear_fecha_whatsapp(coincidencia["fecha"], coincidencia["hora"]),
+                coincidencia["hablante"].strip(),
+                [coincidencia["texto"]],
+            )
+            continue
+
+        coincidencia = _RE_EMAIL_DE.match(linea)
+        if coincidencia:
+            if actual is not None and (mensaje := cerrar(actual)) is not None:
+                yield mensaje
+            hablante = re.sub(r"\s*<[^>]*>", "", coincidencia["hablante"]).strip('" ')
+            actual = (None, hablante or coincidencia["hablante"], [])
+            fecha_correo = None
+            continue
+
+        if actual is not None and not actual[2] and fecha_correo is None:
+            coincidencia = _RE_EMAIL_FECHA.match(linea)
+            if coincidencia:
+                fecha_correo = coincidencia["fecha"]
+                continue
+
+        if (
+            _RE_EMAIL_OTROS.match(linea)
+            or _RE_EMAIL_SEPARADOR.match(linea)
+            or linea.lstrip().startswith(">")
+        ):
+            continue
+
+        if actual is None:
+            # Texto antes del primer encabezado: se atribuye al usuario
+            actual = (None, "Usuario", [])
+        actual[2].append(linea)
+
+    if actual is not None and (mensaje := cerrar(actual)) is not None:
+        yield mensaje
+
+
+############################## 3. Conteo de tokens ##############################
+
+
+_codificadores = {}
+_codificadores_lock = threading.Lock()
+
+
+def _obtener_codificador(modelo):
+    with _codificadores_lock:
+        if modelo not in _codificadores:
+            codificador = None
+            if tiktoken is not None:
+                try:
+                    try:
+                        codificador = tiktoken.encoding_for_model(modelo)
+                    except KeyError:
+                        codificador = tiktoken.get_encoding("o200k_base")
+                except Exception as e:
+                    # tiktoken descarga el vocabulario la primera vez; sin red se estima
+                    print(f"No se pudo cargar tiktoken, se estimarán los tokens: {e}")
+            _codificadores[modelo] = codificador
+        return _codificadores[modelo]
+
+
+def contar_tokens(texto, modelo="gpt-4o-mini"):
+    """
+    Cuenta tokens con tiktoken; si no está disponible, estima 4 caracteres por token.
+    """
+    codificador = _obtener_codificador(modelo)
+    if codificador is None:
+        return len(texto) // 4
+    return len(codificador.encode(texto, disallowed_special=()))
+
+
+############################## 4. Compactación ##############################
+
+
+def _recortar(texto, max_caracteres):
+    if max_caracteres is None or len(texto) <= max_caracteres:
+        return texto
+    corte = texto.rfind(" ", 0, max_caracteres)
+    return texto[: corte if corte > max_caracteres // 2 else max_caracteres].rstrip() + "…"
+
+
+def renderizar_compacto(
+    mensajes: Iterable[MensajeConversacion],
+    max_caracteres_asistente=200,
+    omitir_asistente=False,
+):
+    """
+    Escribe los mensajes en un formato corto para el prompt:
+
+        [26/10/2024]
+        10:15 Fernanda: Hola, buenos días...
+        10:16 Asistente (contexto): ¡Hola, Fernanda! Buenos días. Claro que sí…
+
+    La fecha solo se repite cuando cambia, los mensajes consecutivos del mismo hablante se
+    unen, los duplicados exactos se descartan y los turnos del asistente se recortan a
+    `max_caracteres_asistente` (o se omiten por completo con `omitir_asistente`).
+    """
+    lineas = []
+    fecha_anterior = None
+    anterior = None  # (hablante, contenido)
+
+    for mensaje in mensajes:
+        contenido = " ".join(mensaje.contenido.split())
+        if mensaje.rol == "assistant":
+            if omitir_asistente:
+                continue
+            contenido = _recortar(contenido, max_caracteres_asistente)
+
+        if anterior == (mensaje.hablante, contenido):
+            continue
+
+        prefijo = ""
+        if mensaje.timestamp is not None:
+            fecha = mensaje.timestamp.strftime("%d/%m/%Y")
+            if fecha != fecha_anterior:
+                lineas.append(f"[{fecha}]")
+                fecha_anterior = fecha
+                # Después del encabezado el mensaje va en su propia línea, aunque sea del mismo hablante
+                anterior = None
+            prefijo = mensaje.timestamp.strftime("%H:%M") + " "
+
+        if anterior is not None and anterior[0] == mensaje.hablante and lineas:
+            lineas[-1] += " " + contenido
+        else:
+            etiqueta = mensaje.hablante
+            if mensaje.rol == "assistant":
+                etiqueta += " (contexto)"
+            lineas.append(f"{prefijo}{etiqueta}: {contenido}")
+        anterior = (mensaje.hablante, contenido)
+
+    return "\n".join(lineas)
+
+
+def compactar_conversacion(
+    texto,
+    max_caracteres_asistente=200,
+    omitir_asistente=False,
+    modelo="gpt-4o-mini",
+):
+    """
+    Parsea y compacta una conversación antes de enviarla al LLM.
+
+    Returns:
+        tuple: (texto_compacto, estadisticas) donde estadisticas incluye tokens_antes,
+               tokens_despues, mensajes y ahorro (fracción de tokens eliminados). Si el texto
+               no tiene encabezados reconocibles se devuelve sin cambios.
+    """
+    mensajes = list(parsear_conversacion(texto))
+    tokens_antes = contar_tokens(texto, modelo)
+
+    if not mensajes or (len(mensajes) == 1 and mensajes[0].timestamp is None):
+        compacto = texto
+    else:
+        compacto = renderizar_compacto(
+            mensajes,
+            max_caracteres_asistente=max_caracteres_asistente,
+            omitir_asistente=omitir_asistente,
+        )
+
+    tokens_despues = contar_tokens(compacto, modelo)
+    return compacto, {
+        "mensajes": len(mensajes),
+        "tokens_antes": tokens_antes,
+        "tokens_despues": tokens_despues,
+        "ahorro": 1 - tokens_despues / tokens_antes if tokens_antes else 0.0,
+    }
+
+
+############################## 5. Fragmentos para conversaciones largas ##############################
+
+
+# Escribe el mensaje con un encabezado que parsear_conversacion vuelve a reconocer
+def renderizar_mensaje(mensaje: MensajeConversacion):
+    if mensaje.timestamp is not None:
+        encabezado = mensaje.timestamp.strftime("[%H:%M, %d/%m/%Y]")
+        return f"{encabezado} {mensaje.hablante}: {mensaje.contenido}"
+    return f"De: {mensaje.hablante}\n{mensaje.contenido}"
+
+
+def _partir_texto(texto, max_tokens, modelo):
+    # Último recurso para un solo mensaje enorme: cortar por párrafos y, si hace falta, por caracteres
+    max_caracteres = max_tokens * 4
+    partes, actual = [], ""
+    for parrafo in texto.split("\n"):
+        while len(parrafo) > max_caracteres:
+            partes.append(parrafo[:max_caracteres])
+            parrafo = parrafo[max_caracteres:]
+        candidato = f"{actual}\n{parrafo}" if actual else parrafo
+        if actual and contar_tokens(candidato, modelo) > max_tokens:
+            partes.append(actual)
+            actual = parrafo
+        else:
+            actual = candidato
+    if actual:
+        partes.append(actual)
+    return partes
+
+
+def dividir_en_fragmentos(texto, max_tokens=6000, modelo="gpt-4o-mini"):
+    """
+    Divide una conversación en fragmentos de a lo sumo `max_tokens`, sin partir mensajes.
+
+    Cada fragmento conserva los encabezados de sus mensajes, así que se puede procesar igual
+    que una conversación completa. Se respeta el orden original.
+
+    Returns:
+        List[str]: Fragmentos en orden cronológico.
+    """
+    mensajes = list(parsear_conversacion(texto))
+    if len(mensajes) <= 1:
+        return _partir_texto(texto, max_tokens, modelo)
+
+    fragmentos, actual, tokens_actual = [], [], 0
+    for mensaje in mensajes:
+        renderizado = renderizar_mensaje(mensaje)
+        tokens = contar_tokens(renderizado, modelo)
+        if tokens > max_tokens:
+            if actual:
+                fragmentos.append("\n".join(actual))
+                actual, tokens_actual = [], 0
+            fragmentos.extend(_partir_texto(renderizado, max_tokens, modelo))
+            continue
+        if actual and tokens_actual + tokens > max_tokens:
+            fragmentos.append("\n".join(actual))
+            actual, tokens_actual = [], 0
+        actual.append(renderizado)
+        tokens_actual += tokens
+    if actual:
+        fragmentos.append("\n".join(actual))
+    return fragmentos
@@ -0,0 +1,235 @@
+"""
+Índice local de conversaciones casi duplicadas (respuestas de plantilla a un anuncio, copias
+reenviadas de la misma solicitud).
+
+Cada conversación se reduce a los mensajes del usuario normalizados (sin encabezados, fechas,
+acentos, teléfonos ni correos) y se firma con MinHash sobre shingles de 3 palabras. Las firmas
+se agrupan por bandas (LSH), así que una búsqueda solo compara contra los candidatos que
+comparten alguna banda. Si la similitud estimada supera el umbral, se reutiliza el resultado
+guardado y solo se corrigen el nombre, el teléfono, el correo y las fechas de la conversación
+nueva. Todo corre en memoria y sin APIs; las entradas menos usadas se desalojan al llegar a
+`max_entradas`.
+"""
+
+import copy
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from airregio_conversacion import parsear_conversacion
+from airregio_extraccion_rapida import (
+    _RE_CORREO,
+    _RE_TELEFONO,
+    _sin_acentos,
+    aplicar_campos_deterministas,
+    extraer_campos_deterministas,
+)
+
+
+############################## 1. Normalización y firma ##############################
+
+
+_RE_PALABRA = re.compile(r"[a-z0-9]+")
+# Nota que aplicar_campos_deterministas agrega al final de description
+_RE_NOTA_FECHAS = re.compile(r"\s*Fechas mencionadas por el cliente: [^\n]*\.\s*$")
+
+TAMANO_SHINGLE = 3
+# Por debajo de este número de shingles la conversación es demasiado corta para compararla
+MIN_SHINGLES = 3
+
+
+def normalizar_mensajes_usuario(mensajes):
+    """
+    Returns:
+        tuple: (palabras, hablante). Las palabras de los mensajes del usuario en minúsculas,
+               sin acentos, teléfonos ni correos, y el nombre del primer hablante del usuario.
+    """
+    textos, hablante = [], None
+    for mensaje in parsear_conversacion(mensajes):
+        if mensaje.rol != "user":
+            continue
+        hablante = hablante or mensaje.hablante
+        texto = _RE_CORREO.sub(" ", mensaje.contenido)
+        textos.append(_RE_TELEFONO.sub(" ", texto))
+    palabras = _RE_PALABRA.findall(_sin_acentos(" ".join(textos).lower()))
+    return palabras, hablante
+
+
+def _hashes_shingles(palabras):
+    shingles = {
+        " ".join(palabras[i : i + TAMANO_SHINGLE])
+        for i in range(len(palabras) - TAMANO_SHINGLE + 1)
+    }
+    return np.fromiter(
+        (
+            int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "little")
+            for s in shingles
+        ),
+        dtype=np.uint64,
+        count=len(shingles),
+    )
+
+
+############################## 2. Índice ##############################
+
+
+class IndiceDuplicados:
+    """
+    Args:
+        umbral (float): Similitud de Jaccard estimada (0-1) a partir de la cual dos
+            conversaciones se consideran la misma.
+        max_entradas (int): Conversaciones guardadas; al pasarse se desaloja la menos usada.
+        num_permutaciones (int): Largo de la firma MinHash.
+        bandas (int): Bandas LSH; num_permutaciones debe ser múltiplo de bandas.
+        habilitado (bool): Si es False, buscar() nunca encuentra nada y agregar() no guarda.
+    """
+
+    def __init__(
+        self,
+        umbral=0.9,
+        max_entradas=5000,
+        num_permutaciones=128,
+        bandas=32,
+        habilitado=True,
+        semilla=1,
+    ):
+        if num_permutaciones % bandas:
+            raise ValueError("num_permutaciones debe ser múltiplo de bandas")
+        self.umbral = umbral
+        self.max_entradas = max_entradas
+        self.num_permutaciones = num_permutaciones
+        self.bandas = bandas
+        self.habilitado = habilitado
+
+        # Hash multiplicativo (a * x + b) mod 2^64 por permutación; se usan los 32 bits altos
+        generador = np.random.default_rng(semilla)
+        self._a = generador.integers(1, 2**63, num_permutaciones, dtype=np.uint64) | np.uint64(1)
+        self._b = generador.integers(0, 2**63, num_permutaciones, dtype=np.uint64)
+
+        self._entradas = OrderedDict()  # id -> (firma, claves de banda, resultado, hablante)
+        self._cubetas = {}  # clave de banda -> {id}
+        self._siguiente_id = 0
+        self._lock = threading.Lock()
+        self._contadores = {"consultas": 0, "aciertos": 0, "agregados": 0, "desalojados": 0}
+
+    def firmar(self, palabras):
+        """
+        Returns:
+            Optional[np.ndarray]: Firma MinHash, o None si el texto es demasiado corto.
+        """
+        hashes = _hashes_shingles(palabras)
+        if len(hashes) < MIN_SHINGLES:
+            return None
+        with np.errstate(over="ignore"):
+            permutados = self._a[:, None] * hashes[None, :] + self._b[:, None]
+        return (permutados >> np.uint64(32)).min(axis=1).astype(np.uint32)
+
+    def _claves_bandas(self, firma):
+        filas = self.num_permutaciones // self.bandas
+        return [
+            (banda, firma[banda * filas : (banda + 1) * filas].tobytes())
+            for banda in range(self.bandas)
+        ]
+
+    def _preparar(self, mensajes):
+        if not self.habilitado or not isinstance(mensajes, str):
+            return None, None
+        palabras, hablante = normalizar_mensajes_usuario(mensajes)
+        return self.firmar(palabras), hablante
+
+    def buscar(self, mensajes):
+        """
+        Busca una conversación casi igual ya procesada.
+
+        Returns:
+            tuple: (resultado, similitud). resultado es una copia del resultado guardado con
+                   nombre, teléfono, correo y fechas tomados de `mensajes`, o None si no hay
+                   ninguna por encima del umbral.
+        """
+        firma, hablante = self._preparar(mensajes)
+        if firma is None:
+            return None, 0.0
+
+        with self._lock:
+            self._contadores["consultas"] += 1
+            candidatos = set()
+            for clave in self._claves_bandas(firma):
+                candidatos.update(self._cubetas.get(clave, ()))
+
+            mejor, similitud = None, 0.0
+            for id_entrada in candidatos:
+                parecido = float(np.mean(self._entradas[id_entrada][0] == firma))
+                if parecido > similitud:
+                    mejor, similitud = id_entrada, parecido
+            if mejor is None or similitud < self.umbral:
+                return None, similitud
+
+            self._entradas.move_to_end(mejor)
+            self._contadores["aciertos"] += 1
+            _, _, resultado, hablante_guardado = self._entradas[mejor]
+            resultado = copy.deepcopy(resultado)
+
+        return _parchar(resultado, mensajes, hablante_guardado, hablante), similitud
+
+    def agregar(self, mensajes, resultado):
+        """
+        Guarda el resultado (datos + score) de una conversación ya procesada.
+        """
+        if not resultado:
+            return
+        firma, hablante = self._preparar(mensajes)
+        if firma is None:
+            return
+
+        claves = self._claves_bandas(firma)
+        with self._lock:
+            id_entrada = self._siguiente_id
+            self._siguiente_id += 1
+            self._entradas[id_entrada] = (firma, claves, copy.deepcopy(resultado), hablante)
+            for clave in claves:
+                self._cubetas.setdefault(clave, set()).add(id_entrada)
+            self._contadores["agregados"] += 1
+
+            while len(self._entradas) > self.max_entradas:
+                viejo, (_, claves_viejas, _, _) = self._entradas.popitem(last=False)
+                for clave in claves_viejas:
+                    cubeta = self._cubetas.get(clave)
+                    if cubeta is not None:
+                        cubeta.discard(viejo)
+                        if not cubeta:
+                            del self._cubetas[clave]
+                self._contadores["desalojados"] += 1
+
+    def limpiar(self):
+        with self._lock:
+            self._entradas.clear()
+            self._cubetas.clear()
+
+    def estadisticas(self):
+        with self._lock:
+            estadisticas = dict(self._contadores)
+            estadisticas["entradas"] = len(self._entradas)
+        consultas = estadisticas["consultas"]
+        estadisticas["tasa_aciertos"] = (
+            estadisticas["aciertos"] / consultas if consultas else 0.0
+        )
+        return estadisticas
+
+
+############################## 3. Ajuste del resultado reutilizado ##############################
+
+
+def _parchar(resultado, mensajes, hablante_guardado, hablante):
+    """
+    Adapta el resultado de la conversación original a la nueva: el nombre de contacto si era
+    el del hablante, y teléfono, correo y fechas con las expresiones regulares.
+    """
+    if hablante and hablante_guardado and resultado.get("contact_name") == hablante_guardado:
+        resultado["contact_name"] = hablante
+
+    if resultado.get("description"):
+        resultado["description"] = _RE_NOTA_FECHAS.sub("", resultado["description"])
+    return aplicar_campos_deterministas(resultado, extraer_campos_deterministas(mensajes))
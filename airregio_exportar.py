@@ -0,0 +1,348 @@
+"""
+Exportación de leads de Odoo a archivos Parquet o CSV para analizar la calidad de la
+calificación.
+
+Uso:
+    python airregio_exportar.py exportaciones/ --formato parquet
+    python airregio_exportar.py exportaciones/ --formato csv --resultados resultados.jsonl
+
+Los leads se leen por páginas con search_read (solo las columnas necesarias) en orden de
+write_date y se escriben página por página, así que la memoria no crece con el número de
+leads. A cada lead se le agregan el score y las etiquetas extraídas localmente (estados de
+airregio_incremental y resultados NDJSON de airregio_batch), unidos por lead_id.
+
+Cada corrida escribe un archivo nuevo (leads-<fecha>.parquet) con los leads que cambiaron
+desde la anterior y guarda el cursor (write_date, id) en _cursor.json. Un lead que cambió
+varias veces aparece en varios archivos: la versión vigente es la de mayor write_date.
+"""
+
+import argparse
+import csv
+import json
+import os
+import sqlite3
+import sys
+from datetime import datetime
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - pyarrow solo hace falta para --formato parquet
+    pa = None
+
+from airregio_calificacion_local import prioridad_desde_score
+from CRM.lead_export import export_changed_leads
+
+
+############################## 1. Columnas ##############################
+
+
+# (columna, tipo). Las columnas de Odoo salen de CRM.lead_export.flatten_lead
+COLUMNAS = [
+    ("id", "int"),
+    ("name", "str"),
+    ("create_date", "str"),
+    ("write_date", "str"),
+    ("active", "bool"),
+    ("stage_id", "int"),
+    ("stage_name", "str"),
+    ("user_id", "int"),
+    ("user_name", "str"),
+    ("priority", "str"),
+    ("tag_ids", "str"),
+    ("partner_name", "str"),
+    ("contact_name", "str"),
+    ("phone", "str"),
+    ("email_from", "str"),
+    ("street", "str"),
+    # Resultado local de la conversación que creó o actualizó el lead
+    ("id_conversacion", "str"),
+    ("score_total", "int"),
+    ("prioridad_score", "str"),
+    ("tag_ids_extraidos", "str"),
+    ("origen_local", "str"),
+]
+
+
+############################## 2. Registros locales ##############################
+
+
+class RegistrosLocales:
+    """
+    Score y etiquetas extraídas por lead_id, en una base SQLite temporal en disco para que
+    la unión no cargue todos los registros en memoria.
+    """
+
+    def __init__(self):
+        # "" abre una base temporal en disco que SQLite borra al cerrarla
+        self._db = sqlite3.connect("")
+        self._db.execute(
+            """
+            CREATE TABLE locales (
+                lead_id INTEGER PRIMARY KEY,
+                id_conversacion TEXT,
+                score_total INTEGER,
+                tag_ids TEXT,
+                origen TEXT NOT NULL
+            )
+            """
+        )
+        self.cargados = 0
+
+    def _guardar(self, lead_id, id_conversacion, datos, origen):
+        if not isinstance(lead_id, int) or not isinstance(datos, dict):
+            return
+        score_total = datos.get("score_total")
+        tag_ids = datos.get("tag_ids")
+        self._db.execute(
+            "INSERT OR REPLACE INTO locales VALUES (?, ?, ?, ?, ?)",
+            (
+                lead_id,
+                id_conversacion,
+                score_total if isinstance(score_total, int) else None,
+                ",".join(map(str, tag_ids)) if tag_ids else None,
+                origen,
+            ),
+        )
+        self.cargados += 1
+
+    # NDJSON de airregio_batch: {"id": ..., "datos": {...}, "lead_id": ...}
+    def cargar_resultados(self, ruta):
+        with open(ruta, encoding="utf-8") as archivo:
+            for numero, linea in enumerate(archivo, start=1):
+                if not linea.strip():
+                    continue
+                try:
+                    registro = json.loads(linea)
+                except json.JSONDecodeError as e:
+                    print(f"{ruta}, línea {numero} ignorada: {e}", file=sys.stderr)
+                    continue
+                self._guardar(
+                    registro.get("lead_id"), registro.get("id"), registro.get("datos"), "lote"
+                )
+        self._db.commit()
+
+    # Tabla conversaciones de airregio_incremental; los estados más recientes quedan al final
+    def cargar_estados(self, ruta):
+        if not os.path.exists(ruta):
+            return
+        origen = sqlite3.connect(f"file:{ruta}?mode=ro", uri=True)
+        try:
+            filas = origen.execute(
+                "SELECT id_conversacion, datos, lead_id FROM conversaciones "
+                "WHERE lead_id IS NOT NULL ORDER BY actualizado"
+            )
+            for id_conversacion, datos, lead_id in filas:
+                self._guardar(lead_id, id_conversacion, json.loads(datos), "incremental")
+        finally:
+            origen.close()
+        self._db.commit()
+
+    def buscar(self, lead_ids):
+        """
+        Returns:
+            dict: lead_id -> (id_conversacion, score_total, tag_ids, origen)
+        """
+        if not lead_ids:
+            return {}
+        marcas = ",".join("?" * len(lead_ids))
+        filas = self._db.execute(
+            f"SELECT lead_id, id_conversacion, score_total, tag_ids, origen FROM locales "
+            f"WHERE lead_id IN ({marcas})",
+            list(lead_ids),
+        )
+        return {fila[0]: fila[1:] for fila in filas}
+
+    def cerrar(self):
+        self._db.close()
+
+
+def _unir(filas, locales):
+    encontrados = locales.buscar([fila["id"] for fila in filas])
+    for fila in filas:
+        id_conversacion, score_total, tag_ids, origen = encontrados.get(
+            fila["id"], (None, None, None, None)
+        )
+        fila.update(
+            id_conversacion=id_conversacion,
+            score_total=score_total,
+            prioridad_score=(
+                prioridad_desde_score(score_total) if score_total is not None else None
+            ),
+            tag_ids_extraidos=tag_ids,
+            origen_local=origen,
+        )
+    return filas
+
+
+############################## 3. Escritura ##############################
+
+
+class _EscritorCSV:
+    def __init__(self, ruta):
+        self.archivo = open(ruta, "w", encoding="utf-8", newline="")
+        self.escritor = csv.DictWriter(
+            self.archivo, fieldnames=[nombre for nombre, _ in COLUMNAS], extrasaction="ignore"
+        )
+        self.escritor.writeheader()
+
+    def escribir(self, filas):
+        self.escritor.writerows(filas)
+
+    def cerrar(self):
+        self.archivo.close()
+
+
+class _EscritorParquet:
+    # Un row group por página de Odoo
+    def __init__(self, ruta):
+        tipos = {"int": pa.int64(), "str": pa.string(), "bool": pa.bool_()}
+        self.esquema = pa.schema([(nombre, tipos[tipo]) for nombre, tipo in COLUMNAS])
+        self.escritor = pq.ParquetWriter(ruta, self.esquema)
+
+    def escribir(self, filas):
+        self.escritor.write_table(pa.Table.from_pylist(filas, schema=self.esquema))
+
+    def cerrar(self):
+        self.escritor.close()
+
+
+ESCRITORES = {"csv": _EscritorCSV, "parquet": _EscritorParquet}
+
+
+############################## 4. Cursor y exportación ##############################
+
+
+def _ruta_cursor(directorio):
+    return os.path.join(directorio, "_cursor.json")
+
+
+def cargar_cursor(directorio):
+    """
+    Returns:
+        Optional[tuple]: (write_date, id) del último lead exportado, o None.
+    """
+    try:
+        with open(_ruta_cursor(directorio), encoding="utf-8") as archivo:
+            estado = json.load(archivo)
+    except FileNotFoundError:
+        return None
+    return estado["write_date"], estado["id"]
+
+
+# Se escribe en un archivo temporal y se renombra para no dejar un cursor a medias
+def guardar_cursor(directorio, cursor):
+    ruta = _ruta_cursor(directorio)
+    with open(ruta + ".tmp", "w", encoding="utf-8") as archivo:
+        json.dump({"write_date": cursor[0], "id": cursor[1]}, archivo)
+    os.replace(ruta + ".tmp", ruta)
+
+
+def exportar_leads(
+    directorio,
+    formato="parquet",
+    rutas_resultados=(),
+    ruta_estados=None,
+    tamano_pagina=500,
+    desde_cero=False,
+):
+    """
+    Exporta los leads que cambiaron desde la corrida anterior.
+
+    Args:
+        directorio (str): Carpeta de los archivos exportados y de _cursor.json.
+        formato (str): "parquet" o "csv".
+        rutas_resultados: Archivos NDJSON de airregio_batch para unir por lead_id.
+        ruta_estados (Optional[str]): Base de estados de airregio_incremental.
+        tamano_pagina (int): Leads por llamada a search_read.
+        desde_cero (bool): Ignora el cursor y exporta todos los leads.
+
+    Returns:
+        dict: {"archivo", "leads", "con_datos_locales", "cursor"}. archivo es None si no
+              hubo cambios.
+    """
+    if formato == "parquet" and pa is None:
+        raise RuntimeError("Para exportar a Parquet instala pyarrow o usa --formato csv")
+
+    os.makedirs(directorio, exist_ok=True)
+    cursor = None if desde_cero else cargar_cursor(directorio)
+
+    locales = RegistrosLocales()
+    for ruta in rutas_resultados:
+        locales.cargar_resultados(ruta)
+    if ruta_estados:
+        locales.cargar_estados(ruta_estados)
+
+    marca = datetime.now().strftime("%Y%m%dT%H%M%S")
+    ruta = os.path.join(directorio, f"leads-{marca}.{formato}")
+    escritor = None
+    leads = con_datos_locales = 0
+    try:
+        for filas in export_changed_leads(cursor=cursor, page_size=tamano_pagina):
+            if escritor is None:
+                escritor = ESCRITORES[formato](ruta)
+            filas = _unir(filas, locales)
+            escritor.escribir(filas)
+            leads += len(filas)
+            con_datos_locales += sum(1 for fila in filas if fila["origen_local"])
+            cursor = (filas[-1]["write_date"], filas[-1]["id"])
+    except BaseException:
+        # Sin cursor nuevo, la siguiente corrida vuelve a pedir estos leads
+        if escritor is not None:
+            escritor.cerrar()
+            os.remove(ruta)
+        raise
+    finally:
+        locales.cerrar()
+
+    if escritor is not None:
+        escritor.cerrar()
+        guardar_cursor(directorio, cursor)
+    return {
+        "archivo": ruta if escritor is not None else None,
+        "leads": leads,
+        "con_datos_locales": con_datos_locales,
+        "cursor": list(cursor) if cursor else None,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Exporta los leads de Odoo con su score local a Parquet o CSV."
+    )
+    parser.add_argument("salida", help="Directorio de los archivos exportados")
+    parser.add_argument("--formato", choices=sorted(ESCRITORES), default="parquet")
+    parser.add_argument(
+        "--resultados",
+        action="append",
+        default=[],
+        help="NDJSON de airregio_batch para unir por lead_id (se puede repetir)",
+    )
+    parser.add_argument(
+        "--estados",
+        default=os.getenv("AIRREGIO_ESTADOS_DB", ".cache/airregio_estados.sqlite3"),
+        help="Base de estados de airregio_incremental",
+    )
+    parser.add_argument(
+        "--pagina", type=int, default=500, help="Leads por llamada a search_read"
+    )
+    parser.add_argument(
+        "--desde-cero",
+        action="store_true",
+        help="Ignorar el cursor guardado y exportar todos los leads",
+    )
+    args = parser.parse_args(argv)
+
+    resumen = exportar_leads(
+        args.salida,
+        formato=args.formato,
+        rutas_resultados=args.resultados,
+        ruta_estados=args.estados,
+        tamano_pagina=args.pagina,
+        desde_cero=args.desde_cero,
+    )
+    print(json.dumps(resumen, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+import re
+from datetime import datetime, timedelta
+
+from airregio_conversacion import parsear_conversacion
+
+
+############################## Extracción determinista (teléfono, correo, fechas) ##############################
+
+
+# Secuencia de dígitos con separadores típicos: "81 1234 5678", "(81) 1234-5678",
+# "+52 1 81 1234 5678", "33 12 34 56 78", "8112345678"
+_RE_TELEFONO = re.compile(r"(?<![\w+])(\+\s?)?\(?\d[\d\s().-]{8,18}\d(?!\d)")
+# "folio 1234567890", "pedido #1234567890", "factura no. 1234567890" no son teléfonos
+_RE_ANTES_DE_NO_TELEFONO = re.compile(
+    r"\b(?:folio|pedido|factura|orden|ticket|referencia|guia|cuenta|contrato)\s*"
+    r"(?:(?:no|num|numero)\.?\s*)?[#:]?\s*$"
+)
+_RE_CORREO = re.compile(r"[A-Za-z0-9._%+-]+@[A-Za-z0-9-]+(?:\.[A-Za-z0-9-]+)*\.[A-Za-z]{2,}")
+# 29/10/2024, 29-10-24, 29/10
+_RE_FECHA_NUMERICA = re.compile(
+    r"(?<!\d)(\d{1,2})[/-](\d{1,2})(?:[/-](\d{2,4}))?(?![\d/-])"
+)
+# Sin año, "29/10" solo es fecha después de una de estas palabras ("3/4 de la azotea" no lo es)
+_RE_ANTES_DE_FECHA = re.compile(
+    r"\b(?:el|para|dia|fecha|hasta|desde|antes del?|despues del?|a partir del?|del|al)\s*$"
+)
+# 29 de octubre, 29 de octubre de 2024
+_RE_FECHA_TEXTO = re.compile(
+    r"\b(\d{1,2})\s+de\s+(enero|febrero|marzo|abril|mayo|junio|julio|agosto|septiembre|"
+    r"setiembre|octubre|noviembre|diciembre)(?:\s+(?:de|del)\s+(\d{4}))?\b"
+)
+# el martes, este jueves, próximo lunes, mañana, pasado mañana ("de la mañana" es una hora)
+_RE_DIA_RELATIVO = re.compile(
+    r"\b(pasado manana|(?<!de la )manana|hoy|lunes|martes|miercoles|jueves|viernes|sabado|domingo)\b"
+)
+# a las 10, a las 10:30 am, 4 pm, a las 3 de la tarde
+_RE_HORA = re.compile(
+    r"\b(?:a\s+las?\s+)?(\d{1,2})(?::(\d{2}))?\s*"
+    r"(am|pm|a\.m\.|p\.m\.|hrs|h|de la manana|de la tarde|de la noche)?\b"
+)
+
+_LADAS_DOS_DIGITOS = {"55", "56", "33", "81"}
+_MESES = {
+    "enero": 1,
+    "febrero": 2,
+    "marzo": 3,
+    "abril": 4,
+    "mayo": 5,
+    "junio": 6,
+    "julio": 7,
+    "agosto": 8,
+    "septiembre": 9,
+    "setiembre": 9,
+    "octubre": 10,
+    "noviembre": 11,
+    "diciembre": 12,
+}
+_DIAS = ["lunes", "martes", "miercoles", "jueves", "viernes", "sabado", "domingo"]
+_NOMBRES_DIAS = ["lunes", "martes", "miércoles", "jueves", "viernes", "sábado", "domingo"]
+
+
+# str.translate con una tabla fija es mucho más rápido que normalizar con unicodedata
+_TABLA_SIN_ACENTOS = str.maketrans("áéíóúüñÁÉÍÓÚÜÑ", "aeiouunAEIOUUN")
+
+
+def _sin_acentos(texto):
+    return texto.translate(_TABLA_SIN_ACENTOS)
+
+
+def normalizar_telefono(texto):
+    """
+    Convierte un número mexicano a "+52 81 1234 5678" (lada de 2 dígitos) o
+    "+52 444 123 4567" (lada de 3 dígitos). Devuelve None si no tiene 10 dígitos nacionales.
+    """
+    digitos = re.sub(r"\D", "", texto)
+    if len(digitos) == 13 and digitos.startswith("521"):
+        digitos = digitos[3:]
+    elif len(digitos) == 12 and digitos.startswith("52"):
+        digitos = digitos[2:]
+    elif len(digitos) == 11 and digitos.startswith("1"):
+        digitos = digitos[1:]
+    if len(digitos) != 10:
+        return None
+
+    if digitos[:2] in _LADAS_DOS_DIGITOS:
+        return f"+52 {digitos[:2]} {digitos[2:6]} {digitos[6:]}"
+    return f"+52 {digitos[:3]} {digitos[3:6]} {digitos[6:]}"
+
+
+def buscar_telefonos(texto):
+    telefonos = []
+    for coincidencia in _RE_TELEFONO.finditer(texto):
+        antes = _sin_acentos(texto[max(0, coincidencia.start() - 30) : coincidencia.start()].lower())
+        if _RE_ANTES_DE_NO_TELEFONO.search(antes):
+            continue
+        telefono = normalizar_telefono(coincidencia.group(0))
+        if telefono is not None and telefono not in telefonos:
+            telefonos.append(telefono)
+    return telefonos
+
+
+def buscar_correos(texto):
+    correos = []
+    for coincidencia in _RE_CORREO.finditer(texto):
+        correo = coincidencia.group(0).rstrip(".").lower()
+        if correo not in correos:
+            correos.append(correo)
+    return correos
+
+
+def _hora_mencionada(texto):
+    for coincidencia in _RE_HORA.finditer(texto):
+        hora, minutos, sufijo = coincidencia.groups()
+        hora = int(hora)
+        # Sin "a las" ni am/pm, un número suelto no es una hora ("500 metros")
+        if sufijo is None and not coincidencia.group(0).startswith("a la"):
+            continue
+        if sufijo in ("pm", "p.m.", "de la tarde", "de la noche") and hora < 12:
+            hora += 12
+        elif sufijo in ("am", "a.m.", "de la manana", "de la noche") and hora == 12:
+            hora = 0
+        if hora > 23:
+            continue
+        return hora, int(minutos or 0)
+    return None
+
+
+def buscar_fechas(texto, referencia=None):
+    """
+    Busca fechas mencionadas en un mensaje y las resuelve contra la fecha del mensaje
+    (`referencia`, normalmente su timestamp de WhatsApp).
+
+    Returns:
+        List[datetime]: Fechas encontradas; si el mensaje menciona una hora se le asigna.
+    """
+    fechas = []
+    texto_plano = _sin_acentos(texto.lower())
+    hora = _hora_mencionada(texto_plano)
+    anio_referencia = referencia.year if referencia else datetime.now().year
+
+    for coincidencia in _RE_FECHA_NUMERICA.finditer(texto_plano):
+        dia, mes, anio = coincidencia.groups()
+        if not anio and not _RE_ANTES_DE_FECHA.search(texto_plano[: coincidencia.start()]):
+            continue
+        anio = int(anio) if anio else anio_referencia
+        if anio < 100:
+            anio += 2000
+        try:
+            fechas.append(datetime(anio, int(mes), int(dia)))
+        except ValueError:
+            continue
+
+    for dia, mes, anio in _RE_FECHA_TEXTO.findall(texto_plano):
+        try:
+            fechas.append(
+                datetime(int(anio) if anio else anio_referencia, _MESES[mes], int(dia))
+            )
+        except ValueError:
+            continue
+
+    if referencia is not None:
+        base = referencia.replace(hour=0, minute=0, second=0, microsecond=0)
+        for palabra in _RE_DIA_RELATIVO.findall(texto_plano):
+            if palabra == "hoy":
+                fechas.append(base)
+            elif palabra == "manana":
+                fechas.append(base + timedelta(days=1))
+            elif palabra == "pasado manana":
+                fechas.append(base + timedelta(days=2))
+            else:
+                dias = (_DIAS.index(palabra) - base.weekday()) % 7 or 7
+                fechas.append(base + timedelta(days=dias))
+
+    if hora is not None:
+        fechas = [fecha.replace(hour=hora[0], minute=hora[1]) for fecha in fechas]
+    return fechas
+
+
+def formatear_fecha(fecha):
+    texto = f"{_NOMBRES_DIAS[fecha.weekday()]} {fecha.strftime('%d/%m/%Y')}"
+    if fecha.hour or fecha.minute:
+        texto += fecha.strftime(" %H:%M")
+    return texto
+
+
+def extraer_campos_deterministas(mensajes):
+    """
+    Busca teléfono, correo y fechas solo en los mensajes del usuario.
+
+    Args:
+        mensajes: Conversación en texto (WhatsApp o correo).
+
+    Returns:
+        dict: {"phone": str o None, "email_from": str o None, "fechas": List[datetime],
+               "texto_usuario": str} con el primer teléfono y correo encontrados.
+    """
+    telefonos, correos, fechas, textos = [], [], [], []
+    for mensaje in parsear_conversacion(mensajes):
+        if mensaje.rol != "user":
+            continue
+        textos.append(mensaje.contenido)
+        telefonos.extend(buscar_telefonos(mensaje.contenido))
+        correos.extend(buscar_correos(mensaje.contenido))
+        for fecha in buscar_fechas(mensaje.contenido, mensaje.timestamp):
+            if fecha not in fechas:
+                fechas.append(fecha)
+
+    # "el martes" sin hora no aporta nada si ya hay "el martes a las 10"
+    con_hora = {fecha.date() for fecha in fechas if fecha.hour or fecha.minute}
+    fechas = [
+        fecha
+        for fecha in fechas
+        if fecha.hour or fecha.minute or fecha.date() not in con_hora
+    ]
+
+    return {
+        "phone": telefonos[0] if telefonos else None,
+        "email_from": correos[0] if correos else None,
+        "fechas": fechas,
+        "texto_usuario": "\n".join(textos),
+    }
+
+
+def aplicar_campos_deterministas(datos, campos):
+    """
+    Completa o corrige los datos del LLM con lo encontrado por las expresiones regulares.
+
+    - phone / email_from: el valor determinista tiene prioridad. Si no se encontró ninguno
+      se conserva el del LLM (el teléfono, normalizado cuando se puede); que las expresiones
+      regulares no encuentren nada no significa que el dato sea inventado.
+    - Fechas: se agregan al final de description para el vendedor.
+
+    Returns:
+        dict: Los mismos datos, modificados en su lugar.
+    """
+    if campos["phone"]:
+        datos["phone"] = campos["phone"]
+    elif datos.get("phone"):
+        datos["phone"] = normalizar_telefono(datos["phone"]) or datos["phone"]
+
+    if campos["email_from"]:
+        datos["email_from"] = campos["email_from"]
+
+    if campos["fechas"]:
+        fechas = ", ".join(formatear_fecha(fecha) for fecha in campos["fechas"])
+        nota = f"Fechas mencionadas por el cliente: {fechas}."
+        descripcion = datos.get("description") or ""
+        if nota not in descripcion:
+            datos["description"] = f"{descripcion}\n\n{nota}".strip()
+
+    return datos
@@ -0,0 +1,313 @@
+"""
+Recalificación incremental de conversaciones que siguen creciendo (por ejemplo, un hilo de
+WhatsApp que recibe mensajes nuevos cada tanto).
+
+Por cada conversación se guarda el último estado extraído (datos + score_total), cuántos
+mensajes ya se procesaron y una huella de esos mensajes. Cuando llega la conversación con
+mensajes nuevos solo se envían al LLM el estado anterior y los mensajes nuevos. El lead en
+Odoo solo se actualiza si cambió algún campo.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import weakref
+
+from airregio_agents_crm_simple import (
+    MAX_CARACTERES_ASISTENTE,
+    aextraer_delta,
+    datos_a_lead,
+    ejecutar_async,
+    procesar_conversacion_async,
+)
+from airregio_conversacion import parsear_conversacion, renderizar_compacto
+
+
+############################## 1. Estado por conversación ##############################
+
+
+class AlmacenEstados:
+    """
+    Estado por id de conversación en SQLite: datos y score actuales, marca de agua (mensajes
+    procesados), huella de esos mensajes, id del lead y los datos que ya se enviaron a Odoo.
+    """
+
+    def __init__(self, ruta=".cache/airregio_estados.sqlite3"):
+        self.ruta = ruta
+        self._lock = threading.Lock()
+        self._conexion = None
+
+    def _db(self):
+        if self._conexion is None:
+            directorio = os.path.dirname(self.ruta)
+            if directorio:
+                os.makedirs(directorio, exist_ok=True)
+            self._conexion = sqlite3.connect(self.ruta, check_same_thread=False)
+            self._conexion.execute("PRAGMA journal_mode=WAL")
+            self._conexion.execute(
+                """
+                CREATE TABLE IF NOT EXISTS conversaciones (
+                    id_conversacion TEXT PRIMARY KEY,
+                    datos TEXT NOT NULL,
+                    marca INTEGER NOT NULL,
+                    huella TEXT NOT NULL,
+                    lead_id INTEGER,
+                    datos_odoo TEXT,
+                    actualizado REAL NOT NULL
+                )
+                """
+            )
+            self._conexion.commit()
+        return self._conexion
+
+    def obtener(self, id_conversacion):
+        """
+        Returns:
+            Optional[dict]: {"datos", "marca", "huella", "lead_id", "datos_odoo"} o None.
+        """
+        with self._lock:
+            fila = (
+                self._db()
+                .execute(
+                    "SELECT datos, marca, huella, lead_id, datos_odoo FROM conversaciones "
+                    "WHERE id_conversacion = ?",
+                    (id_conversacion,),
+                )
+                .fetchone()
+            )
+        if fila is None:
+            return None
+        return {
+            "datos": json.loads(fila[0]),
+            "marca": fila[1],
+            "huella": fila[2],
+            "lead_id": fila[3],
+            "datos_odoo": json.loads(fila[4]) if fila[4] else None,
+        }
+
+    def guardar(self, id_conversacion, datos, marca, huella, lead_id=None, datos_odoo=None):
+        with self._lock:
+            db = self._db()
+            db.execute(
+                "INSERT OR REPLACE INTO conversaciones "
+                "(id_conversacion, datos, marca, huella, lead_id, datos_odoo, actualizado) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    id_conversacion,
+                    json.dumps(datos, ensure_ascii=False),
+                    marca,
+                    huella,
+                    lead_id,
+                    json.dumps(datos_odoo, ensure_ascii=False) if datos_odoo is not None else None,
+                    time.time(),
+                ),
+            )
+            db.commit()
+
+    def eliminar(self, id_conversacion):
+        with self._lock:
+            db = self._db()
+            db.execute(
+                "DELETE FROM conversaciones WHERE id_conversacion = ?", (id_conversacion,)
+            )
+            db.commit()
+
+
+_almacen = None
+_almacen_lock = threading.Lock()
+
+
+def obtener_almacen():
+    global _almacen
+    with _almacen_lock:
+        if _almacen is None:
+            _almacen = AlmacenEstados(
+                os.getenv("AIRREGIO_ESTADOS_DB", ".cache/airregio_estados.sqlite3")
+            )
+        return _almacen
+
+
+# Huella de los primeros mensajes: si el inicio de la conversación cambió (mensajes editados
+# o un hilo distinto con el mismo id), no se puede continuar desde la marca de agua
+def huella_mensajes(mensajes):
+    resumen = hashlib.sha256()
+    for mensaje in mensajes:
+        contenido = " ".join(mensaje.contenido.split())
+        resumen.update(f"{mensaje.hablante}\x1f{contenido}\x1e".encode("utf-8"))
+    return resumen.hexdigest()
+
+
+############################## 2. Cambios para Odoo ##############################
+
+
+# Nombre del argumento de datos_a_lead -> nombre del argumento de update_lead
+_CAMPOS_UPDATE_LEAD = {
+    "lead_name": "name",
+    "phone_number_id": "phone",
+    "contact_name": "contact_name",
+    "email_from": "email_from",
+    "partner_name": "partner_name",
+    "description": "description",
+    "priority": "priority",
+    "tag_ids": "tag_ids",
+    "street": "street",
+}
+
+
+def campos_cambiados(datos_anteriores, datos_nuevos):
+    """
+    Compara los valores que se mandarían a Odoo para cada versión de los datos.
+
+    Returns:
+        dict: Argumentos para update_lead con solo los campos que cambiaron.
+    """
+    anterior = datos_a_lead(datos_anteriores or {})
+    nuevo = datos_a_lead(datos_nuevos)
+    return {
+        campo_odoo: nuevo[campo]
+        for campo, campo_odoo in _CAMPOS_UPDATE_LEAD.items()
+        if nuevo[campo] is not None and nuevo[campo] != anterior[campo]
+    }
+
+
+async def _sincronizar_odoo(estado, datos):
+    """
+    Crea el lead la primera vez (o lo encuentra con upsert) y después solo lo actualiza con los
+    campos que cambiaron respecto a lo último que se envió.
+
+    Returns:
+        tuple: (lead_id, datos_odoo, cambios)
+    """
+    from CRM.lead_index import upsert_lead_full_data
+    from CRM.odoo_api_calls import update_lead
+
+    lead_id = estado["lead_id"] if estado else None
+    datos_odoo = estado["datos_odoo"] if estado else None
+
+    if lead_id is None:
+        lead = await asyncio.to_thread(datos_a_lead, datos)
+        lead_id = await asyncio.to_thread(upsert_lead_full_data, **lead)
+        return lead_id, (datos if lead_id is not None else None), list(datos)
+
+    cambios = await asyncio.to_thread(campos_cambiados, datos_odoo, datos)
+    if not cambios:
+        return lead_id, datos_odoo, []
+
+    actualizado = await asyncio.to_thread(update_lead, lead_id, **cambios)
+    # Si falló, datos_odoo no cambia y los mismos campos se vuelven a intentar la próxima vez
+    return lead_id, (datos if actualizado else datos_odoo), list(cambios)
+
+
+############################## 3. Recalificación ##############################
+
+
+# Un asyncio.Lock por (loop, id de conversación). Dos versiones de la misma conversación que
+# llegan juntas se procesan una después de otra: la segunda ve el estado que guardó la
+# primera en lugar de repetir la extracción y crear el lead dos veces. Un lock sin nadie
+# esperándolo desaparece del diccionario.
+_locks_conversacion = weakref.WeakValueDictionary()
+_locks_conversacion_lock = threading.Lock()
+
+
+def _lock_conversacion(id_conversacion):
+    clave = (asyncio.get_running_loop(), id_conversacion)
+    with _locks_conversacion_lock:
+        lock = _locks_conversacion.get(clave)
+        if lock is None:
+            lock = asyncio.Lock()
+            _locks_conversacion[clave] = lock
+        return lock
+
+
+async def arecalificar_conversacion(
+    id_conversacion, conversacion, almacen=None, sincronizar_odoo=False
+):
+    """
+    Procesa la versión actual de una conversación reutilizando el estado guardado.
+
+    - Sin estado previo, o si los mensajes ya procesados cambiaron: extracción completa.
+    - Sin mensajes nuevos: devuelve el estado guardado sin llamar al LLM.
+    - Con mensajes nuevos: modo delta (estado anterior + mensajes nuevos).
+
+    Args:
+        id_conversacion (str): Id estable de la conversación (por ejemplo, el teléfono).
+        conversacion (str): Conversación completa hasta el momento.
+        almacen (Optional[AlmacenEstados]): Por defecto, el de AIRREGIO_ESTADOS_DB.
+        sincronizar_odoo (bool): Crear el lead la primera vez y actualizarlo solo si cambió.
+
+    Returns:
+        dict: {"datos", "modo" ("completo", "delta" o "sin_cambios"), "mensajes_nuevos",
+               "lead_id", "cambios_odoo"} o None si el LLM no devolvió datos.
+    """
+    # Leer estado -> LLM -> Odoo -> guardar, sin otra llamada con el mismo id en medio
+    async with _lock_conversacion(id_conversacion):
+        return await _recalificar(id_conversacion, conversacion, almacen, sincronizar_odoo)
+
+
+async def _recalificar(id_conversacion, conversacion, almacen, sincronizar_odoo):
+    almacen = almacen or obtener_almacen()
+    estado = almacen.obtener(id_conversacion)
+    mensajes = list(parsear_conversacion(conversacion))
+
+    continuar = (
+        estado is not None
+        and 0 < estado["marca"] <= len(mensajes)
+        and huella_mensajes(mensajes[: estado["marca"]]) == estado["huella"]
+    )
+    if continuar and estado["marca"] == len(mensajes):
+        modo, datos = "sin_cambios", estado["datos"]
+    elif continuar:
+        modo = "delta"
+        nuevos = renderizar_compacto(
+            mensajes[estado["marca"] :], max_caracteres_asistente=MAX_CARACTERES_ASISTENTE
+        )
+        datos = await aextraer_delta(estado["datos"], nuevos, conversacion)
+    else:
+        modo = "completo"
+        # Con el mismo id se conserva el lead, aunque el historial haya cambiado
+        datos = await procesar_conversacion_async(conversacion) or None
+
+    if datos is None:
+        return None
+
+    lead_id = estado["lead_id"] if estado else None
+    datos_odoo = estado["datos_odoo"] if estado else None
+    cambios = []
+    if sincronizar_odoo:
+        lead_id, datos_odoo, cambios = await _sincronizar_odoo(estado, datos)
+
+    almacen.guardar(
+        id_conversacion,
+        datos,
+        len(mensajes),
+        huella_mensajes(mensajes),
+        lead_id=lead_id,
+        datos_odoo=datos_odoo,
+    )
+    return {
+        "datos": datos,
+        "modo": modo,
+        "mensajes_nuevos": len(mensajes) - (estado["marca"] if continuar else 0),
+        "lead_id": lead_id,
+        "cambios_odoo": cambios,
+    }
+
+
+def recalificar_conversacion(
+    id_conversacion, conversacion, almacen=None, sincronizar_odoo=False
+):
+    """
+    Versión síncrona de arecalificar_conversacion.
+    """
+    return ejecutar_async(
+        arecalificar_conversacion(
+            id_conversacion,
+            conversacion,
+            almacen=almacen,
+            sincronizar_odoo=sincronizar_odoo,
+        )
+    )
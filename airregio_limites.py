@@ -0,0 +1,321 @@
+"""
+Limitador de llamadas al LLM compartido por todo el proceso.
+
+Por modelo lleva una ventana de 60 s con las solicitudes y los tokens enviados (RPM y TPM) y
+un límite de llamadas simultáneas que se ajusta con AIMD: sube de a poco con cada respuesta
+normal y se reduce a la mitad con un 429 (o un 10 % si la latencia se dispara). Los tokens de
+cada llamada se estiman antes de enviarla y se corrigen con el uso real de la respuesta. Las
+llamadas rechazadas por límite de tasa o con un error transitorio (5xx, red) se reintentan con
+espera exponencial y jitter; los clientes de OpenAI y Groq se crean sin reintentos propios.
+
+Sirve igual para hilos (invoke) y para corrutinas (ainvoke) en cualquier event loop.
+"""
+
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+
+
+############################## Límites por modelo ##############################
+
+
+# (solicitudes por minuto, tokens por minuto). Dependen del nivel de la cuenta; se pueden
+# cambiar con AIRREGIO_LIMITES='{"gpt-4o-mini": [5000, 4000000]}'
+LIMITES_POR_MODELO = {
+    "gpt-4o-mini": (500, 200_000),
+    "gpt-4o": (500, 30_000),
+    "llama-3.1-70b-versatile": (30, 6_000),
+    "llama-3.2-90b-vision-preview": (15, 7_000),
+}
+for _modelo, _limites in json.loads(os.getenv("AIRREGIO_LIMITES", "{}")).items():
+    LIMITES_POR_MODELO[_modelo] = tuple(_limites)
+
+VENTANA_SEGUNDOS = 60.0
+# La latencia de referencia es la mínima observada en esta ventana
+VENTANA_LATENCIA_SEGUNDOS = 300.0
+
+
+def limites_modelo(modelo):
+    """
+    Returns:
+        tuple: (rpm, tpm) del modelo; los nombres con fecha usan la clave más larga que
+               coincida. (None, None) si el modelo no está en la tabla.
+    """
+    if modelo in LIMITES_POR_MODELO:
+        return LIMITES_POR_MODELO[modelo]
+    prefijos = [clave for clave in LIMITES_POR_MODELO if modelo and modelo.startswith(clave)]
+    if prefijos:
+        return LIMITES_POR_MODELO[max(prefijos, key=len)]
+    return None, None
+
+
+# Un 429 de OpenAI o Groq (RateLimitError) o cualquier error con status_code 429
+def es_limite_de_tasa(error):
+    if type(error).__name__ == "RateLimitError":
+        return True
+    return getattr(error, "status_code", None) == 429
+
+
+# Errores que el SDK de OpenAI o Groq reintentaría: red, timeout, 408, 409 y 5xx
+def es_error_transitorio(error):
+    if type(error).__name__ in ("APIConnectionError", "APITimeoutError"):
+        return True
+    status = getattr(error, "status_code", None)
+    return status in (408, 409) or (status is not None and status >= 500)
+
+
+def _retry_after(error):
+    respuesta = getattr(error, "response", None)
+    encabezados = getattr(respuesta, "headers", None) or {}
+    try:
+        return float(encabezados.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+############################## Limitador ##############################
+
+
+class LimitadorModelo:
+    """
+    Args:
+        rpm (Optional[int]): Solicitudes por minuto; None no limita.
+        tpm (Optional[int]): Tokens (entrada + salida) por minuto; None no limita.
+        concurrencia_inicial, concurrencia_minima, concurrencia_maxima: Rango del límite AIMD.
+        reintentos (int): Reintentos de una llamada rechazada con 429 o con un error
+            transitorio.
+        factor_latencia (float): Si la latencia promedio supera este múltiplo de la mejor
+            observada en los últimos VENTANA_LATENCIA_SEGUNDOS, se reduce la concurrencia
+            aunque no haya 429.
+    """
+
+    def __init__(
+        self,
+        rpm=None,
+        tpm=None,
+        concurrencia_inicial=4,
+        concurrencia_minima=1,
+        concurrencia_maxima=64,
+        reintentos=5,
+        espera_base=1.0,
+        espera_maxima=30.0,
+        factor_latencia=3.0,
+    ):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.limite = float(concurrencia_inicial)
+        self.concurrencia_minima = concurrencia_minima
+        self.concurrencia_maxima = concurrencia_maxima
+        self.reintentos = reintentos
+        self.espera_base = espera_base
+        self.espera_maxima = espera_maxima
+        self.factor_latencia = factor_latencia
+
+        self.en_curso = 0
+        self.limitados = 0
+        self.reintentados = 0
+        self._ventana = deque()  # [instante, tokens]
+        self._tokens_ventana = 0
+        self._latencia = None
+        # (instante, latencia) con latencias crecientes: el primero es el mínimo de la ventana
+        self._minimos_latencia = deque()
+        self._ultimo_recorte = 0.0
+        self._lock = threading.Lock()
+
+    def _purgar(self, ahora):
+        while self._ventana and ahora - self._ventana[0][0] >= VENTANA_SEGUNDOS:
+            self._tokens_ventana -= self._ventana.popleft()[1]
+
+    # Reserva un lugar si hay cupo. Devuelve (reserva, 0) o (None, segundos de espera sugeridos)
+    def _intentar(self, tokens):
+        with self._lock:
+            ahora = time.monotonic()
+            self._purgar(ahora)
+            if self.en_curso >= int(self.limite):
+                return None, 0.05
+            if self.rpm is not None and len(self._ventana) >= self.rpm:
+                return None, self._ventana[0][0] + VENTANA_SEGUNDOS - ahora
+            # Una llamada más grande que el TPM completo pasa sola con la ventana vacía
+            if (
+                self.tpm is not None
+                and self._ventana
+                and self._tokens_ventana + tokens > self.tpm
+            ):
+                return None, self._ventana[0][0] + VENTANA_SEGUNDOS - ahora
+            reserva = [ahora, tokens]
+            self._ventana.append(reserva)
+            self._tokens_ventana += tokens
+            self.en_curso += 1
+            return reserva, 0
+
+    def adquirir(self, tokens):
+        while True:
+            reserva, espera = self._intentar(tokens)
+            if reserva is not None:
+                return reserva
+            time.sleep(min(max(espera, 0.01), 1.0))
+
+    async def aadquirir(self, tokens):
+        while True:
+            reserva, espera = self._intentar(tokens)
+            if reserva is not None:
+                return reserva
+            await asyncio.sleep(min(max(espera, 0.01), 1.0))
+
+    def liberar(self, reserva, segundos, tokens_reales=None, limitado=False):
+        with self._lock:
+            self.en_curso -= 1
+            # Si la reserva ya salió de la ventana, sus tokens ya no cuentan
+            if tokens_reales is not None and any(r is reserva for r in self._ventana):
+                self._tokens_ventana += tokens_reales - reserva[1]
+                reserva[1] = tokens_reales
+            self._ajustar(segundos, limitado)
+
+    # AIMD: +1/límite por respuesta normal (≈ +1 por cada "ronda" de llamadas), ×0.5 con un
+    # 429 y ×0.9 si la latencia se degrada. Un solo recorte por segundo: una ráfaga de 429
+    # simultáneos es una sola señal. segundos es None si la llamada falló o se canceló: su
+    # duración no dice nada de la latencia del modelo.
+    def _ajustar(self, segundos, limitado):
+        ahora = time.monotonic()
+        if limitado:
+            self.limitados += 1
+            if ahora - self._ultimo_recorte >= 1.0:
+                self.limite = max(self.concurrencia_minima, self.limite * 0.5)
+                self._ultimo_recorte = ahora
+            return
+        if segundos is None:
+            return
+
+        self._latencia = (
+            segundos if self._latencia is None else 0.8 * self._latencia + 0.2 * segundos
+        )
+        # Mínimo en ventana deslizante: una latencia alta sostenida no sube la referencia hasta
+        # que sale de la ventana, y un modelo que se volvió más lento de forma permanente
+        # deja de recortarse cuando la ventana solo tiene latencias nuevas
+        while self._minimos_latencia and self._minimos_latencia[-1][1] >= self._latencia:
+            self._minimos_latencia.pop()
+        self._minimos_latencia.append((ahora, self._latencia))
+        while self._minimos_latencia[0][0] < ahora - VENTANA_LATENCIA_SEGUNDOS:
+            self._minimos_latencia.popleft()
+        latencia_base = self._minimos_latencia[0][1]
+
+        if self._latencia > self.factor_latencia * latencia_base:
+            if ahora - self._ultimo_recorte >= 1.0:
+                self.limite = max(self.concurrencia_minima, self.limite * 0.9)
+                self._ultimo_recorte = ahora
+        else:
+            self.limite = min(self.concurrencia_maxima, self.limite + 1 / self.limite)
+
+    def _espera_reintento(self, intento, error):
+        espera = _retry_after(error)
+        if espera is None:
+            espera = random.uniform(0, min(self.espera_maxima, self.espera_base * 2**intento))
+        return espera
+
+    def llamar(self, funcion, tokens):
+        """
+        Ejecuta funcion() cuando hay cupo para `tokens` y reintenta si el proveedor responde 429
+        o con un error transitorio.
+        """
+        for intento in range(self.reintentos + 1):
+            reserva = self.adquirir(tokens)
+            inicio = time.monotonic()
+            try:
+                resultado = funcion()
+            except Exception as e:
+                limitado = es_limite_de_tasa(e)
+                self.liberar(reserva, None, limitado=limitado)
+                if not (limitado or es_error_transitorio(e)) or intento == self.reintentos:
+                    raise
+                self.reintentados += 1
+                time.sleep(self._espera_reintento(intento, e))
+                continue
+            self.liberar(reserva, time.monotonic() - inicio, tokens_usados(resultado))
+            return resultado
+
+    async def allamar(self, fabrica, tokens):
+        """
+        Igual que llamar, para corrutinas. `fabrica` crea una corrutina nueva en cada intento.
+        """
+        for intento in range(self.reintentos + 1):
+            reserva = await self.aadquirir(tokens)
+            inicio = time.monotonic()
+            try:
+                resultado = await fabrica()
+            except asyncio.CancelledError:
+                self.liberar(reserva, None)
+                raise
+            except Exception as e:
+                limitado = es_limite_de_tasa(e)
+                self.liberar(reserva, None, limitado=limitado)
+                if not (limitado or es_error_transitorio(e)) or intento == self.reintentos:
+                    raise
+                self.reintentados += 1
+                await asyncio.sleep(self._espera_reintento(intento, e))
+                continue
+            self.liberar(reserva, time.monotonic() - inicio, tokens_usados(resultado))
+            return resultado
+
+    def estadisticas(self):
+        with self._lock:
+            self._purgar(time.monotonic())
+            return {
+                "concurrencia": round(self.limite, 2),
+                "en_curso": self.en_curso,
+                "solicitudes_ultimo_minuto": len(self._ventana),
+                "tokens_ultimo_minuto": self._tokens_ventana,
+                "rpm": self.rpm,
+                "tpm": self.tpm,
+                "limitados": self.limitados,
+                "reintentados": self.reintentados,
+            }
+
+
+def tokens_usados(respuesta):
+    uso = getattr(respuesta, "usage_metadata", None) or {}
+    total = uso.get("total_tokens")
+    if total is None and uso:
+        total = (uso.get("input_tokens") or 0) + (uso.get("output_tokens") or 0)
+    return total
+
+
+############################## Registro por modelo ##############################
+
+
+# AIRREGIO_LIMITADOR=0 desactiva el limitador (por ejemplo, en el benchmark con el LLM simulado)
+LIMITADOR_ACTIVO = os.getenv("AIRREGIO_LIMITADOR", "1") == "1"
+
+_limitadores = {}
+_limitadores_lock = threading.Lock()
+
+
+def obtener_limitador(modelo):
+    """
+    Returns:
+        Optional[LimitadorModelo]: El limitador del modelo (uno por proceso), o None si el
+        limitador está desactivado.
+    """
+    if not LIMITADOR_ACTIVO:
+        return None
+    with _limitadores_lock:
+        limitador = _limitadores.get(modelo)
+        if limitador is None:
+            rpm, tpm = limites_modelo(modelo)
+            limitador = LimitadorModelo(
+                rpm=rpm,
+                tpm=tpm,
+                concurrencia_inicial=int(os.getenv("AIRREGIO_CONCURRENCIA_INICIAL", "4")),
+                concurrencia_maxima=int(os.getenv("AIRREGIO_CONCURRENCIA_MAXIMA", "64")),
+            )
+            _limitadores[modelo] = limitador
+        return limitador
+
+
+def estadisticas_limitadores():
+    with _limitadores_lock:
+        limitadores = dict(_limitadores)
+    return {modelo: limitador.estadisticas() for modelo, limitador in limitadores.items()}
@@ -0,0 +1,273 @@
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from airregio_prompts import tokens_en_cache
+
+
+############################## Precios ##############################
+
+
+# Dólares por millón de tokens: (entrada, entrada en cache, salida)
+PRECIOS_POR_MILLON = {
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+    "gpt-4o": (2.50, 1.25, 10.00),
+    "llama-3.1-70b-versatile": (0.59, 0.59, 0.79),
+    "llama-3.2-90b-vision-preview": (0.90, 0.90, 0.90),
+}
+
+
+def costo_estimado(modelo, tokens_entrada, tokens_salida, tokens_cache=0):
+    """
+    Returns:
+        float: Costo en dólares de una llamada, o 0.0 si el modelo no está en la tabla.
+    """
+    precios = PRECIOS_POR_MILLON.get(modelo)
+    if precios is None and modelo:
+        # Nombres con fecha ("gpt-4o-mini-2024-07-18"): se usa la clave más larga que coincida
+        prefijos = [clave for clave in PRECIOS_POR_MILLON if modelo.startswith(clave)]
+        if prefijos:
+            precios = PRECIOS_POR_MILLON[max(prefijos, key=len)]
+    if precios is None:
+        return 0.0
+    entrada, cache, salida = precios
+    return (
+        (tokens_entrada - tokens_cache) * entrada
+        + tokens_cache * cache
+        + tokens_salida * salida
+    ) / 1_000_000
+
+
+############################## Spans ##############################
+
+
+# Límites de los buckets del histograma de duración, en segundos
+BUCKETS_SEGUNDOS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+logger = logging.getLogger("airregio.spans")
+
+_lock = threading.Lock()
+_duraciones = {}  # etapa -> {"buckets": [...], "suma": float, "conteo": int}
+_resultados = {}  # (etapa, resultado) -> int
+_tokens = {}  # (etapa, tipo) -> int
+_costos = {}  # etapa -> float
+
+
+class Span:
+    """
+    Una etapa medida: duración, resultado y, en llamadas al LLM, tokens y costo.
+    """
+
+    def __init__(self, etapa, atributos):
+        self.etapa = etapa
+        self.atributos = atributos
+        self.tokens_entrada = 0
+        self.tokens_salida = 0
+        self.tokens_cache = 0
+        self.costo_usd = 0.0
+
+    # Toma los tokens de la respuesta del LLM (AIMessage) y calcula el costo
+    def uso_llm(self, respuesta, modelo=None):
+        uso = getattr(respuesta, "usage_metadata", None) or {}
+        self.tokens_entrada += uso.get("input_tokens") or 0
+        self.tokens_salida += uso.get("output_tokens") or 0
+        self.tokens_cache += tokens_en_cache(respuesta)
+        self.costo_usd = costo_estimado(
+            modelo or self.atributos.get("modelo"),
+            self.tokens_entrada,
+            self.tokens_salida,
+            self.tokens_cache,
+        )
+
+
+@contextmanager
+def span(etapa, **atributos):
+    """
+    Mide el bloque como la etapa `etapa`. Al terminar actualiza las métricas y escribe una
+    línea JSON en el logger "airregio.spans". Las excepciones se registran y se vuelven a lanzar.
+
+    Uso:
+        with span("llm_extraccion", modelo="gpt-4o-mini") as s:
+            respuesta = llm.invoke(mensajes)
+            s.uso_llm(respuesta)
+    """
+    actual = Span(etapa, atributos)
+    resultado, error = "ok", None
+    inicio = time.perf_counter()
+    try:
+        yield actual
+    except Exception as e:
+        resultado, error = "error", f"{type(e).__name__}: {e}"
+        raise
+    except BaseException:
+        # GeneratorExit, CancelledError o KeyboardInterrupt: el trabajo no terminó
+        resultado = "cancelado"
+        raise
+    finally:
+        _registrar(actual, time.perf_counter() - inicio, resultado, error)
+
+
+def _registrar(actual, segundos, resultado, error):
+    etapa = actual.etapa
+    with _lock:
+        duracion = _duraciones.setdefault(
+            etapa, {"buckets": [0] * len(BUCKETS_SEGUNDOS), "suma": 0.0, "conteo": 0}
+        )
+        for indice, limite in enumerate(BUCKETS_SEGUNDOS):
+            if segundos <= limite:
+                duracion["buckets"][indice] += 1
+        duracion["suma"] += segundos
+        duracion["conteo"] += 1
+        _resultados[(etapa, resultado)] = _resultados.get((etapa, resultado), 0) + 1
+        for tipo, valor in (
+            ("entrada", actual.tokens_entrada),
+            ("salida", actual.tokens_salida),
+            ("cache", actual.tokens_cache),
+        ):
+            if valor:
+                _tokens[(etapa, tipo)] = _tokens.get((etapa, tipo), 0) + valor
+        if actual.costo_usd:
+            _costos[etapa] = _costos.get(etapa, 0.0) + actual.costo_usd
+
+    if logger.isEnabledFor(logging.INFO):
+        registro = {
+            "ts": round(time.time(), 3),
+            "etapa": etapa,
+            "segundos": round(segundos, 6),
+            "resultado": resultado,
+            **actual.atributos,
+        }
+        if actual.tokens_entrada or actual.tokens_salida:
+            registro.update(
+                tokens_entrada=actual.tokens_entrada,
+                tokens_salida=actual.tokens_salida,
+                tokens_cache=actual.tokens_cache,
+                costo_usd=round(actual.costo_usd, 8),
+            )
+        if error is not None:
+            registro["error"] = error
+        logger.info(json.dumps(registro, ensure_ascii=False, default=str))
+
+
+def reiniciar_metricas():
+    with _lock:
+        _duraciones.clear()
+        _resultados.clear()
+        _tokens.clear()
+        _costos.clear()
+
+
+############################## Exportación ##############################
+
+
+def _etiquetas(**etiquetas):
+    partes = ",".join(
+        '{}="{}"'.format(nombre, str(valor).replace("\\", "\\\\").replace('"', '\\"'))
+        for nombre, valor in etiquetas.items()
+    )
+    return "{" + partes + "}"
+
+
+def exportar_prometheus():
+    """
+    Returns:
+        str: Métricas en el formato de texto de Prometheus.
+    """
+    with _lock:
+        duraciones = {etapa: dict(d, buckets=list(d["buckets"])) for etapa, d in _duraciones.items()}
+        resultados = dict(_resultados)
+        tokens = dict(_tokens)
+        costos = dict(_costos)
+
+    lineas = [
+        "# HELP airregio_span_segundos Duración de cada etapa del pipeline.",
+        "# TYPE airregio_span_segundos histogram",
+    ]
+    for etapa, duracion in sorted(duraciones.items()):
+        for limite, conteo in zip(BUCKETS_SEGUNDOS, duracion["buckets"]):
+            lineas.append(
+                f"airregio_span_segundos_bucket{_etiquetas(etapa=etapa, le=limite)} {conteo}"
+            )
+        lineas.append(
+            f"airregio_span_segundos_bucket{_etiquetas(etapa=etapa, le='+Inf')} {duracion['conteo']}"
+        )
+        lineas.append(f"airregio_span_segundos_sum{_etiquetas(etapa=etapa)} {duracion['suma']}")
+        lineas.append(
+            f"airregio_span_segundos_count{_etiquetas(etapa=etapa)} {duracion['conteo']}"
+        )
+
+    lineas += [
+        "# HELP airregio_spans_total Etapas terminadas por resultado (ok, error, cancelado).",
+        "# TYPE airregio_spans_total counter",
+    ]
+    for (etapa, resultado), conteo in sorted(resultados.items()):
+        lineas.append(
+            f"airregio_spans_total{_etiquetas(etapa=etapa, resultado=resultado)} {conteo}"
+        )
+
+    lineas += [
+        "# HELP airregio_tokens_total Tokens del LLM por etapa y tipo (entrada, salida, cache).",
+        "# TYPE airregio_tokens_total counter",
+    ]
+    for (etapa, tipo), conteo in sorted(tokens.items()):
+        lineas.append(f"airregio_tokens_total{_etiquetas(etapa=etapa, tipo=tipo)} {conteo}")
+
+    lineas += [
+        "# HELP airregio_costo_usd_total Costo estimado del LLM en dólares por etapa.",
+        "# TYPE airregio_costo_usd_total counter",
+    ]
+    for etapa, costo in sorted(costos.items()):
+        lineas.append(f"airregio_costo_usd_total{_etiquetas(etapa=etapa)} {costo:.8f}")
+
+    return "\n".join(lineas) + "\n"
+
+
+class _ManejadorMetricas(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        cuerpo = exportar_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def log_message(self, formato, *args):
+        pass
+
+
+def servir_metricas(puerto=9464, host="0.0.0.0"):
+    """
+    Expone /metrics en un hilo de fondo para que Prometheus lo lea.
+
+    Returns:
+        ThreadingHTTPServer: El servidor, por si se quiere detener con shutdown().
+    """
+    servidor = ThreadingHTTPServer((host, puerto), _ManejadorMetricas)
+    threading.Thread(
+        target=servidor.serve_forever, name="airregio-metricas", daemon=True
+    ).start()
+    return servidor
+
+
+def configurar_logs_json(stream=None):
+    """
+    Escribe cada span como una línea JSON en `stream` (stderr por defecto).
+    """
+    manejador = logging.StreamHandler(stream or sys.stderr)
+    manejador.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(manejador)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+
+# AIRREGIO_LOG_SPANS=1 activa los logs JSON sin tocar el código
+if os.getenv("AIRREGIO_LOG_SPANS", "0") == "1":
+    configurar_logs_json()
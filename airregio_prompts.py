@@ -0,0 +1,109 @@
+import hashlib
+import threading
+
+from langchain_core.messages import HumanMessage, SystemMessage
+
+
+############################## Registro de prompts ##############################
+
+
+class PromptRegistrado:
+    """
+    Prompt construido una sola vez al cargar el módulo.
+
+    El mensaje de sistema es texto fijo (instrucciones, tabla de factores y formato JSON) y
+    el mensaje del usuario empieza con un encabezado fijo y termina con la conversación.
+    Así el prefijo de cada llamada es idéntico byte por byte y el proveedor puede cachearlo.
+    """
+
+    def __init__(self, nombre, sistema, encabezado_usuario, parser=None):
+        self.nombre = nombre
+        self.sistema = sistema
+        self.encabezado_usuario = encabezado_usuario
+        self.parser = parser
+        huella = hashlib.sha256(
+            f"{sistema}\x1f{encabezado_usuario}".encode("utf-8")
+        ).hexdigest()
+        self.version = f"{nombre}-{huella[:12]}"
+        self._mensaje_sistema = SystemMessage(content=sistema)
+
+    def mensajes(self, conversacion, nota=None):
+        """
+        Args:
+            conversacion (str): Conversación (ya compactada) que va al final del prompt.
+            nota (Optional[str]): Indicación variable que se agrega antes de la conversación.
+
+        Returns:
+            list: [SystemMessage, HumanMessage]
+        """
+        contenido = self.encabezado_usuario
+        if nota:
+            contenido += f"{nota}\n\n"
+        return [self._mensaje_sistema, HumanMessage(content=contenido + str(conversacion))]
+
+
+_prompts = {}
+_uso = {}
+_uso_lock = threading.Lock()
+
+
+def registrar_prompt(nombre, sistema, encabezado_usuario, parser=None):
+    prompt = PromptRegistrado(nombre, sistema, encabezado_usuario, parser)
+    _prompts[nombre] = prompt
+    return prompt
+
+
+def obtener_prompt(nombre):
+    return _prompts[nombre]
+
+
+def versiones_prompts():
+    return {nombre: prompt.version for nombre, prompt in _prompts.items()}
+
+
+############################## Uso de tokens y cache del proveedor ##############################
+
+
+# Tokens de entrada que el proveedor sirvió desde su cache de prefijos
+def tokens_en_cache(respuesta):
+    uso = getattr(respuesta, "usage_metadata", None) or {}
+    detalles = uso.get("input_token_details") or {}
+    if detalles.get("cache_read") is not None:
+        return detalles["cache_read"]
+
+    metadatos = getattr(respuesta, "response_metadata", None) or {}
+    detalles = (metadatos.get("token_usage") or {}).get("prompt_tokens_details") or {}
+    return detalles.get("cached_tokens") or 0
+
+
+def registrar_uso(nombre, respuesta):
+    """
+    Acumula tokens de entrada, de salida y en cache para el prompt `nombre` a partir de la
+    respuesta del LLM (AIMessage).
+    """
+    uso = getattr(respuesta, "usage_metadata", None) or {}
+    with _uso_lock:
+        acumulado = _uso.setdefault(
+            nombre,
+            {"llamadas": 0, "tokens_entrada": 0, "tokens_cache": 0, "tokens_salida": 0},
+        )
+        acumulado["llamadas"] += 1
+        acumulado["tokens_entrada"] += uso.get("input_tokens") or 0
+        acumulado["tokens_salida"] += uso.get("output_tokens") or 0
+        acumulado["tokens_cache"] += tokens_en_cache(respuesta)
+
+
+def estadisticas_prompts():
+    """
+    Returns:
+        dict: Por prompt, su versión, llamadas, tokens y la fracción de entrada servida en cache.
+    """
+    with _uso_lock:
+        estadisticas = {nombre: dict(uso) for nombre, uso in _uso.items()}
+
+    for nombre, uso in estadisticas.items():
+        uso["version"] = _prompts[nombre].version if nombre in _prompts else None
+        uso["proporcion_cache"] = (
+            uso["tokens_cache"] / uso["tokens_entrada"] if uso["tokens_entrada"] else 0.0
+        )
+    return estadisticas
@@ -0,0 +1,329 @@
+"""
+Servicio HTTP para calificar leads desde el webhook del proveedor de WhatsApp.
+
+Uso:
+    python airregio_servicio.py --puerto 8080 --trabajadores 8 --cola 100
+
+Endpoints (JSON):
+    POST /extraer     {"conversation": "..."}  -> {"datos": {...}}
+    POST /calificar   {"conversation": "..."}  -> {"score_total": 75}
+    POST /procesar    {"conversation": "..."}  -> {"datos": {... , "score_total": 75}}
+    POST /leads       {"conversation": "..."} o {"datos": {...}}, opcional "upsert": true
+                      -> {"lead_id": 123, "datos": {...}}
+    POST /conversaciones/{id}
+                      {"conversation": "...", "odoo": true} -> recalificación incremental
+                      (solo los mensajes nuevos van al LLM; el lead solo se actualiza si cambió)
+    GET  /salud       -> estado de la cola y de los limitadores del LLM
+    GET  /metrics     -> métricas de Prometheus
+
+Todas las llamadas al LLM y a Odoo pasan por una cola acotada atendida por un número fijo de
+trabajadores. Si la cola está llena, el servicio responde 429 con Retry-After en lugar de
+acumular trabajo. El proceso usa un solo cliente del LLM y un solo cliente de Odoo.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+
+from aiohttp import web
+
+from airregio_agents_crm_simple import (
+    acalificar_conversacion,
+    aextraer_datos_conversacion,
+    cargar_referencias,
+    datos_a_lead,
+    procesar_conversacion_async,
+)
+from airregio_incremental import arecalificar_conversacion
+from airregio_limites import estadisticas_limitadores
+from airregio_metricas import exportar_prometheus
+
+
+############################## 1. Cola de trabajo acotada ##############################
+
+
+class ColaLlena(Exception):
+    pass
+
+
+class ColaTrabajo:
+    """
+    Cola con capacidad fija atendida por `trabajadores` tareas. Cada trabajo es una
+    corrutina; quien lo encola espera su resultado.
+
+    Args:
+        trabajadores (int): Trabajos que se ejecutan al mismo tiempo.
+        max_pendientes (int): Trabajos que pueden esperar en la cola antes de rechazar.
+    """
+
+    def __init__(self, trabajadores=8, max_pendientes=100):
+        self.trabajadores = trabajadores
+        self.max_pendientes = max_pendientes
+        self.en_proceso = 0
+        self.rechazados = 0
+        self._cola = None
+        self._tareas = []
+
+    async def iniciar(self):
+        self._cola = asyncio.Queue(maxsize=self.max_pendientes)
+        self._tareas = [
+            asyncio.create_task(self._trabajar()) for _ in range(self.trabajadores)
+        ]
+
+    async def detener(self):
+        for tarea in self._tareas:
+            tarea.cancel()
+        await asyncio.gather(*self._tareas, return_exceptions=True)
+        self._tareas = []
+
+    @property
+    def pendientes(self):
+        return self._cola.qsize() if self._cola is not None else 0
+
+    async def _trabajar(self):
+        while True:
+            corrutina, futuro = await self._cola.get()
+            if futuro.cancelled():
+                # El cliente ya se desconectó; no se paga una llamada que nadie va a leer
+                corrutina.close()
+                self._cola.task_done()
+                continue
+            self.en_proceso += 1
+            try:
+                resultado = await corrutina
+                if not futuro.done():
+                    futuro.set_result(resultado)
+            except asyncio.CancelledError:
+                futuro.cancel()
+                raise
+            except Exception as e:
+                if not futuro.done():
+                    futuro.set_exception(e)
+            finally:
+                self.en_proceso -= 1
+                self._cola.task_done()
+
+    async def ejecutar(self, corrutina):
+        """
+        Encola la corrutina y espera su resultado.
+
+        Raises:
+            ColaLlena: Si ya hay max_pendientes trabajos esperando.
+        """
+        futuro = asyncio.get_running_loop().create_future()
+        try:
+            self._cola.put_nowait((corrutina, futuro))
+        except asyncio.QueueFull:
+            corrutina.close()
+            self.rechazados += 1
+            raise ColaLlena()
+        return await futuro
+
+
+############################## 2. Endpoints ##############################
+
+
+CLAVE_COLA = web.AppKey("cola", ColaTrabajo)
+
+
+async def _leer_conversacion(request):
+    try:
+        cuerpo = await request.json()
+    except json.JSONDecodeError:
+        raise web.HTTPBadRequest(
+            text=json.dumps({"error": "El cuerpo no es JSON válido"}),
+            content_type="application/json",
+        )
+    if not isinstance(cuerpo, dict):
+        raise web.HTTPBadRequest(
+            text=json.dumps({"error": "Se esperaba un objeto JSON"}),
+            content_type="application/json",
+        )
+    return cuerpo, (
+        cuerpo.get("conversation") or cuerpo.get("conversacion") or cuerpo.get("text")
+    )
+
+
+def _error(estado, mensaje):
+    return web.json_response({"error": mensaje}, status=estado)
+
+
+async def _en_cola(request, corrutina):
+    try:
+        return await request.app[CLAVE_COLA].ejecutar(corrutina)
+    except ColaLlena:
+        raise web.HTTPTooManyRequests(
+            text=json.dumps({"error": "Demasiadas solicitudes en espera"}),
+            content_type="application/json",
+            headers={"Retry-After": "5"},
+        )
+
+
+async def extraer(request):
+    _, conversacion = await _leer_conversacion(request)
+    if not conversacion:
+        return _error(400, "Falta la conversación")
+    datos = await _en_cola(request, aextraer_datos_conversacion(conversacion))
+    if datos is None:
+        return _error(502, "El LLM no devolvió datos")
+    return web.json_response({"datos": datos})
+
+
+async def calificar(request):
+    _, conversacion = await _leer_conversacion(request)
+    if not conversacion:
+        return _error(400, "Falta la conversación")
+    score = await _en_cola(request, acalificar_conversacion(conversacion))
+    if score is None:
+        return _error(502, "El LLM no devolvió una calificación")
+    return web.json_response(score)
+
+
+async def procesar(request):
+    _, conversacion = await _leer_conversacion(request)
+    if not conversacion:
+        return _error(400, "Falta la conversación")
+    datos = await _en_cola(request, procesar_conversacion_async(conversacion))
+    if not datos:
+        return _error(502, "El LLM no devolvió datos")
+    return web.json_response({"datos": datos})
+
+
+# Extrae (si hace falta) y crea o actualiza el lead dentro del mismo trabajo de la cola
+async def _crear_lead(conversacion, datos, upsert):
+    if datos is None:
+        datos = await procesar_conversacion_async(conversacion)
+        if not datos:
+            return None, None
+
+    from CRM.lead_index import upsert_lead_full_data
+    from CRM.odoo_api_calls import create_lead_full_data
+
+    enviar_lead = upsert_lead_full_data if upsert else create_lead_full_data
+    # datos_a_lead no consulta Odoo, pero se deja fuera del loop junto con el envío
+    lead = await asyncio.to_thread(datos_a_lead, datos)
+    lead_id = await asyncio.to_thread(enviar_lead, **lead)
+    return lead_id, datos
+
+
+async def crear_lead(request):
+    cuerpo, conversacion = await _leer_conversacion(request)
+    datos = cuerpo.get("datos") if isinstance(cuerpo.get("datos"), dict) else None
+    if not conversacion and datos is None:
+        return _error(400, "Falta la conversación o los datos del lead")
+
+    lead_id, datos = await _en_cola(
+        request, _crear_lead(conversacion, datos, bool(cuerpo.get("upsert")))
+    )
+    if datos is None:
+        return _error(502, "El LLM no devolvió datos")
+    if lead_id is None:
+        return _error(502, "Odoo no creó el lead")
+    return web.json_response({"lead_id": lead_id, "datos": datos})
+
+
+async def recalificar(request):
+    cuerpo, conversacion = await _leer_conversacion(request)
+    if not conversacion:
+        return _error(400, "Falta la conversación")
+    resultado = await _en_cola(
+        request,
+        arecalificar_conversacion(
+            request.match_info["id_conversacion"],
+            conversacion,
+            sincronizar_odoo=bool(cuerpo.get("odoo")),
+        ),
+    )
+    if resultado is None:
+        return _error(502, "El LLM no devolvió datos")
+    return web.json_response(resultado)
+
+
+async def salud(request):
+    cola = request.app[CLAVE_COLA]
+    return web.json_response(
+        {
+            "pendientes": cola.pendientes,
+            "en_proceso": cola.en_proceso,
+            "trabajadores": cola.trabajadores,
+            "max_pendientes": cola.max_pendientes,
+            "rechazados": cola.rechazados,
+            "llm": estadisticas_limitadores(),
+        }
+    )
+
+
+async def metricas(request):
+    cola = request.app[CLAVE_COLA]
+    texto = exportar_prometheus() + (
+        "# HELP airregio_cola_pendientes Trabajos esperando un trabajador.\n"
+        "# TYPE airregio_cola_pendientes gauge\n"
+        f"airregio_cola_pendientes {cola.pendientes}\n"
+        "# HELP airregio_cola_rechazados_total Solicitudes rechazadas con 429.\n"
+        "# TYPE airregio_cola_rechazados_total counter\n"
+        f"airregio_cola_rechazados_total {cola.rechazados}\n"
+    )
+    return web.Response(text=texto, content_type="text/plain", charset="utf-8")
+
+
+############################## 3. Aplicación ##############################
+
+
+def crear_app(trabajadores=None, max_pendientes=None):
+    cola = ColaTrabajo(
+        trabajadores=trabajadores or int(os.getenv("AIRREGIO_TRABAJADORES", "8")),
+        max_pendientes=max_pendientes or int(os.getenv("AIRREGIO_COLA_MAX", "100")),
+    )
+
+    app = web.Application(client_max_size=4 * 1024 * 1024)
+    app[CLAVE_COLA] = cola
+
+    async def al_iniciar(app):
+        # Etiquetas y etapas de Odoo antes de aceptar conversaciones; después las recarga un
+        # hilo de fondo y los prompts nunca esperan a Odoo dentro del loop
+        await asyncio.to_thread(cargar_referencias)
+        await cola.iniciar()
+
+    async def al_cerrar(app):
+        await cola.detener()
+
+    app.on_startup.append(al_iniciar)
+    app.on_cleanup.append(al_cerrar)
+    app.add_routes(
+        [
+            web.post("/extraer", extraer),
+            web.post("/calificar", calificar),
+            web.post("/procesar", procesar),
+            web.post("/leads", crear_lead),
+            web.post("/conversaciones/{id_conversacion}", recalificar),
+            web.get("/salud", salud),
+            web.get("/metrics", metricas),
+        ]
+    )
+    return app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Servicio HTTP de extracción y calificación de leads de AIRREGIO."
+    )
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--puerto", type=int, default=8080)
+    parser.add_argument(
+        "--trabajadores", type=int, default=None, help="Trabajos en paralelo (LLM y Odoo)"
+    )
+    parser.add_argument(
+        "--cola", type=int, default=None, help="Trabajos en espera antes de responder 429"
+    )
+    args = parser.parse_args(argv)
+
+    web.run_app(
+        crear_app(trabajadores=args.trabajadores, max_pendientes=args.cola),
+        host=args.host,
+        port=args.puerto,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,28 +1,88 @@
 import streamlit as st
 import sys
 import os
+import json
+import re
+from concurrent.futures import ThreadPoolExecutor
 
-from CRM.odoo_api_calls import create_lead_full_data
+from CRM.lead_queue import enqueue_lead_full_data, get_lead_queue
 
 from airregio_agents_crm_simple import (
-    extraer_datos_conversacion,
-    calificar_conversacion,
+    MODO_FUSIONADO,
+    VENDEDOR_PREDETERMINADO,
+    cargar_referencias,
+    etapa_inicial,
+    etiquetas_validas,
+    invalidar_referencias,
+    prioridad_desde_score,
+    procesar_conversacion_stream,
+    vendedor_valido,
 )
 
 st.title("Extractor de Información de Chat para CRM")
 
+# Permite comparar costo y latencia entre una sola llamada fusionada y dos llamadas en paralelo
+modo_fusionado = st.sidebar.checkbox(
+    "Modo fusionado (extraer y calificar en una sola llamada)", value=MODO_FUSIONADO
+)
+
+# Etiquetas de los campos en el orden en que se muestran
+ETIQUETAS_CAMPOS = {
+    "contact_name": "Nombre del Contacto",
+    "partner_name": "Nombre de la Compañía",
+    "phone": "Teléfono",
+    "email_from": "Correo Electrónico",
+    "description": "Descripción",
+    "conversation_name": "Nombre de la Conversación",
+    "tag_ids": "IDs de Etiquetas",
+    "street": "Calle",
+    "score_total": "Puntuación Total",
+}
+
+
+############################## Recursos compartidos ##############################
+
+
+# Un solo ejecutor por proceso para todas las sesiones: las extracciones siguen corriendo
+# mientras el operador revisa las que ya terminaron. El cliente del LLM (módulo de agentes)
+# y el de Odoo (get_client) ya son uno por proceso.
+@st.cache_resource
+def obtener_ejecutor():
+    return ThreadPoolExecutor(
+        max_workers=int(os.getenv("AIRREGIO_TRABAJADORES_APP", "4")),
+        thread_name_prefix="airregio-app",
+    )
+
+
+@st.cache_resource
+def obtener_cola_odoo():
+    return get_lead_queue()
+
+
+# Etiquetas y etapas de Odoo: se cargan una vez por proceso y luego las recarga un hilo de fondo
+@st.cache_resource
+def iniciar_referencias():
+    cargar_referencias()
+
+
+iniciar_referencias()
+
+
+############################## Cola de conversaciones ##############################
+
+
 # Inicializar session_state si no existe
-if "datos" not in st.session_state:
-    st.session_state["datos"] = {}
-if "datos_editados" not in st.session_state:
-    st.session_state["datos_editados"] = {}
-if "mostrar_formulario" not in st.session_state:
-    st.session_state["mostrar_formulario"] = False
-
-# Área de texto para pegar la conversación
-conversation = st.text_area(
-    "Pega aquí una conversación de WhatsApp o cadena de correo y el agente IA extraerá la información para subirla al CRM de tu empresa.",
-    value="""[10:15 am, 26/10/2024] Fernanda: Hola, buenos días. Estoy interesada en impermeabilizar una plataforma industrial. ¿Podrían ayudarme con eso?
+if "trabajos" not in st.session_state:
+    st.session_state["trabajos"] = {}
+if "siguiente_trabajo" not in st.session_state:
+    st.session_state["siguiente_trabajo"] = 1
+if "terminados_mostrados" not in st.session_state:
+    st.session_state["terminados_mostrados"] = set()
+
+# Una línea que solo tenga --- separa conversaciones pegadas juntas
+_RE_SEPARADOR = re.compile(r"^\s*-{3,}\s*$", re.MULTILINE)
+
+EJEMPLO_CONVERSACION = """[10:15 am, 26/10/2024] Fernanda: Hola, buenos días. Estoy interesada en impermeabilizar una plataforma industrial. ¿Podrían ayudarme con eso?
 
 [10:16 am, 26/10/2024] Asistente: ¡Hola, Fernanda! Buenos días. Claro que sí, en AIRREGIO tenemos amplia experiencia en la impermeabilización de plataformas industriales. ¿Podrías contarme un poco más sobre lo que necesitas?
 
@@ -48,119 +108,302 @@ conversation = st.text_area(
 
 [10:27 am, 26/10/2024] Fernanda: Gracias, quedo al pendiente del correo. ¡Nos vemos el martes!
 
-[10:28 am, 26/10/2024] Asistente: ¡Gracias a ti, Fernanda! Nos vemos el martes. Que tengas un excelente día.""",
-    height=500,  # Adjust the height as desired
-)
+[10:28 am, 26/10/2024] Asistente: ¡Gracias a ti, Fernanda! Nos vemos el martes. Que tengas un excelente día."""
+
+
+# Corre en el ejecutor: los campos se guardan en el trabajo a medida que llegan para mostrarlos
+# en la bandeja antes de que termine
+def procesar_trabajo(trabajo, fusionado):
+    for campo, valor in procesar_conversacion_stream(
+        trabajo["conversacion"], fusionado=fusionado
+    ):
+        if valor is None:
+            trabajo["parcial"].pop(campo, None)
+        else:
+            trabajo["parcial"][campo] = valor
+    return dict(trabajo["parcial"])
+
+
+def agregar_trabajo(nombre, conversacion):
+    numero = st.session_state["siguiente_trabajo"]
+    st.session_state["siguiente_trabajo"] += 1
+    trabajo = {
+        "nombre": nombre or f"Conversación {numero}",
+        "conversacion": conversacion,
+        "parcial": {},
+        "enviado": False,
+    }
+    trabajo["futuro"] = obtener_ejecutor().submit(procesar_trabajo, trabajo, modo_fusionado)
+    st.session_state["trabajos"][f"trabajo_{numero}"] = trabajo
+
+
+# Una conversación por archivo .txt / .eml, o un JSONL con una por línea (mismas claves que
+# airregio_batch: "conversation", "conversacion" o "text")
+def leer_archivos(archivos):
+    for archivo in archivos:
+        contenido = archivo.getvalue().decode("utf-8", errors="replace")
+        nombre = os.path.splitext(archivo.name)[0]
+        if not archivo.name.endswith(".jsonl"):
+            yield nombre, contenido
+            continue
+        for numero, linea in enumerate(contenido.splitlines(), start=1):
+            if not linea.strip():
+                continue
+            try:
+                registro = json.loads(linea)
+            except json.JSONDecodeError:
+                st.warning(f"{archivo.name}, línea {numero}: JSON inválido")
+                continue
+            texto = (
+                registro.get("conversation")
+                or registro.get("conversacion")
+                or registro.get("text")
+            )
+            if texto:
+                yield str(registro.get("id") or f"{nombre} #{numero}"), texto
 
-# Botón para extraer información
-if st.button("Extraer Información"):
-    if conversation.strip() != "":
-        # Llamar a las funciones para extraer datos y calificación
-        datos_conversacion = extraer_datos_conversacion(conversation)
-        calificacion = calificar_conversacion(conversation)
 
-        # Combinar los datos obtenidos
-        st.session_state["datos"] = {**datos_conversacion, **calificacion}
-        st.session_state["mostrar_formulario"] = True
+def estado_trabajo(trabajo):
+    if trabajo["enviado"]:
+        return "enviado"
+    futuro = trabajo["futuro"]
+    if not futuro.done():
+        return "procesando" if futuro.running() else "en espera"
+    if futuro.exception() is not None or not futuro.result():
+        return "error"
+    return "listo"
+
+
+# El formulario para agregar conversaciones no hace rerun mientras se escribe
+with st.form("nuevas_conversaciones", clear_on_submit=True):
+    pegadas = st.text_area(
+        "Pega aquí una o varias conversaciones de WhatsApp o cadenas de correo (separadas por "
+        "una línea con ---) y el agente IA extraerá la información para subirla al CRM de tu "
+        "empresa.",
+        value=EJEMPLO_CONVERSACION,
+        height=500,  # Adjust the height as desired
+    )
+    archivos = st.file_uploader(
+        "O sube archivos (.txt o .eml con una conversación, .jsonl con una por línea)",
+        type=["txt", "eml", "jsonl"],
+        accept_multiple_files=True,
+    )
+    agregar = st.form_submit_button("Extraer Información")
+
+if agregar:
+    conversaciones = [
+        (None, texto.strip()) for texto in _RE_SEPARADOR.split(pegadas) if texto.strip()
+    ]
+    conversaciones.extend(leer_archivos(archivos or []))
+    if conversaciones:
+        for nombre, conversacion in conversaciones:
+            agregar_trabajo(nombre, conversacion)
     else:
         st.warning("Por favor, pegue la conversación de WhatsApp antes de continuar.")
 
-# Mostrar el formulario si los datos han sido extraídos
-if st.session_state.get("mostrar_formulario", False):
-    st.write("Edite los datos extraídos si es necesario:")
+trabajos = st.session_state["trabajos"]
+terminados = {
+    id_trabajo
+    for id_trabajo, trabajo in trabajos.items()
+    if trabajo["futuro"].done()
+}
+st.session_state["terminados_mostrados"] = terminados
+pendientes = len(trabajos) - len(terminados)
 
-    datos = st.session_state["datos"]
 
-    # Mostrar campos editables para los datos extraídos
-    contact_name = st.text_input("Nombre del Contacto", datos.get("contact_name", ""))
-    partner_name = st.text_input("Nombre de la Compañía", datos.get("partner_name", ""))
-    phone = st.text_input("Teléfono", datos.get("phone", ""))
-    email_from = st.text_input("Correo Electrónico", datos.get("email_from", ""))
-    description = st.text_area("Descripción", datos.get("description", ""))
-    conversation_name = st.text_input(
-        "Nombre de la Conversación", datos.get("conversation_name", "")
+############################## Bandeja ##############################
+
+
+# Se actualiza sola cada 2 segundos mientras hay conversaciones en proceso, sin volver a
+# ejecutar la página. Cuando termina una, se recarga la página para mostrar su formulario.
+def bandeja():
+    trabajos = st.session_state["trabajos"]
+    terminados = {
+        id_trabajo
+        for id_trabajo, trabajo in trabajos.items()
+        if trabajo["futuro"].done()
+    }
+    if terminados != st.session_state["terminados_mostrados"]:
+        st.rerun()
+    if not trabajos:
+        return
+
+    en_proceso = len(trabajos) - len(terminados)
+    st.progress(
+        len(terminados) / len(trabajos),
+        text=f"{len(terminados)} de {len(trabajos)} conversaciones procesadas"
+        + (f" · {en_proceso} en proceso" if en_proceso else ""),
+    )
+    st.dataframe(
+        [
+            {
+                "Conversación": trabajo["nombre"],
+                "Estado": estado_trabajo(trabajo),
+                ETIQUETAS_CAMPOS["contact_name"]: trabajo["parcial"].get("contact_name"),
+                ETIQUETAS_CAMPOS["partner_name"]: trabajo["parcial"].get("partner_name"),
+                ETIQUETAS_CAMPOS["score_total"]: trabajo["parcial"].get("score_total"),
+            }
+            for trabajo in trabajos.values()
+        ],
+        hide_index=True,
+        use_container_width=True,
     )
-    tag_ids = st.text_input(
-        "IDs de Etiquetas (separados por comas)",
-        ", ".join(map(str, datos.get("tag_ids", []))),
+
+
+st.fragment(bandeja, run_every=2 if pendientes else None)()
+
+
+############################## Revisión ##############################
+
+
+def enviar_lead(valores, actualizar_existente):
+    # Preparar datos para la función create_lead_full_data
+    tag_ids_list = (
+        [int(tag.strip()) for tag in valores["tag_ids"].split(",") if tag.strip()]
+        if valores["tag_ids"] != ""
+        else None
     )
-    street = st.text_input("Calle", datos.get("street", ""))
+    # Solo etiquetas que existen en Odoo; un id desconocido haría fallar el envío
+    tag_ids_list = etiquetas_validas(tag_ids_list) or None
+
+    # El lead se guarda en la cola local y un hilo de fondo lo envía a Odoo, así la
+    # página no espera a Odoo y el lead no se pierde si Odoo está caído
+    enqueue_lead_full_data(
+        upsert=actualizar_existente,
+        lead_name=valores["conversation_name"],
+        phone_number_id=valores["phone"],
+        contact_name=valores["contact_name"] or None,
+        email_from=valores["email_from"] or None,
+        partner_name=valores["partner_name"] or None,
+        description=valores["description"] or None,
+        priority=valores["priority"],
+        tag_ids=tag_ids_list,
+        street=valores["street"] or None,
+        stage_id=etapa_inicial(),
+        user_id=vendedor_valido(VENDEDOR_PREDETERMINADO),
+    )
+
+
+# Cada formulario es un fragmento: editar un campo solo vuelve a ejecutar ese formulario
+@st.fragment
+def formulario_revision(id_trabajo):
+    trabajo = st.session_state["trabajos"][id_trabajo]
+    datos = trabajo["futuro"].result()
+
+    def campo(nombre):
+        return f"{id_trabajo}_{nombre}"
+
+    # Mostrar campos editables para los datos extraídos
+    valores = {
+        "contact_name": st.text_input(
+            "Nombre del Contacto", datos.get("contact_name") or "", key=campo("contact_name")
+        ),
+        "partner_name": st.text_input(
+            "Nombre de la Compañía", datos.get("partner_name") or "", key=campo("partner_name")
+        ),
+        "phone": st.text_input("Teléfono", datos.get("phone") or "", key=campo("phone")),
+        "email_from": st.text_input(
+            "Correo Electrónico", datos.get("email_from") or "", key=campo("email_from")
+        ),
+        "description": st.text_area(
+            "Descripción", datos.get("description") or "", key=campo("description")
+        ),
+        "conversation_name": st.text_input(
+            "Nombre de la Conversación",
+            datos.get("conversation_name") or "",
+            key=campo("conversation_name"),
+        ),
+        "tag_ids": st.text_input(
+            "IDs de Etiquetas (separados por comas)",
+            ", ".join(map(str, datos.get("tag_ids") or [])),
+            key=campo("tag_ids"),
+        ),
+        "street": st.text_input("Calle", datos.get("street") or "", key=campo("street")),
+    }
     score_total = datos.get("score_total", 0)
     st.write(f"Puntuación Total: {score_total}")
 
     # Determinar prioridad basada en score_total
-    if score_total < 33:
-        priority = "1"
-    elif 34 <= score_total <= 66:
-        priority = "2"
-    else:
-        priority = "3"
-
-    st.write(f"Prioridad: {priority}")
-
-    # Actualizar datos editados en session_state
-    st.session_state["datos_editados"] = {
-        "contact_name": contact_name,
-        "partner_name": partner_name,
-        "phone": phone,
-        "email_from": email_from,
-        "description": description,
-        "conversation_name": conversation_name,
-        "tag_ids": tag_ids,
-        "street": street,
-        "score_total": score_total,
-        "priority": priority,
-    }
+    valores["priority"] = prioridad_desde_score(score_total)
+    st.write(f"Prioridad: {valores['priority']}")
 
-    # Botón para enviar datos al CRM
-    if st.button("Enviar a CRM"):
-        datos_editados = st.session_state["datos_editados"]
-
-        # Preparar datos para la función create_lead_full_data
-        lead_name = datos_editados["conversation_name"]
-        phone_number_id = datos_editados["phone"]
-        contact_name = (
-            datos_editados["contact_name"]
-            if datos_editados["contact_name"] != ""
-            else None
-        )
-        email_from = (
-            datos_editados["email_from"] if datos_editados["email_from"] != "" else None
-        )
-        partner_name = (
-            datos_editados["partner_name"]
-            if datos_editados["partner_name"] != ""
-            else None
+    etiquetas = [tag.strip() for tag in valores["tag_ids"].split(",") if tag.strip()]
+    if not all(tag.isdigit() for tag in etiquetas):
+        st.error("Los IDs de etiquetas deben ser números separados por comas.")
+        return
+    descartadas = set(map(int, etiquetas)) - set(etiquetas_validas(list(map(int, etiquetas))))
+    if descartadas:
+        st.warning(
+            "Se omitirán etiquetas que no existen en el CRM: "
+            + ", ".join(map(str, sorted(descartadas)))
         )
-        description = (
-            datos_editados["description"]
-            if datos_editados["description"] != ""
-            else None
-        )
-        tag_ids_list = (
-            [int(tag.strip()) for tag in datos_editados["tag_ids"].split(",")]
-            if datos_editados["tag_ids"] != ""
-            else None
-        )
-        street = datos_editados["street"] if datos_editados["street"] != "" else None
-        priority = datos_editados["priority"]
-
-        # Llamar a la función para crear el lead en el CRM
-        create_lead_full_data(
-            lead_name=lead_name,
-            phone_number_id=phone_number_id,
-            contact_name=contact_name,
-            email_from=email_from,
-            partner_name=partner_name,
-            description=description,
-            priority=priority,
-            tag_ids=tag_ids_list,
-            street=street,
-            stage_id=None,
-        )
-        st.success("Los datos han sido actualizados")
 
-        # Reiniciar el estado para permitir nuevas entradas
-        st.session_state["mostrar_formulario"] = False
-        st.session_state["datos"] = {}
-        st.session_state["datos_editados"] = {}
+    # Si el contacto ya tiene un lead (mismo teléfono, correo o empresa), actualizarlo
+    actualizar_existente = st.checkbox(
+        "Actualizar el lead existente si el contacto ya está en el CRM",
+        value=True,
+        key=campo("actualizar_existente"),
+    )
+
+    enviar, descartar = st.columns(2)
+    # Botón para enviar datos al CRM
+    if enviar.button("Enviar a CRM", key=campo("enviar"), type="primary"):
+        enviar_lead(valores, actualizar_existente)
+        trabajo["enviado"] = True
+        st.toast(f"{trabajo['nombre']}: el lead quedó en cola para enviarse al CRM")
+        st.rerun()
+    if descartar.button("Descartar", key=campo("descartar")):
+        del st.session_state["trabajos"][id_trabajo]
+        st.rerun()
+
+
+for id_trabajo, trabajo in list(trabajos.items()):
+    if id_trabajo not in terminados or trabajo["enviado"]:
+        continue
+    with st.expander(trabajo["nombre"], expanded=True):
+        if estado_trabajo(trabajo) == "error":
+            st.error("No se pudo extraer la información de esta conversación.")
+            reintentar, descartar = st.columns(2)
+            if reintentar.button("Reintentar", key=f"{id_trabajo}_reintentar"):
+                del trabajos[id_trabajo]
+                agregar_trabajo(trabajo["nombre"], trabajo["conversacion"])
+                st.rerun()
+            if descartar.button("Descartar", key=f"{id_trabajo}_descartar"):
+                del trabajos[id_trabajo]
+                st.rerun()
+            continue
+        st.write("Edite los datos extraídos si es necesario:")
+        formulario_revision(id_trabajo)
+
+enviados = [id_trabajo for id_trabajo, trabajo in trabajos.items() if trabajo["enviado"]]
+if enviados and st.button(f"Quitar las enviadas de la bandeja ({len(enviados)})"):
+    for id_trabajo in enviados:
+        del trabajos[id_trabajo]
+    st.rerun()
+
+# Estado de los envíos a Odoo: pendientes, fallidos y sin confirmar
+with st.sidebar.expander("Envíos al CRM"):
+    cola_odoo = obtener_cola_odoo()
+    estado_cola = cola_odoo.status()
+    conteos = estado_cola["counts"]
+    st.write(
+        f"Pendientes: {conteos['pending'] + conteos['sending']} · "
+        f"Enviados: {conteos['done']} · Fallidos: {conteos['failed']} · "
+        f"Sin confirmar: {conteos['unknown']}"
+    )
+    for envio in estado_cola["items"]:
+        st.caption(
+            f"{envio['status']} · intentos: {envio['attempts']}"
+            + (f" · {envio['error']}" if envio["error"] else "")
+        )
+        # Sin confirmar: se cortó la conexión y Odoo pudo haberlo creado
+        if envio["status"] == "unknown":
+            st.caption("Revisa en Odoo que el lead no exista antes de reintentar.")
+        if envio["status"] in ("failed", "unknown") and st.button(
+            "Reintentar", key=f"reintentar_{envio['idempotency_key']}"
+        ):
+            cola_odoo.retry(envio["idempotency_key"])
+            st.rerun()
+    # Después de editar etiquetas o etapas en Odoo
+    if st.button("Recargar etiquetas y etapas"):
+        invalidar_referencias()
@@ -0,0 +1,89 @@
+"""
+Benchmark de la extracción determinista de teléfono, correo y fechas.
+
+Uso:
+    python benchmarks/bench_extraccion_rapida.py [--repeticiones 2000]
+
+Mide los microsegundos por conversación sobre el corpus de conversaciones_muestra.jsonl y
+compara el resultado con los valores esperados de cada muestra.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from airregio_extraccion_rapida import extraer_campos_deterministas  # noqa: E402
+
+RUTA_CORPUS = os.path.join(os.path.dirname(__file__), "conversaciones_muestra.jsonl")
+
+
+def cargar_corpus(ruta=RUTA_CORPUS):
+    with open(ruta, encoding="utf-8") as archivo:
+        return [json.loads(linea) for linea in archivo if linea.strip()]
+
+
+def _fechas_como_texto(fechas):
+    return [
+        fecha.strftime("%d/%m/%Y %H:%M" if fecha.hour or fecha.minute else "%d/%m/%Y")
+        for fecha in fechas
+    ]
+
+
+def verificar(corpus):
+    aciertos = 0
+    total = 0
+    for muestra in corpus:
+        campos = extraer_campos_deterministas(muestra["conversation"])
+        obtenido = {
+            "phone": campos["phone"],
+            "email_from": campos["email_from"],
+            "fechas": _fechas_como_texto(campos["fechas"]),
+        }
+        for campo, esperado in muestra["esperado"].items():
+            total += 1
+            if obtenido[campo] == esperado:
+                aciertos += 1
+            else:
+                print(
+                    f"  [{muestra['id']}] {campo}: esperado {esperado!r}, obtenido {obtenido[campo]!r}"
+                )
+    return aciertos, total
+
+
+def medir(corpus, repeticiones):
+    tiempos = {}
+    for muestra in corpus:
+        conversacion = muestra["conversation"]
+        inicio = time.perf_counter()
+        for _ in range(repeticiones):
+            extraer_campos_deterministas(conversacion)
+        tiempos[muestra["id"]] = (time.perf_counter() - inicio) / repeticiones * 1e6
+    return tiempos
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeticiones", type=int, default=2000)
+    args = parser.parse_args(argv)
+
+    corpus = cargar_corpus()
+
+    print("Exactitud contra el corpus:")
+    aciertos, total = verificar(corpus)
+    print(f"  {aciertos}/{total} campos correctos\n")
+
+    print(f"Tiempo por conversación ({args.repeticiones} repeticiones):")
+    tiempos = medir(corpus, args.repeticiones)
+    for id_muestra, microsegundos in tiempos.items():
+        caracteres = len(next(m for m in corpus if m["id"] == id_muestra)["conversation"])
+        print(f"  {id_muestra:<25} {microsegundos:8.1f} µs  ({caracteres} caracteres)")
+    promedio = sum(tiempos.values()) / len(tiempos)
+    print(f"  {'promedio':<25} {promedio:8.1f} µs")
+
+
+if __name__ == "__main__":
+    main()
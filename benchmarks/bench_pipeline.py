@@ -0,0 +1,250 @@
+"""
+Benchmark de punta a punta del pipeline con un LLM simulado y un Odoo local.
+
+Uso:
+    python benchmarks/bench_pipeline.py [--escenarios individual lote larga] [--lote 50]
+        [--latencia 0.5] [--segundos-por-token 0.01] [--latencia-odoo 0.02] [--json salida.json]
+
+No llama a la API ni escribe en la base real: el modelo responde con
+respuestas_grabadas.json y los leads se crean en odoo_simulado.OdooSimulado. Para cada
+escenario reporta p50/p95/p99 de la latencia por conversación, llamadas y tokens por etapa
+del LLM y las llamadas RPC a Odoo por método.
+
+Escenarios:
+    individual  Una conversación a la vez: extracción + calificación y create del lead.
+    lote        N conversaciones con airregio_batch (concurrencia y create en lotes).
+    larga       Un hilo largo que pasa por el modo map-reduce.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from odoo_simulado import OdooSimulado  # noqa: E402
+
+RUTA_CORPUS = os.path.join(os.path.dirname(__file__), "conversaciones_muestra.jsonl")
+
+
+def cargar_corpus(ruta=RUTA_CORPUS):
+    with open(ruta, encoding="utf-8") as archivo:
+        return [json.loads(linea) for linea in archivo if linea.strip()]
+
+
+# Percentil por rango más cercano; no interpola para que los números sean valores medidos
+def percentil(valores, p):
+    if not valores:
+        return None
+    ordenados = sorted(valores)
+    indice = max(0, min(len(ordenados) - 1, round(p / 100 * len(ordenados) + 0.5) - 1))
+    return ordenados[indice]
+
+
+def resumir_latencias(valores):
+    return {
+        "n": len(valores),
+        "p50": percentil(valores, 50),
+        "p95": percentil(valores, 95),
+        "p99": percentil(valores, 99),
+        "max": max(valores) if valores else None,
+    }
+
+
+def resumir_llm(llamadas):
+    etapas = {}
+    for llamada in llamadas:
+        etapa = etapas.setdefault(
+            llamada["prompt"],
+            {"llamadas": 0, "tokens_entrada": 0, "tokens_salida": 0, "segundos": []},
+        )
+        etapa["llamadas"] += 1
+        etapa["tokens_entrada"] += llamada["tokens_entrada"]
+        etapa["tokens_salida"] += llamada["tokens_salida"]
+        etapa["segundos"].append(llamada["segundos"])
+    for etapa in etapas.values():
+        etapa["segundos"] = resumir_latencias(etapa["segundos"])
+    return etapas
+
+
+############################## Escenarios ##############################
+
+
+async def escenario_individual(corpus, repeticiones, odoo, fusionado):
+    from airregio_agents_crm_simple import datos_a_lead, procesar_conversacion_async
+    from CRM.odoo_api_calls import create_lead_full_data
+
+    latencias, latencias_odoo = [], []
+    for numero in range(repeticiones):
+        conversacion = corpus[numero % len(corpus)]["conversation"]
+        inicio = time.perf_counter()
+        datos = await procesar_conversacion_async(conversacion, fusionado=fusionado)
+        inicio_odoo = time.perf_counter()
+        await asyncio.to_thread(create_lead_full_data, **datos_a_lead(datos))
+        fin = time.perf_counter()
+        latencias.append(fin - inicio)
+        latencias_odoo.append(fin - inicio_odoo)
+    return latencias, latencias_odoo
+
+
+async def escenario_lote(corpus, tamano, odoo, fusionado, concurrencia):
+    from airregio_batch import procesar_lote
+
+    conversaciones = [
+        (f"{corpus[i % len(corpus)]['id']}-{i}", corpus[i % len(corpus)]["conversation"])
+        for i in range(tamano)
+    ]
+    with tempfile.TemporaryDirectory() as directorio:
+        ruta_salida = os.path.join(directorio, "resultados.jsonl")
+        await procesar_lote(
+            conversaciones,
+            ruta_salida,
+            concurrencia=concurrencia,
+            modo_odoo="create",
+            fusionado=fusionado,
+        )
+        with open(ruta_salida, encoding="utf-8") as archivo:
+            registros = [json.loads(linea) for linea in archivo]
+    return [registro["segundos"] for registro in registros], []
+
+
+async def escenario_larga(corpus, repeticiones, odoo, fusionado):
+    from airregio_agents_crm_simple import UMBRAL_TOKENS_LARGO
+    from airregio_conversacion import contar_tokens
+
+    # Se repite el corpus hasta pasar el umbral del modo map-reduce
+    partes, tokens = [], 0
+    while tokens <= UMBRAL_TOKENS_LARGO:
+        for muestra in corpus:
+            partes.append(muestra["conversation"])
+            tokens += contar_tokens(muestra["conversation"])
+    hilo = "\n\n".join(partes)
+    return await escenario_individual(
+        [{"conversation": hilo}], repeticiones, odoo, fusionado
+    )
+
+
+############################## Ejecución ##############################
+
+
+async def ejecutar(args, odoo, modelo):
+    corpus = cargar_corpus()
+    resultados = {}
+    for escenario in args.escenarios:
+        modelo.reiniciar()
+        odoo.reiniciar_contadores()
+        inicio = time.perf_counter()
+        if escenario == "individual":
+            latencias, latencias_odoo = await escenario_individual(
+                corpus, args.repeticiones, odoo, args.fusionado
+            )
+        elif escenario == "lote":
+            latencias, latencias_odoo = await escenario_lote(
+                corpus, args.lote, odoo, args.fusionado, args.concurrencia
+            )
+        else:
+            latencias, latencias_odoo = await escenario_larga(
+                corpus, max(1, args.repeticiones // 5), odoo, args.fusionado
+            )
+        segundos = time.perf_counter() - inicio
+
+        resultados[escenario] = {
+            "segundos": round(segundos, 3),
+            "conversaciones_por_segundo": round(len(latencias) / segundos, 2),
+            "latencia_conversacion": resumir_latencias(latencias),
+            "latencia_odoo": resumir_latencias(latencias_odoo),
+            "llm": resumir_llm(modelo.llamadas),
+            "rpc_odoo": dict(odoo.contadores),
+        }
+    return resultados
+
+
+def _ms(segundos):
+    return "-" if segundos is None else f"{segundos * 1000:8.1f}"
+
+
+def imprimir(resultados):
+    for escenario, resultado in resultados.items():
+        print(
+            f"\n== {escenario}: {resultado['latencia_conversacion']['n']} conversaciones en "
+            f"{resultado['segundos']} s ({resultado['conversaciones_por_segundo']}/s)"
+        )
+        print(f"  {'latencia (ms)':<24} {'p50':>8} {'p95':>8} {'p99':>8}")
+        for nombre, clave in (("conversación", "latencia_conversacion"), ("odoo", "latencia_odoo")):
+            latencia = resultado[clave]
+            if latencia["n"]:
+                print(
+                    f"  {nombre:<24} {_ms(latencia['p50'])} {_ms(latencia['p95'])} {_ms(latencia['p99'])}"
+                )
+        for etapa, datos in resultado["llm"].items():
+            latencia = datos["segundos"]
+            print(
+                f"  llm {etapa:<20} {_ms(latencia['p50'])} {_ms(latencia['p95'])} {_ms(latencia['p99'])}"
+                f"  {datos['llamadas']} llamadas, {datos['tokens_entrada']} tokens entrada,"
+                f" {datos['tokens_salida']} salida"
+            )
+        rpc = ", ".join(f"{metodo}={n}" for metodo, n in sorted(resultado["rpc_odoo"].items()))
+        print(f"  rpc odoo: {rpc or '-'}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--escenarios",
+        nargs="+",
+        choices=["individual", "lote", "larga"],
+        default=["individual", "lote", "larga"],
+    )
+    parser.add_argument("--repeticiones", type=int, default=20)
+    parser.add_argument("--lote", type=int, default=50, help="Conversaciones del escenario lote")
+    parser.add_argument("--concurrencia", type=int, default=8)
+    parser.add_argument("--latencia", type=float, default=0.5, help="Segundos al primer token")
+    parser.add_argument("--segundos-por-token", type=float, default=0.01)
+    parser.add_argument("--latencia-odoo", type=float, default=0.02)
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--fusionado", action="store_true", default=None)
+    parser.add_argument("--json", default=None, help="Guardar los resultados en este archivo")
+    args = parser.parse_args(argv)
+
+    with OdooSimulado(latencia=args.latencia_odoo) as odoo:
+        # Antes de importar el pipeline: el cliente de Odoo toma las credenciales al cargarse,
+        # la cache de resultados y el índice de duplicados ocultarían las llamadas al LLM, el
+        # limitador frenaría al modelo simulado y la clave de la API no se usa
+        os.environ.update(
+            ODOO_URL=odoo.url,
+            ODOO_DB=odoo.db,
+            ODOO_USERNAME=odoo.username,
+            ODOO_PASSWORD=odoo.password,
+            AIRREGIO_CACHE="0",
+            AIRREGIO_LIMITADOR="0",
+            AIRREGIO_DUPLICADOS="0",
+        )
+        os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+        os.environ.setdefault("GROQ_API_KEY", "gsk-benchmark")
+
+        import airregio_agents_crm_simple as agentes
+        from llm_simulado import crear_modelo_simulado
+
+        modelo = crear_modelo_simulado(
+            latencia=args.latencia,
+            segundos_por_token=args.segundos_por_token,
+            semilla=args.semilla,
+        )
+        agentes.llm = modelo
+        # Sin cascada: las respuestas grabadas siempre son válidas y el modelo fuerte es real
+        agentes.llm_fuerte = None
+
+        resultados = asyncio.run(ejecutar(args, odoo, modelo))
+
+    imprimir(resultados)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as archivo:
+            json.dump(resultados, archivo, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
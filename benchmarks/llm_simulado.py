@@ -0,0 +1,149 @@
+"""
+Modelo de chat simulado para medir el pipeline sin llamar a la API.
+
+Reconoce qué prompt registrado se está usando (extraccion, calificacion, fusionado, resumen)
+comparando el mensaje de sistema, responde con las respuestas grabadas para ese prompt y
+tarda una latencia configurable. Con la misma semilla, los tiempos son reproducibles.
+"""
+
+import asyncio
+import json
+import os
+import random
+import sys
+import threading
+import time
+from typing import Any, Dict, List
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import PrivateAttr
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from airregio_conversacion import contar_tokens  # noqa: E402
+from airregio_prompts import obtener_prompt, versiones_prompts  # noqa: E402
+
+RUTA_RESPUESTAS = os.path.join(os.path.dirname(__file__), "respuestas_grabadas.json")
+
+
+def cargar_respuestas(ruta=RUTA_RESPUESTAS):
+    with open(ruta, encoding="utf-8") as archivo:
+        return json.load(archivo)
+
+
+class ChatModeloSimulado(BaseChatModel):
+    """
+    Args:
+        respuestas (dict): {nombre del prompt: [respuestas]}. Se recorren en orden, en ciclo.
+        latencia (float): Segundos hasta el primer token.
+        segundos_por_token (float): Tiempo de generación por token de salida.
+        variacion (float): Fracción de variación aleatoria de la latencia (0.2 = ±20 %).
+        semilla (int): Semilla del generador aleatorio.
+    """
+
+    respuestas: Dict[str, List[str]]
+    latencia: float = 0.5
+    segundos_por_token: float = 0.01
+    variacion: float = 0.2
+    semilla: int = 0
+    model_name: str = "gpt-4o-mini"
+    temperature: float = 0.2
+
+    _aleatorio: Any = PrivateAttr()
+    _indices: Dict[str, int] = PrivateAttr(default_factory=dict)
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+    _llamadas: List[dict] = PrivateAttr(default_factory=list)
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._aleatorio = random.Random(self.semilla)
+
+    # Registro de cada llamada: prompt, segundos simulados y tokens de entrada y salida
+    @property
+    def llamadas(self):
+        with self._lock:
+            return list(self._llamadas)
+
+    @property
+    def _llm_type(self):
+        return "airregio-simulado"
+
+    # Nombre del prompt registrado cuyo mensaje de sistema coincide
+    def _nombre_prompt(self, messages):
+        sistema = messages[0].content if messages else ""
+        for nombre in versiones_prompts():
+            if obtener_prompt(nombre).sistema == sistema:
+                return nombre
+        return "desconocido"
+
+    # Elige la respuesta y calcula los tiempos antes de simular la espera
+    def _preparar(self, messages):
+        nombre = self._nombre_prompt(messages)
+        with self._lock:
+            opciones = self.respuestas.get(nombre) or ["{}"]
+            indice = self._indices.get(nombre, 0)
+            self._indices[nombre] = indice + 1
+            factor = 1 + self._aleatorio.uniform(-self.variacion, self.variacion)
+
+        contenido = opciones[indice % len(opciones)]
+        tokens_entrada = sum(
+            contar_tokens(str(m.content), self.model_name) for m in messages
+        )
+        tokens_salida = contar_tokens(contenido, self.model_name)
+        segundos = (self.latencia + tokens_salida * self.segundos_por_token) * factor
+
+        with self._lock:
+            self._llamadas.append(
+                {
+                    "prompt": nombre,
+                    "segundos": segundos,
+                    "tokens_entrada": tokens_entrada,
+                    "tokens_salida": tokens_salida,
+                }
+            )
+        uso = {
+            "input_tokens": tokens_entrada,
+            "output_tokens": tokens_salida,
+            "total_tokens": tokens_entrada + tokens_salida,
+        }
+        return contenido, segundos, uso
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        contenido, segundos, uso = self._preparar(messages)
+        time.sleep(segundos)
+        mensaje = AIMessage(content=contenido, usage_metadata=uso)
+        return ChatResult(generations=[ChatGeneration(message=mensaje)])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        contenido, segundos, uso = self._preparar(messages)
+        await asyncio.sleep(segundos)
+        mensaje = AIMessage(content=contenido, usage_metadata=uso)
+        return ChatResult(generations=[ChatGeneration(message=mensaje)])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        contenido, segundos, uso = self._preparar(messages)
+        time.sleep(min(self.latencia, segundos))
+        piezas = [contenido[i : i + 16] for i in range(0, len(contenido), 16)] or [""]
+        pausa = max(segundos - self.latencia, 0) / len(piezas)
+        for numero, pieza in enumerate(piezas):
+            time.sleep(pausa)
+            # El uso de tokens llega en el último fragmento, como con stream_usage en OpenAI
+            yield ChatGenerationChunk(
+                message=AIMessageChunk(
+                    content=pieza,
+                    usage_metadata=uso if numero == len(piezas) - 1 else None,
+                )
+            )
+
+    def reiniciar(self):
+        with self._lock:
+            self._llamadas = []
+            self._indices = {}
+            self._aleatorio = random.Random(self.semilla)
+
+
+def crear_modelo_simulado(ruta_respuestas=RUTA_RESPUESTAS, **kwargs):
+    return ChatModeloSimulado(respuestas=cargar_respuestas(ruta_respuestas), **kwargs)
+
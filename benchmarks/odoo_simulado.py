@@ -0,0 +1,269 @@
+"""
+Servidor XML-RPC local que imita la API de Odoo para crm.lead.
+
+Implementa common.authenticate y object.execute_kw (create, write, search, read,
+search_read y search_count) en memoria, cuenta las llamadas por método y puede agregar una
+latencia fija por llamada. crm.tag, crm.stage y res.users son catálogos fijos de solo
+lectura (search_read). Sirve para medir el pipeline sin escribir en la base real.
+
+Uso:
+    with OdooSimulado(latencia=0.02) as odoo:
+        create_lead_full_data("Lead", "+52 81 1234 5678", url=odoo.url, db=odoo.db,
+                              username=odoo.username, password=odoo.password)
+        print(odoo.contadores)
+"""
+
+import socketserver
+import threading
+import time
+import xmlrpc.client
+from collections import Counter
+from datetime import datetime
+from xmlrpc.server import (
+    MultiPathXMLRPCServer,
+    SimpleXMLRPCDispatcher,
+    SimpleXMLRPCRequestHandler,
+)
+
+
+class _Manejador(SimpleXMLRPCRequestHandler):
+    # HTTP/1.1 para que el cliente pueda reutilizar la conexión como con Odoo real
+    protocol_version = "HTTP/1.1"
+    rpc_paths = ("/xmlrpc/2/common", "/xmlrpc/2/object")
+
+    def log_message(self, formato, *args):
+        pass
+
+
+class _Servidor(socketserver.ThreadingMixIn, MultiPathXMLRPCServer):
+    daemon_threads = True
+
+
+_OPERADORES = {
+    "=": lambda valor, esperado: valor == esperado,
+    "!=": lambda valor, esperado: valor != esperado,
+    ">": lambda valor, esperado: valor is not None and valor > esperado,
+    ">=": lambda valor, esperado: valor is not None and valor >= esperado,
+    "<": lambda valor, esperado: valor is not None and valor < esperado,
+    "<=": lambda valor, esperado: valor is not None and valor <= esperado,
+    "in": lambda valor, esperado: valor in esperado,
+    "not in": lambda valor, esperado: valor not in esperado,
+    "ilike": lambda valor, esperado: bool(valor)
+    and str(esperado).lower() in str(valor).lower(),
+}
+
+
+# Catálogos de solo lectura con los mismos ids que ETIQUETAS_PREDETERMINADAS
+CATALOGOS = {
+    "crm.tag": [
+        {"id": 1, "name": "URGENTE"},
+        {"id": 2, "name": "Mantenimiento"},
+        {"id": 3, "name": "Consulta"},
+        {"id": 4, "name": "Instalación"},
+        {"id": 5, "name": "Otro"},
+    ],
+    "crm.stage": [
+        {"id": 1, "name": "Nuevo", "sequence": 1, "is_won": False, "fold": False},
+        {"id": 2, "name": "Calificado", "sequence": 2, "is_won": False, "fold": False},
+        {"id": 3, "name": "Propuesta", "sequence": 3, "is_won": False, "fold": False},
+        {"id": 4, "name": "Ganado", "sequence": 70, "is_won": True, "fold": False},
+    ],
+    "res.users": [
+        {"id": 2, "name": "Vendedor Benchmark", "login": "bench@airregio.local", "share": False},
+    ],
+}
+
+
+def _cumple_dominio(registro, dominio):
+    # Solo condiciones unidas con AND implícito, que es lo que usa el cliente
+    for campo, operador, esperado in dominio:
+        if not _OPERADORES[operador](registro.get(campo), esperado):
+            return False
+    return True
+
+
+class OdooSimulado:
+    """
+    Base de datos en memoria de crm.lead expuesta por XML-RPC en un puerto local.
+
+    Args:
+        latencia (float): Segundos que tarda cada llamada, para simular la red.
+        db, username, password: Credenciales aceptadas por common.authenticate.
+    """
+
+    def __init__(
+        self,
+        latencia=0.0,
+        db="benchmark",
+        username="bench@airregio.local",
+        password="bench",
+        uid=2,
+    ):
+        self.latencia = latencia
+        self.db = db
+        self.username = username
+        self.password = password
+        self.uid = uid
+
+        self.leads = {}
+        self.contadores = Counter()
+        self._siguiente_id = 1
+        self._lock = threading.Lock()
+        self._servidor = None
+        self._hilo = None
+
+    @property
+    def url(self):
+        host, puerto = self._servidor.server_address[:2]
+        return f"http://{host}:{puerto}"
+
+    def iniciar(self):
+        self._servidor = _Servidor(
+            ("127.0.0.1", 0), requestHandler=_Manejador, allow_none=True, logRequests=False
+        )
+        for ruta, funciones in (
+            ("/xmlrpc/2/common", {"authenticate": self.authenticate, "version": self.version}),
+            ("/xmlrpc/2/object", {"execute_kw": self.execute_kw}),
+        ):
+            dispatcher = SimpleXMLRPCDispatcher(allow_none=True, encoding="utf-8")
+            for nombre, funcion in funciones.items():
+                dispatcher.register_function(funcion, nombre)
+            self._servidor.add_dispatcher(ruta, dispatcher)
+
+        self._hilo = threading.Thread(
+            target=self._servidor.serve_forever, name="odoo-simulado", daemon=True
+        )
+        self._hilo.start()
+        return self
+
+    def detener(self):
+        if self._servidor is not None:
+            self._servidor.shutdown()
+            self._servidor.server_close()
+            self._servidor = None
+
+    def __enter__(self):
+        return self.iniciar()
+
+    def __exit__(self, *exc):
+        self.detener()
+
+    def reiniciar_contadores(self):
+        with self._lock:
+            self.contadores.clear()
+
+    def _contar(self, nombre):
+        with self._lock:
+            self.contadores[nombre] += 1
+        if self.latencia:
+            time.sleep(self.latencia)
+
+    ############################## common ##############################
+
+    def version(self):
+        self._contar("common.version")
+        return {"server_version": "17.0-simulado"}
+
+    def authenticate(self, db, login, password, user_agent_env=None):
+        self._contar("common.authenticate")
+        if (db, login, password) == (self.db, self.username, self.password):
+            return self.uid
+        return False
+
+    ############################## object ##############################
+
+    def execute_kw(self, db, uid, password, model, method, args, kwargs=None):
+        self._contar(f"{model}.{method}")
+        if (db, uid, password) != (self.db, self.uid, self.password):
+            raise xmlrpc.client.Fault(3, "AccessDenied: Access Denied")
+        kwargs = kwargs or {}
+        if model in CATALOGOS and method == "search_read":
+            return self._search_read_catalogo(model, *args, **kwargs)
+        if model != "crm.lead":
+            raise xmlrpc.client.Fault(2, f"Object {model} doesn't exist")
+
+        funcion = getattr(self, f"_{method}", None)
+        if funcion is None:
+            raise xmlrpc.client.Fault(2, f"Method {method} not implemented")
+        with self._lock:
+            return funcion(*args, **kwargs)
+
+    def _ahora(self):
+        # Mismo formato que write_date en Odoo; con microsegundos para que sea estrictamente creciente
+        return datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S.%f")
+
+    def _create(self, valores, **_):
+        lista = valores if isinstance(valores, list) else [valores]
+        ids = []
+        for registro in lista:
+            if not registro.get("name"):
+                raise xmlrpc.client.Fault(2, "ValidationError: name is required")
+            lead_id = self._siguiente_id
+            self._siguiente_id += 1
+            self.leads[lead_id] = {
+                "active": True, **registro, "id": lead_id, "write_date": self._ahora()
+            }
+            ids.append(lead_id)
+        return ids if isinstance(valores, list) else ids[0]
+
+    def _write(self, ids, valores, **_):
+        for lead_id in ids:
+            if lead_id not in self.leads:
+                raise xmlrpc.client.Fault(2, f"MissingError: crm.lead({lead_id}) does not exist")
+        for lead_id in ids:
+            self.leads[lead_id].update(valores, write_date=self._ahora())
+        return True
+
+    # Como en Odoo, los leads archivados sólo aparecen con context={"active_test": False}
+    def _buscar(self, dominio, offset=0, limit=None, order=None, context=None):
+        archivados = not (context or {}).get("active_test", True)
+        registros = [
+            r
+            for r in self.leads.values()
+            if (archivados or r.get("active", True)) and _cumple_dominio(r, dominio)
+        ]
+        if order:
+            for parte in reversed(order.split(",")):
+                campo, _, sentido = parte.strip().partition(" ")
+                registros.sort(
+                    key=lambda r: (r.get(campo) is None, r.get(campo) or 0),
+                    reverse=sentido.strip().lower() == "desc",
+                )
+        else:
+            registros.sort(key=lambda r: r["id"])
+        registros = registros[offset:]
+        if limit:
+            registros = registros[:limit]
+        return registros
+
+    def _proyectar(self, registro, fields):
+        if not fields:
+            return {k: (False if v is None else v) for k, v in registro.items()}
+        return {
+            campo: registro.get(campo, False) if campo != "id" else registro["id"]
+            for campo in ["id", *fields]
+        }
+
+    def _search(self, dominio, offset=0, limit=None, order=None, context=None, **_):
+        return [r["id"] for r in self._buscar(dominio, offset, limit, order, context)]
+
+    def _search_count(self, dominio, context=None, **_):
+        return len(self._buscar(dominio, context=context))
+
+    def _read(self, ids, fields=None, **_):
+        return [self._proyectar(self.leads[i], fields) for i in ids if i in self.leads]
+
+    def _search_read_catalogo(self, model, dominio=None, fields=None, order=None, **_):
+        registros = [r for r in CATALOGOS[model] if _cumple_dominio(r, dominio or [])]
+        if order:
+            campo, _, sentido = order.split(",")[0].strip().partition(" ")
+            registros.sort(key=lambda r: r[campo], reverse=sentido.strip() == "desc")
+        return [self._proyectar(r, fields) for r in registros]
+
+    def _search_read(
+        self, dominio=None, fields=None, offset=0, limit=None, order=None, context=None, **_
+    ):
+        return [
+            self._proyectar(r, fields)
+            for r in self._buscar(dominio or [], offset, limit, order, context)
+        ]
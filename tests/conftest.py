@@ -0,0 +1,64 @@
+"""
+Pruebas del pipeline con el mismo LLM simulado y el mismo Odoo local que los benchmarks
+(benchmarks/llm_simulado.py y benchmarks/odoo_simulado.py).
+
+Uso:
+    python -m pytest -q tests
+"""
+
+import os
+import sys
+
+import pytest
+
+_RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, _RAIZ)
+sys.path.insert(0, os.path.join(_RAIZ, "benchmarks"))
+
+from odoo_simulado import OdooSimulado  # noqa: E402
+
+# Antes de importar el pipeline: el cliente de Odoo toma las credenciales al cargarse, la cache
+# de resultados y el índice de duplicados guardarían respuestas entre pruebas, el limitador
+# frenaría al modelo simulado y la clave de la API no se usa
+_odoo = OdooSimulado().iniciar()
+os.environ.update(
+    ODOO_URL=_odoo.url,
+    ODOO_DB=_odoo.db,
+    ODOO_USERNAME=_odoo.username,
+    ODOO_PASSWORD=_odoo.password,
+    AIRREGIO_CACHE="0",
+    AIRREGIO_LIMITADOR="0",
+    AIRREGIO_DUPLICADOS="0",
+)
+os.environ.setdefault("OPENAI_API_KEY", "sk-pruebas")
+os.environ.setdefault("GROQ_API_KEY", "gsk-pruebas")
+
+
+def pytest_sessionfinish(session, exitstatus):
+    _odoo.detener()
+
+
+@pytest.fixture
+def odoo():
+    """
+    El Odoo simulado de la sesión, sin leads ni contadores de la prueba anterior.
+    """
+    with _odoo._lock:
+        _odoo.leads.clear()
+    _odoo.reiniciar_contadores()
+    return _odoo
+
+
+@pytest.fixture
+def modelo(monkeypatch):
+    """
+    ChatModeloSimulado sin latencia como modelo del pipeline y sin cascada al modelo fuerte.
+    """
+    import airregio_agents_crm_simple as agentes
+    from llm_simulado import crear_modelo_simulado
+
+    simulado = crear_modelo_simulado(latencia=0, segundos_por_token=0, variacion=0)
+    monkeypatch.setattr(agentes, "llm", simulado)
+    monkeypatch.setattr(agentes, "llm_fuerte", None)
+    monkeypatch.setattr(agentes, "llm_respaldo", None)
+    return simulado
@@ -0,0 +1,85 @@
+from airregio_cache import CacheResultados, clave_cache
+
+
+def test_clave_ignora_espacios_y_cambia_con_el_modelo():
+    clave = clave_cache("extraccion", "Hola  mundo\n", "v1", "gpt-4o-mini", 0.2)
+
+    assert clave == clave_cache("extraccion", "Hola mundo", "v1", "gpt-4o-mini", 0.2)
+    assert clave != clave_cache("extraccion", "Hola mundo", "v1", "gpt-4o", 0.2)
+    assert clave != clave_cache("extraccion", "Hola mundo", "v2", "gpt-4o-mini", 0.2)
+
+
+def test_devuelve_copias(tmp_path):
+    cache = CacheResultados(ruta=str(tmp_path / "cache.sqlite3"))
+    cache.guardar("a", {"tag_ids": [1]})
+
+    cache.obtener("a")["tag_ids"].append(2)
+
+    assert cache.obtener("a") == {"tag_ids": [1]}
+
+
+def test_desalojo_en_memoria_y_lectura_desde_disco(tmp_path):
+    cache = CacheResultados(ruta=str(tmp_path / "cache.sqlite3"), max_entradas_memoria=2)
+    for clave in "abc":
+        cache.guardar(clave, {"clave": clave})
+
+    # "a" salió del LRU en memoria pero sigue en disco
+    assert cache.obtener("a") == {"clave": "a"}
+    assert cache.obtener("c") == {"clave": "c"}
+    estadisticas = cache.estadisticas()
+    assert estadisticas["hits_disco"] == 1
+    assert estadisticas["hits_memoria"] == 1
+    assert estadisticas["entradas_memoria"] == 2
+
+
+def test_desalojo_en_disco_de_la_menos_usada(tmp_path):
+    cache = CacheResultados(
+        ruta=str(tmp_path / "cache.sqlite3"), max_entradas_memoria=1, max_entradas_disco=2
+    )
+    cache.guardar("a", 1)
+    cache.guardar("b", 2)
+    cache.obtener("a")
+    cache.guardar("c", 3)
+
+    assert cache.obtener("b") is None
+    assert cache.obtener("a") == 1
+    assert cache.obtener("c") == 3
+    assert cache.estadisticas()["desalojados"] == 1
+
+
+def test_ttl(tmp_path, monkeypatch):
+    ahora = [1000.0]
+    monkeypatch.setattr("airregio_cache.time.time", lambda: ahora[0])
+    cache = CacheResultados(ruta=str(tmp_path / "cache.sqlite3"), ttl_segundos=60)
+    cache.guardar("a", {"score_total": 80})
+
+    ahora[0] += 59
+    assert cache.obtener("a") == {"score_total": 80}
+
+    ahora[0] += 2
+    assert cache.obtener("a") is None
+    # Tampoco queda en disco
+    assert CacheResultados(ruta=cache.ruta, ttl_segundos=None).obtener("a") is None
+
+
+def test_deshabilitada(tmp_path):
+    cache = CacheResultados(ruta=str(tmp_path / "cache.sqlite3"), habilitado=False)
+    cache.guardar("a", 1)
+
+    assert cache.obtener("a") is None
+    assert not (tmp_path / "cache.sqlite3").exists()
+
+
+# La respuesta guardada puede venir del modelo fuerte o del de respaldo
+def test_clave_del_pipeline_incluye_toda_la_cascada(modelo, monkeypatch):
+    import airregio_agents_crm_simple as agentes
+    from llm_simulado import crear_modelo_simulado
+
+    prompt = agentes.PROMPT_EXTRACCION
+    mensajes_llm = prompt.mensajes("[10:15 am, 26/10/2024] Ana: Hola")
+    clave = agentes._clave_cache(prompt, mensajes_llm)
+
+    monkeypatch.setattr(
+        agentes, "llm_fuerte", crear_modelo_simulado(model_name="gpt-4o", latencia=0)
+    )
+    assert agentes._clave_cache(prompt, mensajes_llm) != clave
@@ -0,0 +1,62 @@
+import json
+import os
+
+from airregio_calificacion_local import calificar_local
+
+RUTA_CORPUS = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)), "benchmarks", "conversaciones_muestra.jsonl"
+)
+
+MENSAJES = [
+    {
+        "role": "user",
+        "content": "Hola, quiero impermeabilizar la bodega de mi empresa, son 500 m2, es urgente",
+    },
+    {"role": "assistant", "content": "Claro, ¿nos compartes la dirección?"},
+]
+
+
+def _conversacion(numero=0):
+    with open(RUTA_CORPUS, encoding="utf-8") as archivo:
+        return json.loads(archivo.readlines()[numero])["conversation"]
+
+
+# Regresión: una lista de mensajes llegaba a la calificación local y fallaba con AttributeError
+def test_calificar_lista_de_mensajes(modelo):
+    from airregio_agents_crm_simple import calificar_conversacion
+
+    assert calificar_conversacion(MENSAJES) == {"score_total": 78}
+    assert [llamada["prompt"] for llamada in modelo.llamadas] == ["calificacion"]
+
+
+def test_procesar_lista_de_mensajes(modelo):
+    from airregio_agents_crm_simple import procesar_conversacion
+
+    datos = procesar_conversacion(MENSAJES)
+
+    assert datos["conversation_name"]
+    assert isinstance(datos["score_total"], int)
+
+
+def test_calificacion_local_evita_el_llm(modelo):
+    from airregio_agents_crm_simple import calificar_conversacion
+
+    assert calificar_conversacion(_conversacion()) == {"score_total": 75}
+    assert modelo.llamadas == []
+
+
+def test_negacion_en_la_calificacion_local():
+    base = (
+        "[9:00 am, 01/11/2024] Ana: Hola, quiero impermeabilizar la bodega de mi empresa, "
+        "son 500 m2. {}\n"
+        "[9:01 am, 01/11/2024] Asistente: Claro\n"
+        "[9:02 am, 01/11/2024] Ana: Gracias, me parece bien agendar visita"
+    )
+
+    urgente = calificar_local(base.format("Es urgente."))["factores"]["urgencia"]
+    no_urgente = calificar_local(base.format("No es urgente."))["factores"]["urgencia"]
+    coma = calificar_local(base.format("No, es urgente."))["factores"]["urgencia"]
+
+    assert no_urgente["puntos"] < urgente["puntos"]
+    assert no_urgente["confianza"] <= 0.4
+    assert coma["puntos"] == urgente["puntos"]
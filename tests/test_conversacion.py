@@ -0,0 +1,94 @@
+from datetime import datetime
+
+from airregio_conversacion import (
+    parsear_conversacion,
+    renderizar_compacto,
+)
+
+
+def test_whatsapp_con_corchetes():
+    mensajes = list(
+        parsear_conversacion(
+            "[10:15 am, 26/10/2024] Fernanda: Hola\n"
+            "[1:05 p.m., 26/10/2024] Asistente AIRREGIO: Buenas tardes\n"
+            "[12:10 am, 27/10/2024] Fernanda: Gracias"
+        )
+    )
+
+    assert [(m.rol, m.hablante) for m in mensajes] == [
+        ("user", "Fernanda"),
+        ("assistant", "Asistente AIRREGIO"),
+        ("user", "Fernanda"),
+    ]
+    assert [m.timestamp for m in mensajes] == [
+        datetime(2024, 10, 26, 10, 15),
+        datetime(2024, 10, 26, 13, 5),
+        datetime(2024, 10, 27, 0, 10),
+    ]
+
+
+def test_whatsapp_con_guion_y_lineas_de_continuacion():
+    mensajes = list(
+        parsear_conversacion(
+            "26/10/24, 10:15 - Ana: Hola\nsegunda línea\n26/10/24, 10:16 - Bot: Hola Ana"
+        )
+    )
+
+    assert [(m.rol, m.contenido) for m in mensajes] == [
+        ("user", "Hola\nsegunda línea"),
+        ("assistant", "Hola Ana"),
+    ]
+
+
+def test_correo_sin_encabezados_ni_citas():
+    mensajes = list(
+        parsear_conversacion(
+            "De: Fernanda García <fer@empresa.com>\n"
+            "Enviado: lunes, 28 de octubre de 2024\n"
+            "Para: ventas@airregio.com\n"
+            "Asunto: Cotización\n"
+            "Hola, quiero cotizar.\n"
+            "> texto citado\n"
+            "\n"
+            "De: Asistente AIRREGIO <ventas@airregio.com>\n"
+            "Con gusto."
+        )
+    )
+
+    assert [(m.rol, m.hablante, m.contenido) for m in mensajes] == [
+        ("user", "Fernanda García", "Hola, quiero cotizar."),
+        ("assistant", "Asistente AIRREGIO", "Con gusto."),
+    ]
+
+
+def test_acepta_iterable_de_lineas():
+    lineas = iter(["[10:15 am, 26/10/2024] Ana: Hola\n", "[10:16 am, 26/10/2024] Bot: Hola\n"])
+
+    assert len(list(parsear_conversacion(lineas))) == 2
+
+
+# "bot" dentro de un apellido no convierte al cliente en el asistente
+def test_nombre_que_contiene_una_palabra_del_asistente():
+    mensajes = list(
+        parsear_conversacion(
+            "[10:15 am, 26/10/2024] Jorge Botello: Mi número es 81 1234 5678\n"
+            "[10:16 am, 26/10/2024] Agente AIRREGIO: Gracias, Jorge"
+        )
+    )
+
+    assert [m.rol for m in mensajes] == ["user", "assistant"]
+    assert "Jorge Botello: Mi número es 81 1234 5678" in renderizar_compacto(mensajes)
+
+
+def test_cambio_de_fecha_del_mismo_hablante_va_en_otra_linea():
+    mensajes = parsear_conversacion(
+        "[11:50 pm, 26/10/2024] Ana: Hola\n"
+        "[12:05 am, 27/10/2024] Ana: ¿Siguen ahí?"
+    )
+
+    assert renderizar_compacto(mensajes).splitlines() == [
+        "[26/10/2024]",
+        "23:50 Ana: Hola",
+        "[27/10/2024]",
+        "00:05 Ana: ¿Siguen ahí?",
+    ]
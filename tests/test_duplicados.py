@@ -0,0 +1,104 @@
+import json
+import os
+
+import pytest
+
+from airregio_duplicados import IndiceDuplicados
+
+RUTA_CORPUS = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)), "benchmarks", "conversaciones_muestra.jsonl"
+)
+
+RESULTADO = {
+    "contact_name": "Fernanda",
+    "phone": "+52 81 1234 5678",
+    "email_from": "fernanda.garcia@industrialgarcia.com",
+    "description": "Visita técnica.\n\nFechas mencionadas por el cliente: martes 29/10/2024 10:00.",
+    "score_total": 80,
+}
+
+
+@pytest.fixture(scope="module")
+def corpus():
+    with open(RUTA_CORPUS, encoding="utf-8") as archivo:
+        return [json.loads(linea)["conversation"] for linea in archivo if linea.strip()]
+
+
+# La misma solicitud enviada por otra persona, otro día
+def _copia(conversacion):
+    return (
+        conversacion.replace("Fernanda:", "Lucía:")
+        .replace("81 1234 5678", "33 9876 5432")
+        .replace("fernanda.garcia@industrialgarcia.com", "lucia@otra.com")
+        .replace("26/10/2024", "04/11/2024")
+    )
+
+
+# Misma plantilla con algunos detalles distintos (similitud estimada ≈ 0.84)
+def _parecida(conversacion):
+    return (
+        _copia(conversacion)
+        .replace("500 metros", "800 metros")
+        .replace("lluvias recientes", "lluvias de este año")
+    )
+
+
+def test_copia_reutiliza_el_resultado_con_datos_nuevos(corpus):
+    indice = IndiceDuplicados()
+    indice.agregar(corpus[0], RESULTADO)
+
+    resultado, similitud = indice.buscar(_copia(corpus[0]))
+
+    assert similitud >= 0.9
+    assert resultado["contact_name"] == "Lucía"
+    assert resultado["phone"] == "+52 33 9876 5432"
+    assert resultado["email_from"] == "lucia@otra.com"
+    assert resultado["description"] == (
+        "Visita técnica.\n\nFechas mencionadas por el cliente: martes 05/11/2024 10:00."
+    )
+    assert resultado["score_total"] == 80
+
+
+def test_umbral(corpus):
+    estricto = IndiceDuplicados(umbral=0.9)
+    flexible = IndiceDuplicados(umbral=0.8)
+    for indice in (estricto, flexible):
+        indice.agregar(corpus[0], RESULTADO)
+
+    resultado, similitud = estricto.buscar(_parecida(corpus[0]))
+    assert resultado is None
+    assert 0.8 <= similitud < 0.9
+
+    resultado, _ = flexible.buscar(_parecida(corpus[0]))
+    assert resultado["score_total"] == 80
+
+
+def test_conversacion_distinta_no_coincide(corpus):
+    indice = IndiceDuplicados()
+    indice.agregar(corpus[0], RESULTADO)
+
+    for conversacion in corpus[1:]:
+        assert indice.buscar(conversacion)[0] is None
+
+
+def test_desalojo_de_la_menos_usada(corpus):
+    indice = IndiceDuplicados(max_entradas=2)
+    for numero, conversacion in enumerate(corpus[:2]):
+        indice.agregar(conversacion, {"score_total": numero})
+    indice.buscar(corpus[0])
+    indice.agregar(corpus[2], {"score_total": 2})
+
+    assert indice.buscar(corpus[1])[0] is None
+    assert indice.buscar(corpus[0])[0]["score_total"] == 0
+    assert indice.estadisticas()["desalojados"] == 1
+
+
+def test_conversaciones_cortas_y_listas_no_se_indexan():
+    indice = IndiceDuplicados()
+    corta = "[10:15 am, 26/10/2024] Ana: Hola"
+    mensajes = [{"role": "user", "content": "Hola, quiero impermeabilizar mi techo de 80 m2"}]
+    indice.agregar(corta, RESULTADO)
+    indice.agregar(mensajes, RESULTADO)
+
+    assert indice.estadisticas()["entradas"] == 0
+    assert indice.buscar(mensajes) == (None, 0.0)
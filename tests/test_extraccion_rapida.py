@@ -0,0 +1,100 @@
+from datetime import datetime
+
+import pytest
+
+from airregio_extraccion_rapida import (
+    aplicar_campos_deterministas,
+    buscar_fechas,
+    buscar_telefonos,
+    extraer_campos_deterministas,
+    normalizar_telefono,
+)
+
+# Sábado 26/10/2024
+REFERENCIA = datetime(2024, 10, 26, 10, 15)
+
+CONVERSACION = (
+    "[10:15 am, 26/10/2024] Fernanda: Hola, mi cel es 81 1234 5678 y mi correo "
+    "Fer@Empresa.com.\n"
+    "[10:16 am, 26/10/2024] Asistente: Gracias, mi número es 55 9999 8888\n"
+    "[10:20 am, 26/10/2024] Fernanda: ¿Puede venir el martes a las 10?"
+)
+
+
+@pytest.mark.parametrize(
+    "texto, esperado",
+    [
+        ("+52 1 81 1234 5678", "+52 81 1234 5678"),
+        ("(81) 1234-5678", "+52 81 1234 5678"),
+        ("528112345678", "+52 81 1234 5678"),
+        ("4441234567", "+52 444 123 4567"),
+        ("1234", None),
+        ("81 1234 567", None),
+    ],
+)
+def test_normalizar_telefono(texto, esperado):
+    assert normalizar_telefono(texto) == esperado
+
+
+@pytest.mark.parametrize(
+    "texto, esperadas",
+    [
+        ("el martes a las 10 am", [datetime(2024, 10, 29, 10, 0)]),
+        ("mañana", [datetime(2024, 10, 27)]),
+        ("pasado mañana a las 4 pm", [datetime(2024, 10, 28, 16, 0)]),
+        ("29/10/2024", [datetime(2024, 10, 29)]),
+        ("15 de noviembre", [datetime(2024, 11, 15)]),
+        ("31/02/2024", []),
+        ("el 29/10 a las 3 de la tarde", [datetime(2024, 10, 29, 15, 0)]),
+        ("para el 29/10 a las 8 de la noche", [datetime(2024, 10, 29, 20, 0)]),
+        ("mañana a las 9 de la mañana", [datetime(2024, 10, 27, 9, 0)]),
+        # Un número suelto no es una hora ni una fecha
+        ("son 500 metros", []),
+        # Sin año ni "el", "para", ... una fracción no es una fecha
+        ("tenemos 3/4 de la azotea", []),
+    ],
+)
+def test_buscar_fechas(texto, esperadas):
+    assert buscar_fechas(texto, REFERENCIA) == esperadas
+
+
+@pytest.mark.parametrize(
+    "texto",
+    ["Folio 1234567890", "mi pedido #81 1234 5678", "factura no. 8112345678"],
+)
+def test_buscar_telefonos_ignora_folios(texto):
+    assert buscar_telefonos(texto) == []
+
+
+def test_extraer_campos_solo_de_mensajes_del_usuario():
+    campos = extraer_campos_deterministas(CONVERSACION)
+
+    assert campos["phone"] == "+52 81 1234 5678"
+    assert campos["email_from"] == "fer@empresa.com"
+    assert campos["fechas"] == [datetime(2024, 10, 29, 10, 0)]
+    assert "55 9999 8888" not in campos["texto_usuario"]
+
+
+def test_aplicar_campos_corrige_al_llm():
+    datos = {"phone": "5599998888", "description": "Visita"}
+
+    aplicar_campos_deterministas(datos, extraer_campos_deterministas(CONVERSACION))
+
+    assert datos["phone"] == "+52 81 1234 5678"
+    assert datos["email_from"] == "fer@empresa.com"
+    assert datos["description"].endswith(
+        "Fechas mencionadas por el cliente: martes 29/10/2024 10:00."
+    )
+
+
+# Que las expresiones regulares no encuentren nada no borra lo que extrajo el LLM
+def test_aplicar_campos_conserva_al_llm_sin_valor_determinista():
+    campos = extraer_campos_deterministas(
+        "[10:15 am, 26/10/2024] Ana: Hola, soy ana punto ruiz arroba gmail"
+    )
+    datos = {"phone": "8112345678", "email_from": "ana.ruiz@gmail.com"}
+
+    assert aplicar_campos_deterministas(datos, campos) == {
+        "phone": "+52 81 1234 5678",
+        "email_from": "ana.ruiz@gmail.com",
+    }
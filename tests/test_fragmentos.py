@@ -0,0 +1,43 @@
+from airregio_agents_crm_simple import combinar_datos_parciales
+from airregio_conversacion import contar_tokens, dividir_en_fragmentos, parsear_conversacion
+
+
+def test_fragmentos_no_parten_mensajes():
+    conversacion = "\n".join(
+        f"[10:{i:02d} am, 26/10/2024] {'Ana' if i % 2 else 'Asistente'}: mensaje {i} "
+        + "palabra " * 30
+        for i in range(40)
+    )
+
+    fragmentos = dividir_en_fragmentos(conversacion, max_tokens=300)
+
+    assert len(fragmentos) > 1
+    assert all(contar_tokens(fragmento) <= 300 for fragmento in fragmentos)
+    contenidos = [
+        mensaje.contenido
+        for fragmento in fragmentos
+        for mensaje in parsear_conversacion(fragmento)
+    ]
+    assert contenidos == [m.contenido for m in parsear_conversacion(conversacion)]
+
+
+def test_fragmentos_de_un_solo_mensaje_enorme():
+    fragmentos = dividir_en_fragmentos("palabra " * 2000, max_tokens=200)
+
+    assert len(fragmentos) > 1
+    assert "".join(fragmentos).split() == ["palabra"] * 2000
+
+
+def test_combinar_datos_parciales():
+    datos, descripciones = combinar_datos_parciales(
+        [
+            {"contact_name": "Ana", "tag_ids": [1, 2], "description": "Primera parte"},
+            None,
+            {"contact_name": None, "phone": "81 1234 5678", "tag_ids": [2, 3]},
+            {"contact_name": "Ana López", "description": "Segunda parte"},
+        ]
+    )
+
+    # El fragmento más reciente con valor gana; las etiquetas se unen sin repetir
+    assert datos == {"contact_name": "Ana López", "phone": "81 1234 5678", "tag_ids": [1, 2, 3]}
+    assert descripciones == ["Primera parte", "Segunda parte"]
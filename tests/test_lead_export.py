@@ -0,0 +1,54 @@
+import pytest
+
+from CRM.lead_export import iter_changed_leads
+from CRM.odoo_api_calls import get_client
+
+
+@pytest.fixture
+def cliente(odoo):
+    return get_client(odoo.url, odoo.db, odoo.username, odoo.password)
+
+
+def test_keyset_con_write_date_repetido(odoo, cliente, monkeypatch):
+    # Un write masivo deja varios leads con el mismo write_date
+    monkeypatch.setattr(odoo, "_ahora", lambda: "2026-01-01 00:00:00")
+    ids = cliente.execute_kw("crm.lead", "create", [[{"name": f"L{i}"} for i in range(7)]])
+
+    paginas = list(iter_changed_leads(cliente, fields=["id", "write_date"], page_size=3))
+
+    assert [len(pagina) for pagina in paginas] == [3, 3, 1]
+    assert [lead["id"] for pagina in paginas for lead in pagina] == ids
+
+
+def test_keyset_continua_desde_el_cursor(odoo, cliente, monkeypatch):
+    monkeypatch.setattr(odoo, "_ahora", lambda: "2026-01-01 00:00:00")
+    ids = cliente.execute_kw("crm.lead", "create", [[{"name": f"L{i}"} for i in range(5)]])
+    cursor = ("2026-01-01 00:00:00", ids[2])
+
+    # Los que quedan con el mismo write_date y los que cambiaron después
+    monkeypatch.setattr(odoo, "_ahora", lambda: "2026-01-01 00:00:01")
+    cliente.execute_kw("crm.lead", "write", [[ids[0]], {"name": "L0 editado"}])
+
+    vistos = [
+        lead["id"]
+        for pagina in iter_changed_leads(
+            cliente, cursor=cursor, fields=["id", "write_date"], page_size=2
+        )
+        for lead in pagina
+    ]
+    assert vistos == [ids[3], ids[4], ids[0]]
+
+    cursor = ("2026-01-01 00:00:01", ids[0])
+    assert list(iter_changed_leads(cliente, cursor=cursor, fields=["id"], page_size=2)) == []
+
+
+# Un lead archivado también cambia: la exportación lo incluye salvo que se pida lo contrario
+def test_keyset_incluye_archivados(odoo, cliente):
+    activo, archivado = cliente.execute_kw("crm.lead", "create", [[{"name": "A"}, {"name": "B"}]])
+    cliente.execute_kw("crm.lead", "write", [[archivado], {"active": False}])
+
+    def exportados(**kwargs):
+        return [lead["id"] for pagina in iter_changed_leads(cliente, **kwargs) for lead in pagina]
+
+    assert exportados(fields=["id", "write_date"]) == [activo, archivado]
+    assert exportados(fields=["id", "write_date"], include_archived=False) == [activo]
@@ -0,0 +1,97 @@
+import xmlrpc.client
+
+import pytest
+
+import CRM.lead_index as lead_index
+from CRM.lead_index import LeadIndex, upsert_lead_full_data
+from CRM.odoo_api_calls import get_client
+
+
+@pytest.fixture
+def cliente(odoo, monkeypatch):
+    # Índice compartido nuevo en cada prueba: el de la anterior apunta a leads ya borrados
+    monkeypatch.setattr(lead_index, "_indexes", {})
+    return get_client(odoo.url, odoo.db, odoo.username, odoo.password)
+
+
+def _crear(cliente, *telefonos):
+    return cliente.execute_kw(
+        "crm.lead", "create", [[{"name": f"Lead {t}", "phone": t} for t in telefonos]]
+    )
+
+
+# Escrituras masivas dejan muchos leads con el mismo write_date
+def test_sync_incremental_con_write_date_repetido(odoo, cliente, monkeypatch):
+    monkeypatch.setattr(odoo, "_ahora", lambda: "2026-01-01 00:00:00")
+    ids = _crear(cliente, *(f"811234000{i}" for i in range(5)))
+    indice = LeadIndex(cliente, page_size=2)
+
+    assert indice.sync() == 5 and len(indice) == 5
+
+    monkeypatch.setattr(odoo, "_ahora", lambda: "2026-01-01 00:00:01")
+    cliente.execute_kw("crm.lead", "write", [[ids[0]], {"phone": "8119999999"}])
+
+    assert indice.sync() == 1
+    assert indice.find(phone="+52 1 81 1999 9999") == ids[0]
+    assert indice.find(phone="8112340000") is None
+    assert indice.sync() == 0
+
+
+def test_sync_quita_leads_archivados(odoo, cliente):
+    archivado, activo = _crear(cliente, "8112340000", "8112340001")
+    cliente.execute_kw("crm.lead", "write", [[archivado], {"active": False}])
+    indice = LeadIndex(cliente)
+    indice.sync()
+
+    assert indice.find(phone="8112340000") is None
+
+    cliente.execute_kw("crm.lead", "write", [[activo], {"active": False}])
+    indice.sync()
+
+    assert indice.find(phone="8112340001") is None and len(indice) == 0
+
+
+def test_upsert_actualiza_el_lead_existente(odoo, cliente):
+    (lead_id,) = _crear(cliente, "8112340001")
+
+    assert upsert_lead_full_data("Nuevo nombre", "81 1234 0001") == lead_id
+    assert odoo.leads[lead_id]["name"] == "Nuevo nombre"
+    assert odoo.contadores["crm.lead.create"] == 1
+
+
+def test_upsert_no_escribe_en_un_lead_archivado(odoo, cliente):
+    (lead_id,) = _crear(cliente, "8112340001")
+    lead_index.get_lead_index().sync()
+    cliente.execute_kw("crm.lead", "write", [[lead_id], {"active": False}])
+    lead_index.get_lead_index()._last_sync = None
+
+    nuevo = upsert_lead_full_data("Otra vez", "8112340001")
+
+    assert nuevo != lead_id
+    assert odoo.leads[lead_id]["name"] == "Lead 8112340001"
+
+
+def test_upsert_crea_si_el_lead_fue_borrado(odoo, cliente):
+    (lead_id,) = _crear(cliente, "8112340001")
+    lead_index.get_lead_index().sync()
+    with odoo._lock:
+        del odoo.leads[lead_id]
+
+    nuevo = upsert_lead_full_data("Otra vez", "8112340001")
+
+    assert nuevo is not None and nuevo != lead_id
+    assert list(odoo.leads) == [nuevo]
+
+
+# Cualquier otro error pudo haber dejado el lead actualizado: crear otro lo duplicaría
+def test_upsert_no_crea_ante_otros_errores(odoo, cliente, monkeypatch):
+    _crear(cliente, "8112340001")
+
+    def falla(*args, **kwargs):
+        raise xmlrpc.client.Fault(1, "ValidationError: boom")
+
+    monkeypatch.setattr(odoo, "_write", falla)
+
+    with pytest.raises(xmlrpc.client.Fault):
+        upsert_lead_full_data("Otra vez", "8112340001")
+    assert len(odoo.leads) == 1
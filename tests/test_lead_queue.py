@@ -0,0 +1,93 @@
+import pytest
+
+import CRM.lead_queue as lead_queue
+from CRM.lead_queue import LeadQueue
+from CRM.odoo_api_calls import OdooClient, create_leads_bulk
+
+
+@pytest.fixture
+def cola(tmp_path):
+    # Sin hilo de fondo: cada prueba llama a process_once
+    return LeadQueue(path=str(tmp_path / "cola.sqlite3"), base_delay=0, max_attempts=2)
+
+
+def test_envio_y_clave_de_idempotencia(odoo, cola):
+    lead = {"lead_name": "Bodega 500 m2", "phone_number_id": "+52 81 1234 5678"}
+    clave = cola.enqueue(lead)
+
+    # El mismo lead dos veces (doble clic en "Enviar a CRM") es un solo envío
+    assert cola.enqueue(dict(lead)) == clave
+    assert cola.process_once() == 1
+    assert cola.process_once() == 0
+
+    envio = cola.get(clave)
+    assert envio["status"] == "done"
+    assert envio["attempts"] == 1
+    assert odoo.leads[envio["lead_id"]]["name"] == "Bodega 500 m2"
+    assert odoo.contadores["crm.lead.create"] == 1
+
+
+def test_reintentos_hasta_fallar_y_retry(odoo, cola):
+    # Odoo rechaza un lead sin nombre
+    clave = cola.enqueue({"lead_name": "", "phone_number_id": "8112345678"})
+
+    cola.process_once()
+    envio = cola.get(clave)
+    assert envio["status"] == "pending"
+    assert envio["attempts"] == 1
+    assert "name is required" in envio["error"]
+
+    cola.process_once()
+    assert cola.get(clave)["status"] == "failed"
+    assert cola.status()["counts"]["failed"] == 1
+
+    assert cola.retry(clave)
+    envio = cola.get(clave)
+    assert (envio["status"], envio["attempts"]) == ("pending", 0)
+    assert not cola.retry(clave)  # Solo se reintentan los fallidos
+
+
+def test_envios_interrumpidos_vuelven_a_la_cola(odoo, cola):
+    clave = cola.enqueue({"lead_name": "Techo", "phone_number_id": "8112345678"})
+    assert len(cola._claim()) == 1
+    assert cola.get(clave)["status"] == "sending"
+
+    # Otro proceso abre la misma base después de una caída
+    reiniciada = LeadQueue(path=cola.path, base_delay=0)
+    assert reiniciada.get(clave)["status"] == "pending"
+    assert reiniciada.process_once() == 1
+    assert reiniciada.get(clave)["status"] == "done"
+
+
+# Odoo guardó el lote y se cortó la conexión antes de responder: reintentar lo duplicaría
+@pytest.mark.parametrize("falla_dentro_del_envio", [True, False])
+def test_create_sin_confirmar_no_se_reintenta(odoo, cola, monkeypatch, falla_dentro_del_envio):
+    if falla_dentro_del_envio:
+        original = OdooClient.create_leads
+
+        def crear_y_cortar(self, values_list):
+            original(self, values_list)
+            raise ConnectionResetError("connection reset by peer")
+
+        monkeypatch.setattr(OdooClient, "create_leads", crear_y_cortar)
+    else:
+
+        def crear_y_fallar(records):
+            create_leads_bulk(records)
+            raise TimeoutError("timed out")
+
+        monkeypatch.setattr(lead_queue, "create_leads_bulk", crear_y_fallar)
+
+    clave = cola.enqueue({"lead_name": "Techo", "phone_number_id": "8112345678"})
+
+    assert cola.process_once() == 1
+    assert cola.process_once() == 0
+    assert cola.get(clave)["status"] == "unknown"
+    assert len(odoo.leads) == 1
+    estado = cola.status()
+    assert estado["counts"]["unknown"] == 1
+    assert [envio["idempotency_key"] for envio in estado["items"]] == [clave]
+
+    # Solo a mano, después de revisar Odoo
+    assert cola.retry(clave)
+    assert cola.get(clave)["status"] == "pending"
@@ -0,0 +1,146 @@
+import socket
+import threading
+import xmlrpc.client
+
+import pytest
+
+from CRM.odoo_api_calls import OdooClient, create_leads_bulk, update_leads_bulk
+
+
+class _ServidorCrudo:
+    """
+    Servidor XML-RPC mínimo sobre sockets para simular conexiones que se cortan.
+
+    `accion(metodo, numero_en_la_conexion)` devuelve None (responder), "cerrar" (cerrar sin
+    responder) o "reset" (cortar con RST) después de leer la petición completa.
+    """
+
+    def __init__(self, accion):
+        self.accion = accion
+        self.llamadas = []
+        self._socket = socket.socket()
+        self._socket.bind(("127.0.0.1", 0))
+        self._socket.listen(8)
+        threading.Thread(target=self._aceptar, daemon=True).start()
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:{}".format(self._socket.getsockname()[1])
+
+    def _aceptar(self):
+        while True:
+            conexion, _ = self._socket.accept()
+            threading.Thread(target=self._atender, args=(conexion,), daemon=True).start()
+
+    def _atender(self, conexion):
+        numero = 0
+        while True:
+            datos = b""
+            while b"</methodCall>" not in datos:
+                parte = conexion.recv(65536)
+                if not parte:
+                    conexion.close()
+                    return
+                datos += parte
+            numero += 1
+            params, nombre = xmlrpc.client.loads(datos[datos.index(b"<?xml") :])
+            metodo = nombre if nombre == "authenticate" else params[4]
+            self.llamadas.append(metodo)
+
+            accion = self.accion(metodo, numero)
+            if accion == "reset":
+                conexion.setsockopt(
+                    socket.SOL_SOCKET, socket.SO_LINGER, b"\x01\x00\x00\x00\x00\x00\x00\x00"
+                )
+            if accion in ("cerrar", "reset"):
+                conexion.close()
+                return
+            cuerpo = xmlrpc.client.dumps(
+                (2 if metodo == "authenticate" else 7,), methodresponse=True
+            ).encode()
+            conexion.sendall(
+                b"HTTP/1.1 200 OK\r\nContent-Type: text/xml\r\nContent-Length: %d\r\n\r\n"
+                % len(cuerpo)
+                + cuerpo
+            )
+
+
+def _cliente(servidor):
+    return OdooClient(servidor.url, "db", "usuario", "clave", pool_size=1, timeout=5)
+
+
+# Odoo cerró la conexión keep-alive mientras estaba inactiva: no llegó a ejecutar el create
+def test_reintenta_conexion_keep_alive_vencida():
+    servidor = _ServidorCrudo(lambda metodo, numero: "cerrar" if numero == 2 else None)
+
+    assert _cliente(servidor).execute_kw("crm.lead", "create", [{"name": "x"}]) == 7
+    assert servidor.llamadas == ["authenticate", "create", "create"]
+
+
+# El create llegó completo y la conexión se cortó sin respuesta: Odoo pudo haberlo guardado
+def test_no_repite_create_ambiguo():
+    servidor = _ServidorCrudo(lambda metodo, numero: "reset" if metodo == "create" else None)
+
+    with pytest.raises(ConnectionError):
+        _cliente(servidor).execute_kw("crm.lead", "create", [{"name": "x"}])
+    assert servidor.llamadas == ["authenticate", "create"]
+
+
+def test_repite_lectura_ambigua():
+    fallos = []
+
+    def accion(metodo, numero):
+        if metodo == "search_read" and not fallos:
+            fallos.append(metodo)
+            return "reset"
+        return None
+
+    servidor = _ServidorCrudo(accion)
+
+    assert _cliente(servidor).execute_kw("crm.lead", "search_read", [[]]) == 7
+    assert servidor.llamadas == ["authenticate", "search_read", "search_read"]
+
+
+def _registro(nombre):
+    return {"lead_name": nombre, "phone_number_id": "8112345678"}
+
+
+# Odoo rechaza el lote por un registro inválido: el resto se crea uno por uno
+def test_create_bulk_separa_el_lote_rechazado(odoo):
+    resultados = create_leads_bulk([_registro(""), _registro("Lead A"), _registro("Lead B")])
+
+    assert resultados[0]["id"] is None and "name is required" in resultados[0]["error"]
+    assert [resultados[i]["error"] for i in (1, 2)] == [None, None]
+    assert sorted(lead["name"] for lead in odoo.leads.values()) == ["Lead A", "Lead B"]
+
+
+# El lote llegó a Odoo y se cortó la conexión: no se reenvía para no duplicar los leads
+def test_create_bulk_no_reenvia_tras_error_de_conexion(odoo, monkeypatch):
+    original = OdooClient.create_leads
+
+    def crear_y_cortar(self, values_list):
+        original(self, values_list)
+        raise ConnectionResetError("connection reset by peer")
+
+    monkeypatch.setattr(OdooClient, "create_leads", crear_y_cortar)
+    resultados = create_leads_bulk([_registro("Lead A"), _registro("Lead B")])
+
+    assert all(r["id"] is None and r["unknown"] for r in resultados.values())
+    assert odoo.contadores["crm.lead.create"] == 1
+    assert len(odoo.leads) == 2
+
+
+def test_update_bulk_no_reenvia_tras_error_de_conexion(odoo, monkeypatch):
+    ids = [resultado["id"] for resultado in create_leads_bulk([_registro("A"), _registro("B")]).values()]
+
+    llamadas = []
+
+    def cortar(self, lead_ids, values):
+        llamadas.append(list(lead_ids))
+        raise ConnectionResetError("connection reset by peer")
+
+    monkeypatch.setattr(OdooClient, "write_leads", cortar)
+    resultados = update_leads_bulk([{"lead_id": lead_id, "priority": "2"} for lead_id in ids])
+
+    assert [resultados[lead_id]["ok"] for lead_id in ids] == [False, False]
+    assert llamadas == [ids]
@@ -0,0 +1,37 @@
+import pytest
+
+import airregio_agents_crm_simple as agentes
+from CRM.odoo_api_calls import get_client
+from CRM.reference_data import ReferenceData
+
+
+@pytest.fixture
+def referencias(odoo, monkeypatch):
+    referencias = ReferenceData(get_client(odoo.url, odoo.db, odoo.username, odoo.password))
+    referencias.load()
+    monkeypatch.setattr(agentes, "_referencias", referencias)
+    return referencias
+
+
+def test_datos_a_lead_valida_contra_odoo(referencias, monkeypatch):
+    lead = agentes.datos_a_lead({"tag_ids": [1, 9, 1, 3], "stage_id": 99, "user_id": 7})
+
+    assert lead["tag_ids"] == [1, 3]
+    assert lead["stage_id"] == 1  # Etapa desconocida: la primera abierta
+    assert lead["user_id"] is None
+
+    lead = agentes.datos_a_lead({"stage_id": 2, "user_id": 2})
+    assert (lead["stage_id"], lead["user_id"]) == (2, 2)
+
+    monkeypatch.setattr(agentes, "VENDEDOR_PREDETERMINADO", 2)
+    assert agentes.datos_a_lead({})["user_id"] == 2
+
+
+# Sin datos de Odoo solo pasan las etiquetas del prompt predeterminado
+def test_datos_a_lead_sin_referencias(monkeypatch):
+    monkeypatch.setattr(agentes, "USAR_REFERENCIAS_ODOO", False)
+
+    lead = agentes.datos_a_lead({"tag_ids": [5, 6], "stage_id": 2, "user_id": 2})
+
+    assert lead["tag_ids"] == [5]
+    assert (lead["stage_id"], lead["user_id"]) == (None, None)